@@ -1,10 +1,25 @@
+import atexit
+import base64
+import csv
+import io
 import json
-from flask import Flask, jsonify, render_template, request, abort
+import logging
+import math
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask, Response, g, has_request_context, jsonify, render_template, request, abort
+from flask.json.provider import DefaultJSONProvider
 import mysql.connector
 from mysql.connector import errorcode
 import random # For dummy coordinates
 from datetime import date, datetime
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
 app = Flask(__name__)
 
@@ -16,13 +31,356 @@ db_config = {
     'database': 'mediquick'
 }
 
+# --- CONNECTION POOL SETTINGS ---
+db_pool_config = {
+    'pool_size': 10,          # Max open connections per worker process
+    'checkout_timeout': 5,    # Seconds to wait for a free connection before failing the request
+    'recycle_seconds': 1800,  # Reopen connections older than this (stays under MySQL's wait_timeout)
+    'ping_on_borrow': True    # Health-check idle connections before handing them out
+}
+
+class PooledConnection:
+    """
+    Wraps a real MySQL connection borrowed from the pool.
+    Behaves exactly like the connection, except close() returns it to the pool.
+    """
+    def __init__(self, pool, raw_conn, created_at):
+        self._pool = pool
+        self._conn = raw_conn
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        raw_cursor = self._conn.cursor(*args, **kwargs)
+        return InstrumentedCursor(raw_cursor) if metrics_config['enabled'] else raw_cursor
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn, self._created_at)
+            self._conn = None
+
+    def discard(self):
+        """Closes the real connection instead of pooling it (e.g. it still holds session state)."""
+        if self._conn is not None:
+            self._pool.discard(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    """
+    Fixed-size pool of MySQL connections shared by all request threads of a process.
+    Idle connections are reused newest-first, pinged before reuse and recycled once stale.
+    """
+    def __init__(self, config, pool_size=10, checkout_timeout=5, recycle_seconds=1800, ping_on_borrow=True):
+        self.config = config
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+        self.recycle_seconds = recycle_seconds
+        self.ping_on_borrow = ping_on_borrow
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _open(self):
+        return mysql.connector.connect(**self.config), time.time()
+
+    def _discard(self, raw_conn):
+        try:
+            raw_conn.close()
+        except mysql.connector.Error:
+            pass
+
+    def acquire(self):
+        """Borrows a connection, waiting up to checkout_timeout seconds for a free slot."""
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise mysql.connector.errors.PoolError(
+                f"No free connection in pool after {self.checkout_timeout}s (pool_size={self.pool_size})"
+            )
+        try:
+            try:
+                raw_conn, created_at = self._idle.get_nowait()
+            except queue.Empty:
+                raw_conn, created_at = self._open()
+            else:
+                if time.time() - created_at > self.recycle_seconds:
+                    self._discard(raw_conn)
+                    raw_conn, created_at = self._open()
+                elif self.ping_on_borrow:
+                    try:
+                        raw_conn.ping(reconnect=False)
+                    except mysql.connector.Error:
+                        self._discard(raw_conn)
+                        raw_conn, created_at = self._open()
+            return PooledConnection(self, raw_conn, created_at)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, raw_conn, created_at):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        try:
+            if raw_conn.unread_result:
+                raw_conn.consume_results()
+            if raw_conn.in_transaction:
+                raw_conn.rollback()
+            self._idle.put((raw_conn, created_at))
+        except mysql.connector.Error:
+            self._discard(raw_conn)
+        finally:
+            self._slots.release()
+
+    def discard(self, raw_conn):
+        """Closes a borrowed connection for good and frees its slot."""
+        try:
+            self._discard(raw_conn)
+        finally:
+            self._slots.release()
+
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Returns this process's pool, creating it on first use (and again after a fork)."""
+    global _db_pool, _db_pool_pid
+    if _db_pool is None or _db_pool_pid != os.getpid():
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool_pid != os.getpid():
+                _db_pool = ConnectionPool(db_config, **db_pool_config)
+                _db_pool_pid = os.getpid()
+    return _db_pool
+
 def get_db_connection():
+    started = time.perf_counter()
     try:
-        conn = mysql.connector.connect(**db_config)
+        conn = get_db_pool().acquire()
         return conn
     except mysql.connector.Error as err:
         print(f"Error connecting to database: {err}")
         return None
+    finally:
+        metrics.observe('db_connect_ms', current_route(), elapsed_ms(started))
+
+# --- METRICS ---
+metrics_config = {
+    'enabled': True,
+    'slow_query_ms': 200,       # Statements at least this slow go to the slow-query log (None = off)
+    'log_query_params': False   # Include bound parameters in slow-query log lines
+}
+
+METRIC_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+slow_query_log = logging.getLogger('mediquick.slow_queries')
+
+class Metrics:
+    """
+    Latency histograms for this worker process, kept in memory.
+    Each metric has one series per label (a route or a procedure name)
+    with fixed millisecond buckets, so recording is a lock and a few adds.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._series = defaultdict(dict)  # metric -> label -> [count, sum, max, bucket counts...]
+        self._counters = defaultdict(lambda: defaultdict(int))  # metric -> label -> count
+        self._lock = threading.Lock()
+
+    def observe(self, metric, label, ms):
+        if not metrics_config['enabled']:
+            return
+        with self._lock:
+            series = self._series[metric].get(label)
+            if series is None:
+                series = self._series[metric][label] = [0, 0.0, 0.0] + [0] * (len(self.buckets) + 1)
+            series[0] += 1
+            series[1] += ms
+            series[2] = max(series[2], ms)
+            for i, bound in enumerate(self.buckets):
+                if ms <= bound:
+                    series[3 + i] += 1
+                    break
+            else:
+                series[-1] += 1
+
+    def count(self, metric, label):
+        if metrics_config['enabled']:
+            with self._lock:
+                self._counters[metric][label] += 1
+
+    def _percentile(self, series, fraction):
+        """Upper bound of the bucket holding the given fraction of observations."""
+        target = series[0] * fraction
+        seen = 0
+        for bound, hits in zip(self.buckets, series[3:]):
+            seen += hits
+            if seen >= target:
+                return min(bound, series[2])
+        return series[2]
+
+    def snapshot(self):
+        with self._lock:
+            series_copy = {metric: {label: list(s) for label, s in by_label.items()}
+                           for metric, by_label in self._series.items()}
+            counters = {metric: dict(by_label) for metric, by_label in self._counters.items()}
+
+        histograms = {}
+        for metric, by_label in series_copy.items():
+            histograms[metric] = {
+                label: {
+                    "count": s[0],
+                    "sum_ms": round(s[1], 3),
+                    "max_ms": round(s[2], 3),
+                    "p50_ms": round(self._percentile(s, 0.50), 3),
+                    "p95_ms": round(self._percentile(s, 0.95), 3),
+                    "p99_ms": round(self._percentile(s, 0.99), 3)
+                }
+                for label, s in sorted(by_label.items())
+            }
+        return {"histograms": histograms, "counters": counters}
+
+    def prometheus(self):
+        """The same data in the Prometheus text exposition format."""
+        with self._lock:
+            series_copy = {metric: {label: list(s) for label, s in by_label.items()}
+                           for metric, by_label in self._series.items()}
+            counters = {metric: dict(by_label) for metric, by_label in self._counters.items()}
+
+        def quote(label):
+            return label.replace('\\', '\\\\').replace('"', '\\"')
+
+        lines = []
+        for metric, by_label in sorted(series_copy.items()):
+            lines.append(f"# TYPE mediquick_{metric} histogram")
+            for label, s in sorted(by_label.items()):
+                cumulative = 0
+                for bound, hits in zip(self.buckets + ('+Inf',), s[3:]):
+                    cumulative += hits
+                    lines.append(f'mediquick_{metric}_bucket{{label="{quote(label)}",le="{bound}"}} {cumulative}')
+                lines.append(f'mediquick_{metric}_sum{{label="{quote(label)}"}} {s[1]:.3f}')
+                lines.append(f'mediquick_{metric}_count{{label="{quote(label)}"}} {s[0]}')
+        for metric, by_label in sorted(counters.items()):
+            lines.append(f"# TYPE mediquick_{metric} counter")
+            for label, value in sorted(by_label.items()):
+                lines.append(f'mediquick_{metric}{{label="{quote(label)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self._counters.clear()
+
+metrics = Metrics(METRIC_BUCKETS_MS)
+
+def elapsed_ms(started):
+    return (time.perf_counter() - started) * 1000
+
+def current_route():
+    """Label for the code path being timed: "METHOD /rule" inside a request, else "background"."""
+    if has_request_context() and request.url_rule is not None:
+        return f"{request.method} {request.url_rule.rule}"
+    return 'background'
+
+def log_slow_statement(kind, statement, params, ms, route=None):
+    threshold = metrics_config['slow_query_ms']
+    if threshold is None or ms < threshold:
+        return
+    text = ' '.join(str(statement).split())
+    if len(text) > 500:
+        text = text[:500] + '...'
+    message = f"{ms:.1f} ms {kind} [{route or current_route()}] {text}"
+    if metrics_config['log_query_params'] and params:
+        message += f" params={params!r}"
+    slow_query_log.warning(message)
+
+class InstrumentedCursor:
+    """
+    Wraps a mysql-connector cursor, timing execute/callproc and fetches into
+    `metrics` (labelled by route, or by procedure name for callproc) and
+    logging slow statements. Anything else is passed straight through.
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            ms = elapsed_ms(started)
+            metrics.observe('db_execute_ms', current_route(), ms)
+            log_slow_statement('query', operation, params, ms)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            ms = elapsed_ms(started)
+            metrics.observe('db_execute_ms', current_route(), ms)
+            log_slow_statement('batch', operation, None, ms)
+
+    def callproc(self, procname, args=()):
+        started = time.perf_counter()
+        try:
+            return self._cursor.callproc(procname, args)
+        finally:
+            ms = elapsed_ms(started)
+            metrics.observe('procedure_ms', procname, ms)
+            log_slow_statement('procedure', procname, args, ms)
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            metrics.observe('db_fetch_ms', current_route(), elapsed_ms(started))
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed_fetch(self._cursor.fetchall)
+
+    def fetchmany(self, size=1):
+        return self._timed_fetch(self._cursor.fetchmany, size)
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with jsonify() serialization time recorded per route."""
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            metrics.observe('json_ms', current_route(), elapsed_ms(started))
+
+app.json = TimedJSONProvider(app)
+
+def dump_json(obj):
+    """json.dumps with json_serializer (ISO dates, Decimals), timed like jsonify()."""
+    started = time.perf_counter()
+    try:
+        return json.dumps(obj, default=json_serializer)
+    finally:
+        metrics.observe('json_ms', current_route(), elapsed_ms(started))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Streamed responses are timed to the first byte, not the last
+        route = current_route() if request.url_rule is not None else f"{request.method} <unmatched>"
+        metrics.observe('request_ms', route, elapsed_ms(started))
+        metrics.count('responses', f"{route} {response.status_code}")
+    return response
 
 def create_mysql_user_with_role(username, password, role_type, cursor):
     """
@@ -118,6 +476,698 @@ def run_query(query, params=None, fetch_one=False, dictionary=True):
         cursor.close()
         conn.close()
 
+# --- CHECKOUT RETRY ---
+checkout_retry_config = {
+    'max_attempts': 3,       # Total tries for one checkout
+    'backoff_seconds': 0.05  # Base wait, grows per attempt (with jitter)
+}
+RETRYABLE_LOCK_ERRORS = (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
+# --- READ CACHE ---
+read_cache_config = {
+    'max_entries': 1024,  # LRU bound across all cached queries
+    'default_ttl': 30     # Seconds, for names not listed in read_cache_ttls
+}
+read_cache_ttls = {
+    'medicines': 60,       # Catalogue search (/api/medicines GET)
+    'pharmacy_stock': 30,  # Pharmacy stock lists
+    'reports': 300         # /api/reports
+}
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache whose entries also expire after a TTL.
+    Keys are tuples whose first element is the query name, so all entries for
+    a name can be invalidated together. Another backend (e.g. Redis) can be
+    plugged in by assigning an object with the same methods to read_cache
+    (asgi.py looks it up on this module, so it picks up the swap too).
+    """
+    def __init__(self, max_entries=1024, default_ttl=30):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._generations = defaultdict(int)
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (True, value) on a hit, (False, None) on a miss or expired entry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses[key[0]] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._hits[key[0]] += 1
+            return True, entry[1]
+
+    def generation(self, name):
+        """Bumped by invalidate(); read it before running the query you will set()."""
+        with self._lock:
+            return self._generations[name]
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Stores value unless key's name was invalidated since `generation` was read."""
+        with self._lock:
+            if generation is not None and generation != self._generations[key[0]]:
+                return  # A write landed while we were querying; don't cache stale rows
+            self._entries[key] = (time.monotonic() + (ttl or self.default_ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *names):
+        """Drops every entry for the given query names."""
+        with self._lock:
+            for name in names:
+                self._generations[name] += 1
+            for key in [k for k in self._entries if k[0] in names]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            names = set(self._hits) | set(self._misses)
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": sum(self._hits.values()),
+                "misses": sum(self._misses.values()),
+                "by_name": {
+                    name: {"hits": self._hits[name], "misses": self._misses[name]}
+                    for name in sorted(names)
+                }
+            }
+
+read_cache = TTLCache(**read_cache_config)
+
+def cached_result(name, query, params=None, fetch_one=False):
+    """Looks up what cached_query would return without running it. Returns (hit, results)."""
+    return read_cache.get((name, query, tuple(params or ()), fetch_one))
+
+def cached_query(name, query, params=None, fetch_one=False):
+    """
+    run_query through read_cache. `name` groups entries so write routes can
+    invalidate them with read_cache.invalidate(name). Errors are not cached.
+    """
+    key = (name, query, tuple(params or ()), fetch_one)
+    hit, results = read_cache.get(key)
+    if hit:
+        return results, None
+
+    generation = read_cache.generation(name)
+    results, err = run_query(query, params, fetch_one=fetch_one)
+    if not err:
+        read_cache.set(key, results, ttl=read_cache_ttls.get(name), generation=generation)
+    return results, err
+
+# --- Helpers for Streaming Large Results ---
+STREAM_BATCH_SIZE = 500  # Rows pulled from MySQL (and written to the client) per chunk
+
+def run_query_streamed(query, params=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Streaming counterpart of run_query for big SELECTs.
+    Returns (RowBatches, err). The query runs and the first batch is fetched
+    before returning, so SQL errors surface the normal way. The connection
+    stays checked out until the batches are exhausted or closed.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None, "DB connection failed"
+
+    cursor = conn.cursor(dictionary=True)  # unbuffered: rows stay on the server until fetched
+    try:
+        cursor.execute(query, params or ())
+        first_batch = cursor.fetchmany(batch_size)
+    except mysql.connector.Error as err:
+        cursor.close()
+        conn.close()
+        return None, err
+
+    return RowBatches(conn, cursor, first_batch, batch_size), None
+
+class RowBatches:
+    """
+    Row batches from an open unbuffered cursor (see run_query_streamed).
+    close() hands the connection back to the pool. It runs when iteration
+    ends and is safe to call again, so responses also register it with
+    call_on_close: a generator's finally never runs if the body is not
+    iterated at all (client gone before the first chunk).
+    """
+    def __init__(self, conn, cursor, first_batch, batch_size):
+        self._conn = conn
+        self._cursor = cursor
+        self._first_batch = first_batch
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            batch, self._first_batch = self._first_batch, None
+            while batch:
+                yield batch
+                batch = self._cursor.fetchmany(self._batch_size)
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            conn, cursor = self._conn, self._cursor
+            self._conn = self._cursor = None
+        if conn is None:
+            return
+        try:
+            # Client may have disconnected mid-stream; drain before reuse
+            if conn.unread_result:
+                conn.consume_results()
+            cursor.close()
+        except mysql.connector.Error as err:
+            print(f"Warning: Could not drain streamed query: {err}")
+        finally:
+            conn.close()
+
+def stream_json(batches, route=None):
+    """
+    Yields a JSON array one batch of rows at a time (uses json_serializer for
+    dates/Decimals). Serialization time is recorded under route, since the
+    request context is gone by the time the body is generated.
+    """
+    yield '['
+    first = True
+    for batch in batches:
+        started = time.perf_counter()
+        chunk = ','.join(json.dumps(row, default=json_serializer) for row in batch)
+        metrics.observe('json_ms', route or 'background', elapsed_ms(started))
+        yield chunk if first else ',' + chunk
+        first = False
+    yield ']'
+
+def streamed_response(query, params=None):
+    """Runs a SELECT and streams its rows back as a JSON array response."""
+    batches, err = run_query_streamed(query, params)
+    if err:
+        return jsonify({"error": str(err)}), 500
+    response = Response(stream_json(batches, current_route()), mimetype='application/json')
+    response.call_on_close(batches.close)
+    return response
+
+# --- Helpers for Paging and Catalogue Search ---
+def get_int_arg(name, default, minimum=0, args=None):
+    """
+    Reads an integer query-string argument (from request.args unless another
+    mapping is given). Raises ValueError if malformed or below minimum.
+    """
+    args = request.args if args is None else args
+    try:
+        value = int(args.get(name, default))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    return value
+
+def encode_cursor(sort_key):
+    """Packs the sort key of the last row on a page into an opaque ?cursor= token."""
+    raw = json.dumps(list(sort_key), default=json_serializer).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(token, key_size):
+    """Reverses encode_cursor. Raises ValueError if the token was not issued by us."""
+    try:
+        sort_key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(sort_key, list) or len(sort_key) != key_size:
+        raise ValueError("Invalid cursor")
+    return sort_key
+
+def get_page_args(key_size, default_limit=50, max_limit=200, args=None):
+    """
+    Reads ?limit= and ?cursor= for keyset-paged list endpoints.
+    Returns (limit, cursor) where cursor is the sort key of the last row the
+    client already has, or None for the first page.
+    """
+    args = request.args if args is None else args
+    limit = get_int_arg('limit', default_limit, minimum=1, args=args)
+    token = args.get('cursor')
+    cursor = decode_cursor(token, key_size) if token else None
+    return min(limit, max_limit), cursor
+
+def split_page(rows, limit, sort_key):
+    """
+    Trims a result fetched with LIMIT limit + 1 back to one page.
+    If the look-ahead row was there, returns an X-Next-Cursor header
+    pointing just past the last row sent.
+    """
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(sort_key(rows[-1]))
+    return rows, headers
+
+# Must match the server's innodb_ft_min_token_size and its stopword table
+# (INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD unless configured otherwise)
+fulltext_config = {
+    'min_token_size': 3,
+    'stopwords': frozenset([
+        'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from', 'how',
+        'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what',
+        'when', 'where', 'who', 'will', 'with', 'und', 'www'
+    ])
+}
+
+def build_fulltext_query(search_text):
+    """
+    Turns free text typed by the user into a BOOLEAN MODE prefix query,
+    e.g. 'para tab' -> '+para* +tab*'. Every word must match (as a prefix).
+    Operators typed by the user are dropped so they can't break the query.
+    Returns '' when some word is too short or a stopword: the FULLTEXT index
+    never holds those, so the caller falls back to a med_name prefix match.
+    """
+    words = re.findall(r'\w+', search_text)
+    if any(len(word) < fulltext_config['min_token_size'] or word.lower() in fulltext_config['stopwords']
+           for word in words):
+        return ''
+    return ' '.join(f'+{word}*' for word in words)
+
+def build_like_prefix(search_text):
+    """'pa' -> 'pa%', with LIKE wildcards in the text escaped."""
+    escaped = search_text.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+# --- Query Builders for Read-Heavy Endpoints ---
+# Shared by the Flask routes below and the async routes in asgi.py. Each takes
+# the query-string mapping and returns the SQL and its params; ValueError means
+# a bad argument (400).
+
+def build_medicines_query(args):
+    """
+    Catalogue search / browse page. Returns (query, params, limit, sort_key);
+    the query fetches limit + 1 rows for split_page().
+    """
+    search_query = args.get('q', '')
+    fulltext_query = build_fulltext_query(search_query)
+    # Short words and stopwords aren't in the FULLTEXT index: match the name prefix instead
+    name_prefix = build_like_prefix(search_query) if search_query.strip() and not fulltext_query else None
+    # Ranked search pages by position (the cursor carries the offset);
+    # browsing the whole catalogue pages by med_name.
+    limit, cursor = get_page_args(key_size=1, args=args)
+    if not cursor:
+        offset = get_int_arg('offset', 0, args=args)
+    elif fulltext_query and isinstance(cursor[0], int) and cursor[0] >= 0:
+        offset = cursor[0]
+    elif not fulltext_query and isinstance(cursor[0], str):
+        offset = 0
+    else:
+        raise ValueError("Invalid cursor")
+
+    # Step 1: Pick the page of matching medicines (plus one look-ahead row).
+    # With search text this uses the FULLTEXT indexes (name matches rank
+    # above description-only matches); without it, or for a name prefix,
+    # the med_name index.
+    if fulltext_query:
+        hits_query = """
+            SELECT
+                med_id,
+                MATCH(med_name) AGAINST (%s IN BOOLEAN MODE) * 2
+                  + MATCH(med_name, description) AGAINST (%s IN BOOLEAN MODE) AS relevance
+            FROM Medicine
+            WHERE MATCH(med_name, description) AGAINST (%s IN BOOLEAN MODE)
+            ORDER BY relevance DESC, med_name
+            LIMIT %s OFFSET %s
+        """
+        params = (fulltext_query, fulltext_query, fulltext_query, limit + 1, offset)
+        sort_key = lambda med: [offset + limit]
+    else:
+        filters = (["med_name LIKE %s"] if name_prefix else []) + (["med_name > %s"] if cursor else [])
+        hits_query = f"""
+            SELECT med_id, 0 AS relevance
+            FROM Medicine
+            {"WHERE " + " AND ".join(filters) if filters else ""}
+            ORDER BY med_name
+            LIMIT %s OFFSET %s
+        """
+        params = (*([name_prefix] if name_prefix else []), *(cursor or []), limit + 1, offset)
+        sort_key = lambda med: [med['med_name']]
+
+    # Step 2: Attach stock and price for that page only.
+    # Totals come precomputed from Medicine_Stock_Summary (maintained by
+    # the Available_Stock triggers), so no SUM/MIN over every pharmacy here.
+    query = f"""
+        SELECT
+            m.med_id,
+            m.med_name,
+            m.type,
+            m.description,
+            m.prescription_required,
+            COALESCE(mss.total_stock, 0) AS total_stock,
+            COALESCE(mss.min_price, 0) AS min_price
+        FROM ({hits_query}) hits
+        JOIN Medicine m ON m.med_id = hits.med_id
+        LEFT JOIN Medicine_Stock_Summary mss ON m.med_id = mss.med_id
+        ORDER BY hits.relevance DESC, m.med_name
+    """
+    return query, params, limit, sort_key
+
+def build_customer_orders_query(cust_id, args):
+    """
+    One page of a customer's orders with their sub-orders (one row each).
+    Returns (query, params, limit); trim the result with split_order_page().
+    """
+    # Pages are whole orders (newest first), keyed on (order_date, order_id)
+    limit, cursor = get_page_args(key_size=2, default_limit=20, args=args)
+
+    page_filter = ""
+    params = [cust_id]
+    if cursor:
+        page_filter = "AND (order_date < %s OR (order_date = %s AND order_id < %s))"
+        params += [cursor[0], cursor[0], cursor[1]]
+    params.append(limit + 1)
+
+    query = f"""
+        SELECT 
+            o.order_id, 
+            o.order_date, 
+            o.final_status, 
+            o.total_amount,
+            so.sub_order_id,
+            so.status AS sub_order_status,
+            p.pharm_name
+        FROM (
+            SELECT order_id, order_date, final_status, total_amount
+            FROM Orders
+            WHERE cust_id = %s {page_filter}
+            ORDER BY order_date DESC, order_id DESC
+            LIMIT %s
+        ) o
+        LEFT JOIN Sub_Order so ON o.order_id = so.order_id
+        LEFT JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
+        ORDER BY o.order_date DESC, o.order_id DESC, so.sub_order_id ASC;
+    """
+    return query, tuple(params), limit
+
+def split_order_page(orders, limit):
+    """split_page() for order rows: there is one row per sub-order, so the look-ahead is a whole order."""
+    headers = {}
+    order_ids = list(dict.fromkeys(row['order_id'] for row in orders))
+    if len(order_ids) > limit:
+        orders = [row for row in orders if row['order_id'] != order_ids[limit]]
+        headers['X-Next-Cursor'] = encode_cursor([orders[-1]['order_date'], orders[-1]['order_id']])
+    return orders, headers
+
+def sub_order_sort_key(row):
+    return [row['order_id'], row['sub_order_id']]
+
+def build_pharmacy_orders_query(pharm_id, args):
+    """A pharmacy's open sub-orders, oldest first. Returns (query, params, limit)."""
+    limit, cursor = get_page_args(key_size=2, args=args)
+
+    page_filter = ""
+    params = [pharm_id]
+    if cursor:
+        page_filter = "AND (so.order_id > %s OR (so.order_id = %s AND so.sub_order_id > %s))"
+        params += [cursor[0], cursor[0], cursor[1]]
+    params.append(limit + 1)
+
+    query = f"""
+        SELECT so.order_id, so.sub_order_id, so.status, so.sub_total, 
+               c.first_name, c.last_name, c.address_street, c.address_city
+        FROM Sub_Order so
+        JOIN Orders o ON so.order_id = o.order_id
+        JOIN Customer c ON o.cust_id = c.cust_id
+        WHERE so.pharmacy_id = %s AND so.status IN ('Processing', 'Assigned') {page_filter}
+        ORDER BY so.order_id, so.sub_order_id
+        LIMIT %s
+    """
+    return query, tuple(params), limit
+
+def build_agent_deliveries_query(agent_id):
+    """An agent's active deliveries (with stop coordinates for plan_delivery_route). Returns (query, params)."""
+    query = """
+        SELECT 
+            so.order_id, so.sub_order_id, so.status,
+            p.pharm_name, p.address_street AS pickup_address,
+            c.first_name, c.address_street AS dropoff_address,
+            COALESCE(so.pickup_lat, p.latitude) AS pickup_lat,
+            COALESCE(so.pickup_lng, p.longitude) AS pickup_lng,
+            COALESCE(so.drop_lat, c.latitude) AS drop_lat,
+            COALESCE(so.drop_lng, c.longitude) AS drop_lng,
+            da.current_lat AS agent_lat,
+            da.current_lng AS agent_lng,
+            da.last_seen_at AS agent_seen_at
+        FROM Sub_Order so
+        JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
+        JOIN Orders o ON so.order_id = o.order_id
+        JOIN Customer c ON o.cust_id = c.cust_id
+        JOIN Delivery_Agent da ON so.agent_id = da.agent_id
+        WHERE so.agent_id = %s AND so.status in ('Assigned', 'Shipped')
+    """
+    return query, (agent_id,)
+
+# --- Helper for Bulk Cart Requests ---
+MAX_CART_BATCH_ITEMS = 200
+
+def parse_cart_items(items):
+    """
+    Validates a JSON list like [{"med_id": 1, "qty": 2}, ...] (qty defaults to 1).
+    Returns the cleaned list, or raises ValueError describing the first bad entry.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > MAX_CART_BATCH_ITEMS:
+        raise ValueError(f"At most {MAX_CART_BATCH_ITEMS} items per request")
+
+    cleaned = []
+    for i, item in enumerate(items):
+        try:
+            med_id = int(item['med_id'])
+            qty = int(item.get('qty', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise ValueError(f"Item {i}: med_id and qty must be integers")
+        if qty < 1:
+            raise ValueError(f"Item {i}: qty must be at least 1")
+        cleaned.append({"med_id": med_id, "qty": qty})
+    return cleaned
+
+# --- SUBSTITUTES ---
+substitute_config = {
+    'refresh_seconds': 300  # Medicine_Substitute is re-read after this long
+}
+
+class SubstituteGraph:
+    """
+    In-memory copy of Medicine_Substitute with its transitive closure
+    precomputed: if B substitutes A and C substitutes B, C is listed for A
+    (two hops away). Lookups are a dict get instead of a recursive query.
+    Reloaded from the table every substitute_config['refresh_seconds'].
+    """
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._closure = {}  # med_id -> [(substitute_med_id, hops), ...], closest first
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        edges, err = run_query("SELECT med_id, substitute_med_id FROM Medicine_Substitute")
+        if err:
+            print(f"Warning: Could not load medicine substitutes: {err}")
+            return False
+
+        graph = defaultdict(list)
+        for edge in edges:
+            graph[edge['med_id']].append(edge['substitute_med_id'])
+
+        closure = {}
+        for med_id in graph:
+            # Breadth-first, so each substitute is recorded at its fewest hops
+            hops = {med_id: 0}
+            frontier = [med_id]
+            while frontier:
+                next_frontier = []
+                for current in frontier:
+                    for substitute in sorted(graph.get(current, ())):
+                        if substitute not in hops:
+                            hops[substitute] = hops[current] + 1
+                            next_frontier.append(substitute)
+                frontier = next_frontier
+            del hops[med_id]
+            closure[med_id] = sorted(hops.items(), key=lambda item: (item[1], item[0]))
+
+        with self._lock:
+            self._closure = closure
+            self._loaded_at = time.monotonic()
+        return True
+
+    def substitutes(self, med_id):
+        """[(substitute_med_id, hops), ...] for a medicine, closest first."""
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds
+        if stale:
+            self.load()
+        with self._lock:
+            return self._closure.get(med_id, [])
+
+    def is_substitute(self, med_id, substitute_med_id):
+        return any(sub == substitute_med_id for sub, _ in self.substitutes(med_id))
+
+substitute_graph = SubstituteGraph(**substitute_config)
+
+def find_substitutes(med_id, qty, cust_id):
+    """
+    In-stock substitutes for qty of a medicine: every medicine in its closure
+    that some pharmacy holds qty of, ranked by hops then by distance of the
+    nearest such pharmacy to the customer. Returns (list, err).
+    """
+    hops = dict(substitute_graph.substitutes(med_id))
+    if not hops:
+        return [], None
+
+    query = f"""
+        SELECT m.med_id, m.med_name, m.prescription_required,
+               MIN(fn_simple_distance(c.latitude, c.longitude, p.latitude, p.longitude)) AS distance
+        FROM Available_Stock a
+        JOIN Medicine m ON m.med_id = a.med_id
+        JOIN Pharmacy p ON p.pharmacy_id = a.pharmacy_id
+        LEFT JOIN Customer c ON c.cust_id = %s
+        WHERE a.med_id IN ({','.join(['%s'] * len(hops))})
+          AND a.current_stock >= %s
+        GROUP BY m.med_id, m.med_name, m.prescription_required
+    """
+    rows, err = run_query(query, (cust_id, *hops, qty))
+    if err:
+        return None, err
+    for row in rows:
+        row['hops'] = hops[row['med_id']]
+        row['prescription_required'] = bool(row['prescription_required'])
+    rows.sort(key=lambda row: (row['hops'], row['distance'] is None, row['distance'] or 0, row['med_id']))
+    return rows, None
+
+def plan_cart_substitutions(cart_id, cust_id):
+    """
+    Finds cart items that no pharmacy can currently supply and picks the best
+    in-stock substitute for each. A swap needs the customer's confirmation
+    when either medicine requires a prescription. Returns (list, err).
+    """
+    stockouts, err = run_query("""
+        SELECT ci.med_id, m.med_name, m.prescription_required, ci.quantity
+        FROM Cart_Item ci
+        JOIN Medicine m ON m.med_id = ci.med_id
+        WHERE ci.cart_id = %s
+          AND NOT EXISTS (
+              SELECT 1 FROM Available_Stock a
+              WHERE a.med_id = ci.med_id AND a.current_stock >= ci.quantity
+          )
+    """, (cart_id,))
+    if err:
+        return None, err
+
+    plan = []
+    for item in stockouts:
+        candidates, err = find_substitutes(item['med_id'], item['quantity'], cust_id)
+        if err:
+            return None, err
+        if not candidates:
+            continue  # Nothing to offer; checkout reports the item as out of stock
+        best = candidates[0]
+        plan.append({
+            "med_id": item['med_id'],
+            "med_name": item['med_name'],
+            "substitute_med_id": best['med_id'],
+            "substitute_name": best['med_name'],
+            "quantity": item['quantity'],
+            "needs_confirmation": bool(item['prescription_required']) or best['prescription_required']
+        })
+    return plan, None
+
+# --- Helpers for Bulk Inventory Sync ---
+inventory_sync_config = {
+    'chunk_size': 500,   # Rows per multi-row INSERT (and per transaction)
+    'max_errors': 1000   # Row errors listed in the response before they are only counted
+}
+
+INVENTORY_COLUMNS = ['med_id', 'med_name', 'current_stock', 'price']
+
+def read_inventory_rows(stream, fmt):
+    """
+    Yields (line_number, dict) from an upload without reading it all into
+    memory. fmt is 'csv' (header row with med_id, current_stock, price) or
+    'ndjson' (one JSON object per line).
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        for i, row in enumerate(csv.DictReader(text), start=2):  # Line 1 is the header
+            yield i, row
+        return
+    for i, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield i, json.loads(line)
+        except ValueError:
+            yield i, None
+
+def parse_inventory_row(row):
+    """Validates one upload row. Returns (med_id, current_stock, price) or raises ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError("row is not a JSON object")
+    try:
+        med_id = int(row['med_id'])
+        current_stock = int(row['current_stock'])
+        price = Decimal(str(row['price'])).quantize(Decimal('0.01'))
+    except KeyError as e:
+        raise ValueError(f"{e.args[0]} is required")
+    except (TypeError, ValueError, InvalidOperation):
+        raise ValueError("med_id and current_stock must be integers and price a number")
+    if not price.is_finite():
+        raise ValueError("price must be a number")
+    if current_stock < 0 or price < 0:
+        raise ValueError("current_stock and price cannot be negative")
+    if current_stock > 2**31 - 1 or price >= 10**8:
+        raise ValueError("current_stock or price is too large")
+    return med_id, current_stock, price
+
+def upsert_stock_chunk(cursor, pharm_id, rows):
+    """
+    Applies one chunk of validated (med_id, current_stock, price) rows as a
+    single multi-row INSERT ... ON DUPLICATE KEY UPDATE. Rows for medicines
+    that don't exist are left out. Returns the set of med_ids that were skipped.
+    """
+    med_ids = sorted({row[0] for row in rows})
+    cursor.execute(
+        f"SELECT med_id FROM Medicine WHERE med_id IN ({','.join(['%s'] * len(med_ids))})",
+        tuple(med_ids)
+    )
+    known = {found['med_id'] for found in cursor.fetchall()}
+
+    # Last row wins for a repeated med_id; sorted so concurrent writers lock
+    # Available_Stock rows in the same order
+    latest = {row[0]: row for row in rows}
+    values = [latest[med_id] for med_id in med_ids if med_id in known]
+    if values:
+        cursor.execute(f"""
+            INSERT INTO Available_Stock (pharmacy_id, med_id, current_stock, price)
+            VALUES {','.join(['(%s, %s, %s, %s)'] * len(values))}
+            ON DUPLICATE KEY UPDATE
+                current_stock = VALUES(current_stock),
+                price = VALUES(price)
+        """, tuple(value for row in values for value in (pharm_id, *row)))
+    return set(med_ids) - known
+
+def iter_inventory_csv(batches):
+    """Yields a CSV export (header first) one batch of stock rows at a time."""
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=INVENTORY_COLUMNS)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue()
+
 # --- Helper for Dummy Coordinates ---
 def get_dummy_coords(city, state):
     """
@@ -616,6 +1666,7 @@ def handle_medicines():
             ))
             
             conn.commit()
+            read_cache.invalidate('medicines', 'pharmacy_stock', 'reports')
             
             return jsonify({
                 "message": "Medicine created and assigned to pharmacy stock successfully",
@@ -650,6 +1701,7 @@ def handle_medicines():
         results, err = run_query(query, params)
         if err:
             return jsonify({"error": str(err)}), 400
+        read_cache.invalidate('medicines', 'pharmacy_stock', 'reports')
         return jsonify(results)
 
     elif request.method == 'DELETE':
@@ -661,34 +1713,23 @@ def handle_medicines():
         results, err = run_query("DELETE FROM Medicine WHERE med_id = %s", (med_id,))
         if err:
             return jsonify({"error": str(err)}), 500
+        read_cache.invalidate('medicines', 'pharmacy_stock', 'reports')
         return jsonify(results)
 
     else:
     # --- READ Operation (with search) ---
-        search_query = request.args.get('q', '')
-
-    # This new query JOINS with Available_Stock to get stock and price
-        query = """
-            SELECT
-                m.med_id,
-                m.med_name,
-                m.type,
-                m.description,
-                m.prescription_required,
-                COALESCE(SUM(av.current_stock), 0) AS total_stock,
-                COALESCE(MIN(av.price), 0) AS min_price
-            FROM Medicine m
-            LEFT JOIN Available_Stock av ON m.med_id = av.med_id
-            WHERE m.med_name LIKE %s
-            GROUP BY m.med_id, m.med_name, m.type, m.description, m.prescription_required
-        """
+        try:
+            query, params, limit, sort_key = build_medicines_query(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        meds, err = run_query(query, (f"%{search_query}%",))
+        meds, err = cached_query('medicines', query, params)
 
         if err:
             return jsonify({"error": str(err)}), 500
 
-        return jsonify(meds)
+        meds, headers = split_page(meds, limit, sort_key)
+        return jsonify(meds), 200, headers
 # --- CUSTOMER DASHBOARD APIS ---
 
 @app.route('/api/customer/cart', methods=['GET', 'POST'])
@@ -757,108 +1798,377 @@ def handle_cart():
             "details": cart_details
         })
 
-@app.route('/api/cart/process', methods=['POST'])
-def process_cart_order():
-    # --- (Req 4b) PROCESS ORDER (Calls Procedure) ---
+@app.route('/api/customer/cart/batch', methods=['POST'])
+def add_cart_items_batch():
+    """
+    Adds a whole list of items (e.g. a prescription's worth) to the cart in one
+    round-trip: one connection, one procedure call, one transaction.
+    Body: {"items": [{"med_id": 1, "qty": 2}, ...]}
+    """
     cust_id = request.args.get('id')
-    cart, err = run_query("SELECT cart_id FROM Cart WHERE cust_id = %s", (cust_id,), fetch_one=True)
-    if err or not cart:
-        return jsonify({"error": "Could not find cart for customer"}), 404
-    
-    cart_id = cart['cart_id']
+    if not cust_id:
+        return jsonify({"error": "Customer ID is required"}), 400
+    try:
+        items = parse_cart_items((request.json or {}).get('items'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     conn = get_db_connection()
     if not conn: return jsonify({"error": "DB connection failed"}), 500
     cursor = conn.cursor(dictionary=True)
     try:
-        cursor.callproc('sp_process_cart_to_order_modular', (cart_id,))
-        result = {}
-        for res in cursor.stored_results():
-            result = res.fetchone()
+        cursor.execute("SELECT cart_id FROM Cart WHERE cust_id = %s", (cust_id,))
+        cart = cursor.fetchone()
+        if not cart:
+            return jsonify({"error": "Could not find cart for customer"}), 404
+
+        cursor.callproc('sp_add_cart_items', (cart['cart_id'], json.dumps(items)))
         conn.commit()
-        return jsonify(result)
+        return jsonify({"message": f"{len(items)} items added to cart"})
     except mysql.connector.Error as err:
         conn.rollback()
-        if err.errno == 1644: # 1644 is the SQLSTATE '45000'
-            return jsonify({"error": err.msg}), 400
-        else:
-            return jsonify({"error": str(err)}), 500
+        if err.errno == errorcode.ER_NO_REFERENCED_ROW_2: # Unknown med_id
+            return jsonify({"error": "One or more medicines do not exist"}), 400
+        return jsonify({"error": str(err)}), 500
     finally:
         cursor.close()
         conn.close()
 
-# --- (Req 4f) PAY CART: Update Payment Status ---
-@app.route('/api/cart/<int:cust_id>/pay_db_update', methods=['POST'])
-def pay_cart(cust_id):
+@app.route('/api/medicines/<int:med_id>/substitutes', methods=['GET'])
+def get_medicine_substitutes(med_id):
+    """In-stock substitutes for a medicine (?qty=, default 1), best first. ?id= ranks by that customer's distance."""
+    try:
+        qty = get_int_arg('qty', 1, minimum=1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    substitutes, err = find_substitutes(med_id, qty, request.args.get('id'))
+    if err: return jsonify({"error": str(err)}), 500
+    return dump_json(substitutes), 200, {'Content-Type': 'application/json'}
+
+def substitute_cart_items(cart_id, substitutions):
     """
-    Calls stored procedure `sp_update_payment_status` to mark payment as done,
-    update cart and order tables accordingly.
+    Swaps each item for its substitute (same quantity) in one transaction,
+    for swaps the customer confirmed. Returns err or None.
     """
     conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "DB connection failed"}), 500
-    
-    cursor = conn.cursor(dictionary=True)
+    if not conn: return "DB connection failed"
+    cursor = conn.cursor()
     try:
-        # Call your stored procedure
-        cursor.callproc('sp_update_payment_status', [cust_id])
+        for sub in substitutions:
+            cursor.callproc('sp_substitute_cart_item', (cart_id, sub['med_id'], sub['substitute_med_id']))
         conn.commit()
-        return jsonify({"message": "Payment status updated successfully"}), 200
+        return None
     except mysql.connector.Error as err:
         conn.rollback()
-        return jsonify({"error": str(err)}), 500
+        return err
     finally:
         cursor.close()
         conn.close()
 
-
-@app.route('/api/customer/orders', methods=['GET'])
-def get_customer_orders():
-    # --- (Req 4e) JOIN QUERY Example ---
+@app.route('/api/customer/cart/substitute', methods=['POST'])
+def confirm_cart_substitute():
+    """
+    Confirms a substitute offered at checkout (needed for prescription
+    medicines). Body: {"med_id": 4, "substitute_med_id": 2}
+    """
     cust_id = request.args.get('id')
+    data = request.json or {}
     if not cust_id:
         return jsonify({"error": "Customer ID is required"}), 400
-        
-    query = """
-        SELECT 
-            o.order_id, 
-            o.order_date, 
-            o.final_status, 
-            o.total_amount,
-            so.sub_order_id,
-            so.status AS sub_order_status,
-            p.pharm_name
-        FROM Orders o
-        LEFT JOIN Sub_Order so ON o.order_id = so.order_id
-        LEFT JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
-        WHERE o.cust_id = %s
-        ORDER BY o.order_date DESC, so.sub_order_id ASC;
+    try:
+        med_id = int(data['med_id'])
+        substitute_med_id = int(data['substitute_med_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "med_id and substitute_med_id are required"}), 400
+    if not substitute_graph.is_substitute(med_id, substitute_med_id):
+        return jsonify({"error": "That medicine is not a substitute for this item"}), 400
+
+    cart, err = run_query("SELECT cart_id FROM Cart WHERE cust_id = %s", (cust_id,), fetch_one=True)
+    if err or not cart:
+        return jsonify({"error": "Could not find cart for customer"}), 404
+
+    err = substitute_cart_items(cart['cart_id'], [{"med_id": med_id, "substitute_med_id": substitute_med_id}])
+    if err:
+        if getattr(err, 'errno', None) == 1644:
+            return jsonify({"error": err.msg}), 400
+        return jsonify({"error": str(err)}), 500
+    return jsonify({"message": "Substitute added to your cart"})
+
+@app.route('/api/cart/process', methods=['POST'])
+def process_cart_order():
+    # --- (Req 4b) PROCESS ORDER (Calls Procedure) ---
+    cust_id = request.args.get('id')
+    cart, err = run_query("SELECT cart_id FROM Cart WHERE cust_id = %s", (cust_id,), fetch_one=True)
+    if err or not cart:
+        return jsonify({"error": "Could not find cart for customer"}), 404
+    
+    cart_id = cart['cart_id']
+
+    # Items out of stock everywhere: swap in substitutes instead of letting
+    # checkout fail. Over-the-counter swaps happen inside the checkout
+    # transaction, so a failed checkout leaves the cart as it was.
+    # Prescription swaps are confirmed by the customer
+    # (POST /api/customer/cart/substitute) first, and nothing is changed until then.
+    substitutions, err = plan_cart_substitutions(cart_id, cust_id)
+    if err:
+        print(f"Warning: Could not check cart {cart_id} for substitutes: {err}")
+        substitutions = []
+    applied = [sub for sub in substitutions if not sub['needs_confirmation']]
+    pending = [sub for sub in substitutions if sub['needs_confirmation']]
+    if pending:
+        return jsonify({
+            "error": "Some items are out of stock. Please confirm their substitutes to continue.",
+            "substitutions": pending,
+            "automatic_substitutions": applied  # Made at checkout once these are confirmed
+        }), 409
+
+    conn = get_db_connection()
+    if not conn: return jsonify({"error": "DB connection failed"}), 500
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for attempt in range(1, checkout_retry_config['max_attempts'] + 1):
+            try:
+                for sub in applied:
+                    cursor.callproc('sp_substitute_cart_item', (cart_id, sub['med_id'], sub['substitute_med_id']))
+                cursor.callproc('sp_process_cart_to_order_modular', (cart_id,))
+                result = {}
+                for res in cursor.stored_results():
+                    result = res.fetchone()
+                conn.commit()
+                break
+            except mysql.connector.Error as err:
+                conn.rollback()
+                # Deadlocks and lock timeouts under contention are safe to retry
+                if err.errno not in RETRYABLE_LOCK_ERRORS or attempt == checkout_retry_config['max_attempts']:
+                    raise
+                time.sleep(checkout_retry_config['backoff_seconds'] * attempt * random.uniform(0.5, 1.5))
+        # Stock was decremented (reports catch up on the next rollup refresh)
+        read_cache.invalidate('medicines', 'pharmacy_stock')
+        if applied:
+            result['substitutions'] = applied
+        return jsonify(result)
+    except mysql.connector.Error as err:
+        if err.errno == 1644: # 1644 is the SQLSTATE '45000'
+            return jsonify({"error": err.msg}), 400
+        elif err.errno in RETRYABLE_LOCK_ERRORS:
+            return jsonify({"error": "Checkout is busy right now, please try again."}), 503
+        else:
+            return jsonify({"error": str(err)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+# --- (Req 4f) PAY CART: Update Payment Status ---
+@app.route('/api/cart/<int:cust_id>/pay_db_update', methods=['POST'])
+def pay_cart(cust_id):
+    """
+    Calls stored procedure `sp_update_payment_status` to mark payment as done,
+    update cart and order tables accordingly.
     """
-    orders, err = run_query(query, (cust_id,))
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"error": "DB connection failed"}), 500
+    
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # Call your stored procedure
+        cursor.callproc('sp_update_payment_status', [cust_id])
+        conn.commit()
+        return jsonify({"message": "Payment status updated successfully"}), 200
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return jsonify({"error": str(err)}), 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@app.route('/api/customer/orders', methods=['GET'])
+def get_customer_orders():
+    # --- (Req 4e) JOIN QUERY Example ---
+    cust_id = request.args.get('id')
+    if not cust_id:
+        return jsonify({"error": "Customer ID is required"}), 400
+
+    if request.args.get('stream') == '1':
+        # Whole order history in one streamed response (no paging)
+        query = """
+            SELECT 
+                o.order_id, 
+                o.order_date, 
+                o.final_status, 
+                o.total_amount,
+                so.sub_order_id,
+                so.status AS sub_order_status,
+                p.pharm_name
+            FROM Orders o
+            LEFT JOIN Sub_Order so ON o.order_id = so.order_id
+            LEFT JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
+            WHERE o.cust_id = %s
+            ORDER BY o.order_date DESC, o.order_id DESC, so.sub_order_id ASC;
+        """
+        return streamed_response(query, (cust_id,))
+
+    try:
+        query, params, limit = build_customer_orders_query(cust_id, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    orders, err = run_query(query, params)
     if err:
         return jsonify({"error": str(err)}), 500
+
+    orders, headers = split_order_page(orders, limit)
+    headers['Content-Type'] = 'application/json'
         
     # Serialize date/time objects
-    return json.dumps(orders, default=json_serializer), 200, {'Content-Type':'application/json'}
+    return dump_json(orders), 200, headers
+
+
+@app.route('/api/customer/orders/<int:order_id>/reorder', methods=['POST'])
+def reorder(order_id):
+    """Refills the customer's cart from a past order in one server-side transaction."""
+    cust_id = request.args.get('id')
+    if not cust_id:
+        return jsonify({"error": "Customer ID is required"}), 400
+
+    conn = get_db_connection()
+    if not conn: return jsonify({"error": "DB connection failed"}), 500
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.callproc('sp_reorder', (cust_id, order_id))
+        result = {}
+        for res in cursor.stored_results():
+            result = res.fetchone()
+        conn.commit()
+        return jsonify(result)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        if err.errno == 1644: # SQLSTATE '45000'
+            return jsonify({"error": err.msg}), 400
+        return jsonify({"error": str(err)}), 500
+    finally:
+        cursor.close()
+        conn.close()
 
 
 # --- DOCTOR DASHBOARD APIS ---
+# --- Prescription Work Queue ---
+prescription_queue_config = {
+    'batch_size': 10,      # Prescriptions a doctor holds at once by default
+    'max_batch': 50,
+    'lease_seconds': 600   # Unverified claims go back to the queue after this long
+}
+
+PRESCRIPTION_BATCH_QUERY = """
+    SELECT pr.presc_id, pr.order_id, pr.cust_id, pr.file_path, pr.status,
+           pr.uploaded_at, pr.lease_expires_at, c.first_name, c.last_name
+    FROM Prescription pr
+    JOIN Customer c ON pr.cust_id = c.cust_id
+    WHERE pr.lease_doc_id = %s
+      AND pr.status = 'To Be Verified'
+      AND pr.lease_expires_at > NOW()
+    ORDER BY pr.uploaded_at ASC, pr.presc_id ASC
+"""
+
+def claim_prescriptions(doc_id, batch_size):
+    """
+    Tops a doctor's leased batch up to batch_size in one transaction: renews
+    the leases they already hold, then claims the oldest unleased (or
+    expired) prescriptions. Rows another doctor is claiming at the same
+    moment are skipped, so two doctors never get the same prescription.
+    Returns (number newly claimed, err).
+    """
+    lease_seconds = prescription_queue_config['lease_seconds']
+    conn = get_db_connection()
+    if not conn:
+        return None, "DB connection failed"
+    cursor = conn.cursor(dictionary=True)
+    try:
+        conn.start_transaction()
+        # Counted with a locking read: the UPDATE's rowcount leaves out leases
+        # whose expiry didn't change (renewed twice in the same second)
+        cursor.execute("""
+            SELECT COUNT(*) AS held
+            FROM Prescription
+            WHERE lease_doc_id = %s AND status = 'To Be Verified' AND lease_expires_at > NOW()
+            FOR UPDATE
+        """, (doc_id,))
+        held = cursor.fetchone()['held']
+        cursor.execute("""
+            UPDATE Prescription
+            SET lease_expires_at = NOW() + INTERVAL %s SECOND
+            WHERE lease_doc_id = %s AND status = 'To Be Verified' AND lease_expires_at > NOW()
+        """, (lease_seconds, doc_id))
+        wanted = batch_size - held
+
+        claimed = []
+        if wanted > 0:
+            # Walks idx_prescription_status_uploaded oldest first
+            cursor.execute("""
+                SELECT presc_id
+                FROM Prescription
+                WHERE status = 'To Be Verified'
+                  AND (lease_expires_at IS NULL OR lease_expires_at <= NOW())
+                ORDER BY uploaded_at ASC, presc_id ASC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (wanted,))
+            claimed = [row['presc_id'] for row in cursor.fetchall()]
+        if claimed:
+            cursor.execute(f"""
+                UPDATE Prescription
+                SET lease_doc_id = %s, lease_expires_at = NOW() + INTERVAL %s SECOND
+                WHERE presc_id IN ({','.join(['%s'] * len(claimed))})
+            """, (doc_id, lease_seconds, *claimed))
+        conn.commit()
+        return len(claimed), None
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return None, err
+    finally:
+        cursor.close()
+        conn.close()
+
 @app.route('/api/doctor/prescriptions', methods=['GET'])
 def get_prescriptions():
     # --- (Req 4a) Get prescriptions for Doctor ---
-    doc_id = request.args.get('id')  # Not used currently but kept for consistency
-    query = """
-        SELECT pr.presc_id, pr.order_id, pr.cust_id, pr.file_path, pr.status, 
-               pr.uploaded_at, c.first_name, c.last_name
-        FROM Prescription pr
-        JOIN Customer c ON pr.cust_id = c.cust_id
-        WHERE pr.status = 'To Be Verified'
-        ORDER BY pr.uploaded_at ASC;
-    """
-    prescriptions, err = run_query(query)
+    # Only the batch this doctor has leased (see /api/doctor/prescriptions/claim)
+    doc_id = request.args.get('id')
+    if not doc_id:
+        return jsonify({"error": "Doctor ID is required"}), 400
+
+    prescriptions, err = run_query(PRESCRIPTION_BATCH_QUERY, (doc_id,))
     if err:
         return jsonify({"error": str(err)}), 500
-    return json.dumps(prescriptions, default=json_serializer), 200, {'Content-Type':'application/json'}
+    return dump_json(prescriptions), 200, {'Content-Type': 'application/json'}
+
+@app.route('/api/doctor/prescriptions/claim', methods=['POST'])
+def claim_prescription_batch():
+    """
+    Leases the next prescriptions to verify to this doctor (?count=, default
+    prescription_queue_config['batch_size']) and returns their whole batch.
+    Calling it again renews the leases and tops the batch back up.
+    """
+    doc_id = request.args.get('id')
+    if not doc_id:
+        return jsonify({"error": "Doctor ID is required"}), 400
+    try:
+        batch_size = get_int_arg('count', prescription_queue_config['batch_size'], minimum=1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    batch_size = min(batch_size, prescription_queue_config['max_batch'])
+
+    claimed, err = claim_prescriptions(doc_id, batch_size)
+    if err:
+        return jsonify({"error": str(err)}), 500
+    prescriptions, err = run_query(PRESCRIPTION_BATCH_QUERY, (doc_id,))
+    if err:
+        return jsonify({"error": str(err)}), 500
+    return dump_json(prescriptions), 200, {
+        'Content-Type': 'application/json',
+        'X-Claimed': str(claimed)
+    }
 
 @app.route('/api/doctor/verify', methods=['POST'])
 def verify_prescription():
@@ -882,6 +2192,8 @@ def verify_prescription():
         result = {}
         for res in cursor.stored_results():
             result = res.fetchone()
+        if not result.get('rows_updated'):
+            return jsonify({"error": "This prescription was already handled or is claimed by another doctor."}), 409
         return jsonify({"message": f"Prescription {presc_id} {status}", "rows_updated": result.get('rows_updated')})
     except mysql.connector.Error as err:
         conn.rollback()
@@ -895,30 +2207,36 @@ def verify_prescription():
 @app.route('/api/pharmacy/stock', methods=['GET'])
 def get_pharmacy_stock():
     pharm_id = request.args.get('id')
-    query = """
+    try:
+        limit, cursor = get_page_args(key_size=1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = f"""
         SELECT s.med_id, m.med_name, s.current_stock, s.price
         FROM Available_Stock s
         JOIN Medicine m ON s.med_id = m.med_id
-        WHERE s.pharmacy_id = %s
+        WHERE s.pharmacy_id = %s {"AND s.med_id > %s" if cursor else ""}
+        ORDER BY s.med_id
+        LIMIT %s
     """
-    stock, err = run_query(query, (pharm_id,))
+    stock, err = cached_query('pharmacy_stock', query, (pharm_id, *(cursor or []), limit + 1))
     if err: return jsonify({"error": str(err)}), 500
-    return jsonify(stock)
+    stock, headers = split_page(stock, limit, lambda item: [item['med_id']])
+    return jsonify(stock), 200, headers
 
 @app.route('/api/pharmacy/orders', methods=['GET'])
 def get_pharmacy_orders():
     pharm_id = request.args.get('id')
-    query = """
-        SELECT so.order_id, so.sub_order_id, so.status, so.sub_total, 
-               c.first_name, c.last_name, c.address_street, c.address_city
-        FROM Sub_Order so
-        JOIN Orders o ON so.order_id = o.order_id
-        JOIN Customer c ON o.cust_id = c.cust_id
-        WHERE so.pharmacy_id = %s AND so.status IN ('Processing', 'Assigned')
-    """
-    orders, err = run_query(query, (pharm_id,))
+    try:
+        query, params, limit = build_pharmacy_orders_query(pharm_id, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    orders, err = run_query(query, params)
     if err: return jsonify({"error": str(err)}), 500
-    return jsonify(orders)
+    orders, headers = split_page(orders, limit, sub_order_sort_key)
+    return jsonify(orders), 200, headers
 
 @app.route('/api/pharmacy/orders/status', methods=['PUT'])
 def update_pharmacy_order_status():
@@ -958,85 +2276,437 @@ def update_pharmacy_stock():
     if not all([med_id, current_stock is not None, price is not None]):
         return jsonify({"error": "med_id, current_stock, and price are required"}), 400
     
-    # Check if stock record exists, if not create it
-    check_query = "SELECT * FROM Available_Stock WHERE pharmacy_id = %s AND med_id = %s"
-    existing, err = run_query(check_query, (pharm_id, med_id), fetch_one=True)
+    # Create the stock record, or update it if it already exists
+    upsert_query = """
+        INSERT INTO Available_Stock (pharmacy_id, med_id, current_stock, price)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            current_stock = VALUES(current_stock),
+            price = VALUES(price)
+    """
+    results, err = run_query(upsert_query, (pharm_id, med_id, current_stock, price))
     
     if err:
         return jsonify({"error": str(err)}), 500
-    
-    if existing:
-        # Update existing stock
-        update_query = """
-            UPDATE Available_Stock 
-            SET current_stock = %s, price = %s 
-            WHERE pharmacy_id = %s AND med_id = %s
-        """
-        results, err = run_query(update_query, (current_stock, price, pharm_id, med_id))
-    else:
-        # Create new stock record
-        insert_query = """
-            INSERT INTO Available_Stock (pharmacy_id, med_id, current_stock, price)
-            VALUES (%s, %s, %s, %s)
-        """
-        results, err = run_query(insert_query, (pharm_id, med_id, current_stock, price))
-    
+    read_cache.invalidate('pharmacy_stock', 'medicines')
+    return jsonify({"message": "Stock updated successfully"})
+
+@app.route('/api/pharmacy/stock/import', methods=['POST'])
+def import_pharmacy_stock():
+    """
+    Bulk stock/price sync, e.g. a nightly export from a pharmacy's POS.
+    Body is CSV (Content-Type: text/csv, header med_id,current_stock,price)
+    or one JSON object per line (application/x-ndjson); ?format= overrides.
+    Rows are read as they arrive and applied in chunks, one transaction per
+    chunk. Bad rows are skipped and listed in "errors".
+    """
+    pharm_id = request.args.get('id')
+    if not pharm_id:
+        return jsonify({"error": "Pharmacy ID is required"}), 400
+    fmt = request.args.get('format') or ('ndjson' if 'json' in request.mimetype else 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+
+    conn = get_db_connection()
+    if not conn: return jsonify({"error": "DB connection failed"}), 500
+    cursor = conn.cursor(dictionary=True)
+
+    summary = {"applied": 0, "rejected": 0, "errors": []}
+    def reject(row_number, message):
+        summary["rejected"] += 1
+        if len(summary["errors"]) < inventory_sync_config['max_errors']:
+            summary["errors"].append({"row": row_number, "error": message})
+
+    def apply_chunk(chunk):
+        for attempt in range(1, checkout_retry_config['max_attempts'] + 1):
+            try:
+                unknown = upsert_stock_chunk(cursor, pharm_id, [row for _, row in chunk])
+                conn.commit()
+                break
+            except mysql.connector.Error as err:
+                conn.rollback()
+                # Checkouts lock the same stock rows; back off and retry the chunk
+                if err.errno not in RETRYABLE_LOCK_ERRORS or attempt == checkout_retry_config['max_attempts']:
+                    raise
+                time.sleep(checkout_retry_config['backoff_seconds'] * attempt * random.uniform(0.5, 1.5))
+        for row_number, row in chunk:
+            if row[0] in unknown:
+                reject(row_number, f"Medicine {row[0]} does not exist")
+            else:
+                summary["applied"] += 1
+
+    try:
+        chunk = []
+        for row_number, row in read_inventory_rows(request.stream, fmt):
+            try:
+                chunk.append((row_number, parse_inventory_row(row)))
+            except ValueError as e:
+                reject(row_number, str(e))
+                continue
+            if len(chunk) >= inventory_sync_config['chunk_size']:
+                apply_chunk(chunk)
+                chunk = []
+        if chunk:
+            apply_chunk(chunk)
+    except (mysql.connector.Error, UnicodeDecodeError, csv.Error) as err:
+        conn.rollback()
+        # Earlier chunks are already committed; say how far the import got
+        summary["error"] = str(err)
+        status = 500 if isinstance(err, mysql.connector.Error) else 400
+        return jsonify(summary), status
+    finally:
+        cursor.close()
+        conn.close()
+        if summary["applied"]:
+            read_cache.invalidate('pharmacy_stock', 'medicines')
+
+    return jsonify(summary)
+
+@app.route('/api/pharmacy/stock/export', methods=['GET'])
+def export_pharmacy_stock():
+    """
+    Streams a pharmacy's whole stock list as CSV (default) or a JSON array
+    (?format=json). The CSV has the columns the import endpoint accepts.
+    """
+    pharm_id = request.args.get('id')
+    if not pharm_id:
+        return jsonify({"error": "Pharmacy ID is required"}), 400
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'json'):
+        return jsonify({"error": "format must be csv or json"}), 400
+
+    query = """
+        SELECT s.med_id, m.med_name, s.current_stock, s.price
+        FROM Available_Stock s
+        JOIN Medicine m ON s.med_id = m.med_id
+        WHERE s.pharmacy_id = %s
+        ORDER BY s.med_id
+    """
+    if fmt == 'json':
+        return streamed_response(query, (pharm_id,))
+
+    batches, err = run_query_streamed(query, (pharm_id,))
     if err:
         return jsonify({"error": str(err)}), 500
-    return jsonify({"message": "Stock updated successfully"})
+    response = Response(iter_inventory_csv(batches), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="pharmacy_{pharm_id}_stock.csv"'
+    })
+    response.call_on_close(batches.close)
+    return response
 
 
 # --- (Req 4d, 4f) REPORTS API ---
-@app.route('/api/reports', methods=['GET'])
-def get_reports():
-    report_name = request.args.get('name')
+reporting_config = {
+    'refresh_interval': 60  # Seconds between sp_refresh_sales_rollups runs
+}
+
+def get_date_range_args():
+    """
+    Reads ?from=YYYY-MM-DD&to=YYYY-MM-DD (both optional, inclusive).
+    Returns (sql_condition, params) for a `sales_date` column; raises ValueError.
+    """
+    conditions, params = [], []
+    for name, operator in (('from', '>='), ('to', '<=')):
+        value = request.args.get(name)
+        if value:
+            try:
+                params.append(date.fromisoformat(value))
+            except ValueError:
+                raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+            conditions.append(f"sales_date {operator} %s")
+    return " AND ".join(conditions) or "TRUE", params
+
+def build_report_query(report_name):
+    """
+    Sales reports, served from the daily rollup tables (Daily_Pharmacy_Sales,
+    Daily_Medicine_Sales) rather than the order history. Optional ?from= and
+    ?to= limit a report to a date range. Returns (query, params), or
+    (None, None) for an unknown report; raises ValueError for bad dates.
+    """
     query = ""
+    date_filter, params = get_date_range_args()
     
     if report_name == 'aggregate_query':
         # --- (f) AGGREGATE QUERY ---
-        query = """
-            SELECT p.pharm_name, COUNT(so.sub_order_id) AS total_orders, SUM(so.sub_total) AS total_sales
-            FROM Sub_Order so
-            JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
+        query = f"""
+            SELECT p.pharm_name, SUM(d.sub_order_count) AS total_orders, SUM(d.total_sales) AS total_sales
+            FROM Daily_Pharmacy_Sales d
+            JOIN Pharmacy p ON d.pharmacy_id = p.pharmacy_id
+            WHERE {date_filter}
             GROUP BY p.pharm_name
             ORDER BY total_sales DESC;
         """
     elif report_name == 'nested_query':
         # --- (d) NESTED QUERY (Subquery) ---
-        query = """
+        # Medicines with no sales (in the range), via the (med_id, sales_date) index
+        query = f"""
             SELECT med_name, type
-            FROM Medicine
-            WHERE med_id NOT IN (
-                SELECT DISTINCT med_id FROM Order_Medicine
+            FROM Medicine m
+            WHERE NOT EXISTS (
+                SELECT 1 FROM Daily_Medicine_Sales d
+                WHERE d.med_id = m.med_id AND {date_filter}
             );
         """
+    elif report_name == 'medicine_sales':
+        query = f"""
+            SELECT m.med_name, SUM(d.order_count) AS total_orders,
+                   SUM(d.quantity_sold) AS quantity_sold, SUM(d.revenue) AS revenue
+            FROM Daily_Medicine_Sales d
+            JOIN Medicine m ON d.med_id = m.med_id
+            WHERE {date_filter}
+            GROUP BY m.med_id, m.med_name
+            ORDER BY revenue DESC;
+        """
     else:
+        return None, None
+
+    return query, tuple(params)
+
+# --- REPORT JOBS ---
+# Job status and results are stored in Report_Job, so a poll can land on any
+# worker process. The local dicts only let identical requests arriving at
+# the same worker share one execution.
+report_job_config = {
+    'workers': 4,           # Reports computed in parallel per process
+    'wait_seconds': 10,     # GET /api/reports waits this long, then hands back a job id
+    'keep_seconds': 300,    # Finished jobs stay pollable for this long
+    'lost_after_seconds': 900  # A job still 'running' this long died with its worker
+}
+
+report_executor = ThreadPoolExecutor(max_workers=report_job_config['workers'], thread_name_prefix='report')
+_report_jobs_running = {}   # (query, params) -> ReportJob, so identical requests share one run
+_report_jobs_lock = threading.Lock()
+_report_jobs_last_prune = 0
+
+class ReportJob:
+    """
+    One report run in this process. It only gets a Report_Job row (so other
+    workers can answer polls) once persist() is called: when it outlives
+    wait_seconds, or was started with POST /api/reports/jobs.
+    """
+    def __init__(self):
+        self.job_id = uuid.uuid4().hex
+        self.future = None
+        self._lock = threading.Lock()
+        self._persisted = False
+        self._outcome = None  # ('done', rows, None) or ('failed', None, error) once finished
+
+    def persist(self):
+        with self._lock:
+            if self._persisted:
+                return
+            self._persisted = True
+            outcome = self._outcome
+        if outcome:
+            record_report_job(self.job_id, *outcome)
+        else:
+            record_report_job(self.job_id, 'running')
+        prune_report_jobs()
+
+    def finish(self, status, result=None, error=None):
+        with self._lock:
+            self._outcome = (status, result, error)
+            persisted = self._persisted
+        if persisted:
+            record_report_job(self.job_id, status, result, error)
+
+def record_report_job(job_id, status, result=None, error=None):
+    """
+    Writes a job's Report_Job row. 'running' never overwrites a finished row,
+    so persist() and finish() may race in either order.
+    """
+    if status == 'running':
+        query = "INSERT IGNORE INTO Report_Job (job_id, status) VALUES (%s, 'running')"
+        params = (job_id,)
+    else:
+        query = """
+            INSERT INTO Report_Job (job_id, status, result, error, finished_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON DUPLICATE KEY UPDATE
+                status = VALUES(status), result = VALUES(result),
+                error = VALUES(error), finished_at = VALUES(finished_at)
+        """
+        params = (job_id, status, None if result is None else json.dumps(result, default=json_serializer),
+                  error and error[:500])
+    _, err = run_query(query, params)
+    if err:
+        print(f"Warning: Could not record report job {job_id}: {err}")
+
+def prune_report_jobs():
+    """Deletes expired jobs (at most once a minute per process)."""
+    global _report_jobs_last_prune
+    if time.monotonic() - _report_jobs_last_prune < 60:
+        return
+    _report_jobs_last_prune = time.monotonic()
+    run_query(
+        """DELETE FROM Report_Job
+           WHERE finished_at < NOW() - INTERVAL %s SECOND
+              OR (status = 'running' AND created_at < NOW() - INTERVAL %s SECOND)""",
+        (report_job_config['keep_seconds'], report_job_config['lost_after_seconds'])
+    )
+
+def run_report(job, query, params):
+    """
+    Worker-side body of a report job; results go through the read cache
+    ('reports' TTL), and into Report_Job if the job was persisted.
+    """
+    rows, err = cached_query('reports', query, params)
+    if err:
+        job.finish('failed', error=str(err))
+        raise RuntimeError(str(err))
+    job.finish('done', result=rows)
+    return rows
+
+def submit_report_job(query, params):
+    """
+    Starts a report on the worker pool, or joins the identical run already in
+    progress in this process. Returns the ReportJob.
+    """
+    key = (query, params)
+    with _report_jobs_lock:
+        job = _report_jobs_running.get(key)
+        if job:
+            return job
+        job = ReportJob()
+        job.future = report_executor.submit(run_report, job, query, params)
+        _report_jobs_running[key] = job
+
+    def finished(_):
+        with _report_jobs_lock:
+            _report_jobs_running.pop(key, None)
+    job.future.add_done_callback(finished)
+    return job
+
+def report_job_response(job):
+    """JSON status of a report job in this process: running (202), done with result, or failed (500)."""
+    future = job.future
+    if not future.done():
+        payload, status = {"job_id": job.job_id, "status": "running"}, 202
+    elif future.exception():
+        payload, status = {"job_id": job.job_id, "status": "failed", "error": str(future.exception())}, 500
+    else:
+        payload, status = {"job_id": job.job_id, "status": "done", "result": future.result()}, 200
+    return dump_json(payload), status, {'Content-Type': 'application/json'}
+
+@app.route('/api/reports', methods=['GET'])
+def get_reports():
+    """
+    Runs a report and returns its rows. Cached results are returned straight
+    away; otherwise identical concurrent requests share one execution. A
+    report still running after report_job_config['wait_seconds'] returns 202
+    with a job id to poll at /api/reports/jobs/<job_id>.
+    """
+    try:
+        query, params = build_report_query(request.args.get('name'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not query:
+        return jsonify({"error": "Report not found"}), 404
+
+    hit, rows = cached_result('reports', query, params)
+    if hit:
+        return dump_json(rows), 200, {'Content-Type': 'application/json'}
+
+    job = submit_report_job(query, params)
+    wait([job.future], timeout=report_job_config['wait_seconds'])
+    if job.future.done() and not job.future.exception():
+        return dump_json(job.future.result()), 200, {'Content-Type': 'application/json'}
+    if not job.future.done():
+        job.persist()  # The client will poll, possibly another worker
+    return report_job_response(job)
+
+@app.route('/api/reports/jobs', methods=['POST'])
+def create_report_job():
+    """Starts a report in the background (same ?name=&from=&to= as GET /api/reports) and returns its job id."""
+    try:
+        query, params = build_report_query(request.args.get('name'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not query:
         return jsonify({"error": "Report not found"}), 404
 
-    results, err = run_query(query)
+    job = submit_report_job(query, params)
+    job.persist()
+    return report_job_response(job)
+
+@app.route('/api/reports/jobs/<job_id>', methods=['GET'])
+def get_report_job(job_id):
+    """
+    Polls a report job started by POST /api/reports/jobs (or a slow GET
+    /api/reports) on any worker, from its Report_Job row.
+    """
+    job, err = run_query(
+        """SELECT status, result, error,
+                  created_at < NOW() - INTERVAL %s SECOND AS lost
+           FROM Report_Job WHERE job_id = %s""",
+        (report_job_config['lost_after_seconds'], job_id), fetch_one=True
+    )
     if err:
         return jsonify({"error": str(err)}), 500
-    return json.dumps(results, default=json_serializer), 200, {'Content-Type':'application/json'}
+    if not job:
+        return jsonify({"error": "Report job not found or expired"}), 404
+
+    if job['status'] == 'running' and job['lost']:
+        job['status'], job['error'] = 'failed', "Report job was lost; please run the report again"
+    if job['status'] == 'running':
+        return jsonify({"job_id": job_id, "status": "running"}), 202
+    if job['status'] == 'failed':
+        return jsonify({"job_id": job_id, "status": "failed", "error": job['error']}), 500
+    # The stored result is already JSON; splice it in rather than re-encoding it
+    body = f'{{"job_id": {json.dumps(job_id)}, "status": "done", "result": {job["result"]}}}'
+    return body, 200, {'Content-Type': 'application/json'}
+
+def refresh_sales_rollups():
+    """Runs one incremental rollup refresh. Returns (result_row, err)."""
+    conn = get_db_connection()
+    if not conn:
+        return None, "DB connection failed"
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.callproc('sp_refresh_sales_rollups')
+        result = {}
+        for res in cursor.stored_results():
+            result = res.fetchone()
+        if result.get('advanced'):
+            read_cache.invalidate('reports')
+        return result, None
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return None, err
+    finally:
+        cursor.close()
+        conn.close()
+
+def rollup_loop():
+    while True:
+        _, err = refresh_sales_rollups()
+        if err:
+            print(f"Warning: Sales rollup refresh failed: {err}")
+        prune_report_jobs()  # Expired Report_Job rows go even when no new jobs are persisted
+        time.sleep(reporting_config['refresh_interval'])
+
+_rollup_thread = None
+
+def start_rollup_refresher():
+    """Starts the background rollup refresh thread (once per process)."""
+    global _rollup_thread
+    if _rollup_thread is not None and _rollup_thread.is_alive():
+        return _rollup_thread
+    _rollup_thread = threading.Thread(target=rollup_loop, name='sales-rollups', daemon=True)
+    _rollup_thread.start()
+    return _rollup_thread
 
 
 # --- AGENT DASHBOARD APIS ---
 @app.route('/api/agent/deliveries', methods=['GET'])
 def get_agent_deliveries():
     agent_id = request.args.get('id')
-    query = """
-        SELECT 
-            so.order_id, so.sub_order_id, so.status,
-            p.pharm_name, p.address_street AS pickup_address,
-            c.first_name, c.address_street AS dropoff_address
-        FROM Sub_Order so
-        JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
-        JOIN Orders o ON so.order_id = o.order_id
-        JOIN Customer c ON o.cust_id = c.cust_id
-        WHERE so.agent_id = %s AND so.status in ('Assigned', 'Shipped')
-    """
-    deliveries, err = run_query(query, (agent_id,))
+    query, params = build_agent_deliveries_query(agent_id)
+    deliveries, err = run_query(query, params)
     if err: return jsonify({"error": str(err)}), 500
-    return jsonify(deliveries)
+    # Returned in stop order, each with its pickup_stop / dropoff_stop number
+    deliveries, headers = apply_delivery_route(agent_id, deliveries)
+    return jsonify(deliveries), 200, headers
 
 @app.route('/api/agent/status', methods=['POST'])
 def update_agent_status():
@@ -1054,6 +2724,117 @@ def update_agent_status():
     if err: return jsonify({"error": str(err)}), 500
     return jsonify(results)
 
+# --- AGENT LOCATION PINGS ---
+agent_location_config = {
+    'flush_interval': 5,   # Seconds between batched writes to Delivery_Agent
+    'max_pending': 5000    # Flush early once this many agents are waiting
+}
+
+class AgentLocationBuffer:
+    """
+    Collects agent location pings in memory and writes them to Delivery_Agent
+    in one multi-row UPDATE per interval (only each agent's newest ping).
+    Also keeps the latest position of every agent seen by this process. Other
+    workers receive pings too, so callers compare it with the table's
+    last_seen_at (newer_than) rather than always preferring it.
+    """
+    def __init__(self):
+        self._pending = {}  # agent_id -> (lat, lng, seen_at), waiting to be written
+        self._latest = {}   # agent_id -> (lat, lng, seen_at)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, agent_id, lat, lng):
+        position = (lat, lng, datetime.now())
+        with self._lock:
+            self._pending[agent_id] = position
+            self._latest[agent_id] = position
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='agent-locations', daemon=True)
+                self._thread.start()
+            if len(self._pending) >= agent_location_config['max_pending']:
+                self._wake.set()
+
+    def latest(self, agent_id):
+        """(lat, lng, seen_at) from this process's pings, or None."""
+        with self._lock:
+            return self._latest.get(agent_id)
+
+    def newer_than(self, agent_id, db_seen_at):
+        """
+        (lat, lng) from this process's pings if they are at least as recent as
+        the row's last_seen_at (which another worker may have written), else None.
+        """
+        position = self.latest(agent_id)
+        if not position:
+            return None
+        # The table keeps whole seconds
+        if db_seen_at is None or position[2].replace(microsecond=0) >= db_seen_at:
+            return position[0], position[1]
+        return None
+
+    def _run(self):
+        while True:
+            self._wake.wait(agent_location_config['flush_interval'])
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        rows = [[agent_id, lat, lng, seen_at.strftime('%Y-%m-%d %H:%M:%S')]
+                for agent_id, (lat, lng, seen_at) in pending.items()]
+        query = """
+            UPDATE Delivery_Agent da
+            JOIN JSON_TABLE(%s, '$[*]' COLUMNS (
+                agent_id INT PATH '$[0]',
+                lat DECIMAL(10,6) PATH '$[1]',
+                lng DECIMAL(10,6) PATH '$[2]',
+                seen_at DATETIME PATH '$[3]'
+            )) pings ON da.agent_id = pings.agent_id
+            SET da.current_lat = pings.lat,
+                da.current_lng = pings.lng,
+                da.last_seen_at = pings.seen_at
+            WHERE da.last_seen_at IS NULL OR da.last_seen_at <= pings.seen_at
+        """
+        _, err = run_query(query, (json.dumps(rows),))
+        if err:
+            print(f"Warning: Failed to write {len(rows)} agent location(s): {err}")
+            with self._lock:
+                # Retry next time, unless a newer ping has arrived meanwhile
+                for agent_id, position in pending.items():
+                    self._pending.setdefault(agent_id, position)
+
+agent_locations = AgentLocationBuffer()
+atexit.register(agent_locations.flush)
+
+@app.route('/api/agent/location', methods=['POST'])
+def record_agent_location():
+    """
+    High-frequency location ping from an agent's device: {"lat": .., "lng": ..}.
+    Buffered in memory and written in batches, so it never waits on MySQL.
+    """
+    try:
+        agent_id = int(request.args.get('id'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Agent ID is required"}), 400
+
+    data = request.get_json(silent=True) or {}
+    try:
+        lat = round(float(data['lat']), 6)
+        lng = round(float(data['lng']), 6)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "lat and lng must be numbers"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"error": "lat/lng out of range"}), 400
+
+    agent_locations.record(agent_id, lat, lng)
+    return jsonify({"message": "Location received"}), 202
+
 @app.route('/api/agent/deliveries/status', methods=['PUT'])
 def update_delivery_status():
     """Update the status of a delivery sub-order."""
@@ -1116,7 +2897,19 @@ def get_unassigned_orders():
     """
     Fetches all sub-orders that are 'Processing' and need an agent.
     """
-    query = """
+    try:
+        limit, cursor = get_page_args(key_size=2)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    page_filter = ""
+    params = []
+    if cursor:
+        page_filter = "AND (so.order_id > %s OR (so.order_id = %s AND so.sub_order_id > %s))"
+        params += [cursor[0], cursor[0], cursor[1]]
+    params.append(limit + 1)
+
+    query = f"""
         SELECT 
             so.order_id, 
             so.sub_order_id, 
@@ -1128,13 +2921,15 @@ def get_unassigned_orders():
         JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
         JOIN Orders o ON so.order_id = o.order_id
         JOIN Customer c ON o.cust_id = c.cust_id
-        WHERE so.status = 'Processing'
-        ORDER BY so.order_id, so.sub_order_id;
+        WHERE so.status = 'Processing' {page_filter}
+        ORDER BY so.order_id, so.sub_order_id
+        LIMIT %s;
     """
-    orders, err = run_query(query)
+    orders, err = run_query(query, tuple(params))
     if err:
         return jsonify({"error": str(err)}), 500
-    return jsonify(orders)
+    orders, headers = split_page(orders, limit, sub_order_sort_key)
+    return jsonify(orders), 200, headers
 
 @app.route('/api/admin/assign_agent', methods=['POST'])
 def assign_agent_to_order():
@@ -1173,7 +2968,579 @@ def assign_agent_to_order():
         cursor.close()
         conn.close()
 
+# --- ADMIN: BATCH DISPATCHER ---
+dispatcher_config = {
+    'enabled': True,
+    'interval_seconds': 30,  # How often the background dispatcher runs
+    'max_batch': 500         # Sub-orders considered per run (oldest first)
+}
+
+def geo_distance_km(lat1, lng1, lat2, lng2):
+    """Haversine distance between two points, or None if either is unknown."""
+    if None in (lat1, lng1, lat2, lng2):
+        return None
+    lat1, lng1, lat2, lng2 = map(math.radians, map(float, (lat1, lng1, lat2, lng2)))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+def plan_assignments(sub_orders, agents):
+    """
+    Greedy nearest-pair matching: every (sub-order, agent) pair is ranked by
+    pickup distance and taken closest-first while both sides are still free.
+    Pairs with an unknown position rank last, so an agent with no location is
+    only used once every located agent is taken.
+    """
+    pairs = []
+    for so in sub_orders:
+        for agent in agents:
+            dist = geo_distance_km(so['pickup_lat'], so['pickup_lng'],
+                                   agent['current_lat'], agent['current_lng'])
+            pairs.append((dist is None, dist or 0.0, so['order_id'], so['sub_order_id'], agent['agent_id']))
+    pairs.sort()
+
+    plan = []
+    taken_orders, taken_agents = set(), set()
+    for unknown, dist, order_id, sub_order_id, agent_id in pairs:
+        if (order_id, sub_order_id) in taken_orders or agent_id in taken_agents:
+            continue
+        taken_orders.add((order_id, sub_order_id))
+        taken_agents.add(agent_id)
+        plan.append({
+            "order_id": order_id,
+            "sub_order_id": sub_order_id,
+            "agent_id": agent_id,
+            "distance_km": None if unknown else round(dist, 2)
+        })
+        if len(taken_agents) == len(agents):
+            break
+    return plan
+
+# --- DELIVERY ROUTE PLANNING ---
+ROUTE_2OPT_MAX_PASSES = 20
+
+def route_leg_km(a, b):
+    """Distance between two (lat, lng) points; unknown points count as 0 so they never block a plan."""
+    return geo_distance_km(a[0], a[1], b[0], b[1]) or 0.0
+
+def route_length_km(start, stops):
+    total, here = 0.0, start
+    for stop in stops:
+        total += route_leg_km(here, stop['point'])
+        here = stop['point']
+    return total
+
+def route_is_feasible(stops):
+    """Every pickup must come before the drop-off of the same delivery."""
+    picked_up = set()
+    for stop in stops:
+        if stop['kind'] == 'pickup':
+            picked_up.add(stop['delivery'])
+        elif stop['needs_pickup'] and stop['delivery'] not in picked_up:
+            return False
+    return True
+
+def plan_delivery_route(start, deliveries):
+    """
+    Orders an agent's stops: nearest-neighbour from the agent's position
+    (a drop-off only becomes eligible once its pickup is done), then 2-opt
+    segment reversals that shorten the route while keeping every pickup
+    before its drop-off. 'Shipped' deliveries are already picked up and
+    only need a drop-off. Returns (stops in order, total km).
+    """
+    remaining = []
+    for i, d in enumerate(deliveries):
+        needs_pickup = d['status'] == 'Assigned'
+        if needs_pickup:
+            remaining.append({'delivery': i, 'kind': 'pickup', 'needs_pickup': True,
+                              'point': (d['pickup_lat'], d['pickup_lng'])})
+        remaining.append({'delivery': i, 'kind': 'dropoff', 'needs_pickup': needs_pickup,
+                          'point': (d['drop_lat'], d['drop_lng'])})
+
+    # Step 1: Nearest neighbour
+    route, here, picked_up = [], start, set()
+    while remaining:
+        eligible = [s for s in remaining
+                    if s['kind'] == 'pickup' or not s['needs_pickup'] or s['delivery'] in picked_up]
+        nearest = min(eligible, key=lambda s: route_leg_km(here, s['point']))
+        remaining.remove(nearest)
+        route.append(nearest)
+        if nearest['kind'] == 'pickup':
+            picked_up.add(nearest['delivery'])
+        here = nearest['point']
+
+    # Step 2: 2-opt improvement
+    best = route_length_km(start, route)
+    for _ in range(ROUTE_2OPT_MAX_PASSES):
+        improved = False
+        for i in range(len(route) - 1):
+            for j in range(i + 1, len(route)):
+                candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                length = route_length_km(start, candidate)
+                if length < best - 1e-9 and route_is_feasible(candidate):
+                    route, best, improved = candidate, length, True
+        if not improved:
+            break
+
+    return route, round(best, 2)
+
+def apply_delivery_route(agent_id, deliveries):
+    """
+    Sorts an agent's deliveries by the planned route and numbers each one's
+    pickup_stop / dropoff_stop (1-based; pickup_stop is None once Shipped).
+    Returns (deliveries, headers) with the route length in X-Route-Km.
+    """
+    if not deliveries:
+        return deliveries, {}
+    start = (agent_locations.newer_than(int(agent_id), deliveries[0]['agent_seen_at'])
+             or (deliveries[0]['agent_lat'], deliveries[0]['agent_lng']))
+
+    stops, total_km = plan_delivery_route(start, deliveries)
+    for number, stop in enumerate(stops, start=1):
+        deliveries[stop['delivery']][f"{stop['kind']}_stop"] = number
+    for d in deliveries:
+        d.setdefault('pickup_stop', None)
+        d.pop('agent_lat', None)
+        d.pop('agent_lng', None)
+        d.pop('agent_seen_at', None)
+
+    deliveries.sort(key=lambda d: d['pickup_stop'] or d['dropoff_stop'])
+    return deliveries, {'X-Route-Km': str(total_km)}
+
+def run_dispatch():
+    """
+    Assigns every 'Processing' sub-order it can to an 'Available' agent in one
+    transaction. Rows held by a concurrent manual assignment are skipped and
+    picked up on the next run. Returns (assignments, err).
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None, "DB connection failed"
+    cursor = conn.cursor(dictionary=True)
+    has_lock = False
+    try:
+        # Every worker process runs a dispatcher; only one plans at a time
+        cursor.execute("SELECT GET_LOCK('mediquick_dispatcher', 0) AS acquired")
+        has_lock = cursor.fetchone()['acquired'] == 1
+        if not has_lock:
+            return [], None
+
+        conn.start_transaction()
+        cursor.execute("""
+            SELECT so.order_id, so.sub_order_id,
+                   COALESCE(so.pickup_lat, p.latitude) AS pickup_lat,
+                   COALESCE(so.pickup_lng, p.longitude) AS pickup_lng
+            FROM Sub_Order so
+            JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
+            WHERE so.status = 'Processing' AND so.agent_id IS NULL
+            ORDER BY so.order_id, so.sub_order_id
+            LIMIT %s
+            FOR UPDATE OF so SKIP LOCKED
+        """, (dispatcher_config['max_batch'],))
+        sub_orders = cursor.fetchall()
+        if not sub_orders:
+            conn.rollback()
+            return [], None
+
+        cursor.execute("""
+            SELECT agent_id, current_lat, current_lng, last_seen_at
+            FROM Delivery_Agent
+            WHERE status = 'Available'
+            FOR UPDATE SKIP LOCKED
+        """)
+        agents = cursor.fetchall()
+        for agent in agents:
+            # Pings this worker received may not have been flushed to the table
+            # yet; a fix another worker flushed since then wins
+            position = agent_locations.newer_than(agent['agent_id'], agent.pop('last_seen_at'))
+            if position:
+                agent['current_lat'], agent['current_lng'] = position
+
+        plan = plan_assignments(sub_orders, agents)
+        if plan:
+            cursor.executemany(
+                "UPDATE Sub_Order SET agent_id = %s, status = 'Assigned' WHERE order_id = %s AND sub_order_id = %s",
+                [(a['agent_id'], a['order_id'], a['sub_order_id']) for a in plan]
+            )
+            cursor.executemany(
+                "UPDATE Delivery_Agent SET status = 'Busy' WHERE agent_id = %s",
+                [(a['agent_id'],) for a in plan]
+            )
+        conn.commit()
+        return plan, None
+    except mysql.connector.Error as err:
+        conn.rollback()
+        return None, err
+    finally:
+        lock_released = True
+        if has_lock:
+            try:
+                cursor.execute("SELECT RELEASE_LOCK('mediquick_dispatcher')")
+                cursor.fetchall()
+            except mysql.connector.Error as err:
+                print(f"Warning: Could not release the dispatcher lock: {err}")
+                lock_released = False
+        try:
+            cursor.close()
+        except mysql.connector.Error:
+            pass
+        if lock_released:
+            conn.close()
+        else:
+            # A pooled session would keep the named lock and block every other
+            # worker's dispatcher; closing the session is what frees it
+            conn.discard()
+
+_dispatcher_stop = threading.Event()
+
+def dispatcher_loop():
+    while not _dispatcher_stop.wait(dispatcher_config['interval_seconds']):
+        plan, err = run_dispatch()
+        if err:
+            print(f"Warning: Dispatcher run failed: {err}")
+        elif plan:
+            print(f"Dispatcher assigned {len(plan)} sub-order(s)")
+
+_dispatcher_thread = None
+
+def start_dispatcher():
+    """Starts the background dispatcher thread (once per process)."""
+    global _dispatcher_thread
+    if _dispatcher_thread is not None and _dispatcher_thread.is_alive():
+        return _dispatcher_thread
+    _dispatcher_thread = threading.Thread(target=dispatcher_loop, name='dispatcher', daemon=True)
+    _dispatcher_thread.start()
+    return _dispatcher_thread
+
+@app.route('/api/admin/dispatch', methods=['POST'])
+def dispatch_now():
+    """Runs the batch dispatcher immediately instead of waiting for its next tick."""
+    plan, err = run_dispatch()
+    if err:
+        return jsonify({"error": str(err)}), 500
+    return jsonify({
+        "message": f"Assigned {len(plan)} sub-order(s)",
+        "assignments": plan
+    })
+
+# --- LIVE STATUS EVENTS (Server-Sent Events) ---
+status_events_config = {
+    'poll_interval': 1.0,     # Seconds between reads of Status_Event (one query per worker, not per client)
+    'keepalive_seconds': 15,  # Idle streams get a comment line so proxies keep them open
+    'retention_hours': 24,    # Older events are pruned (clients reconnecting later just reload)
+    'max_queue': 500,         # Undelivered events per client before it is told to resync
+    'gap_timeout_seconds': 120,  # How long a skipped event_id may still turn up (an uncommitted transaction)
+    'max_gaps': 500,          # Skipped ids tracked at once; older ones are given up first
+    # Each open stream holds a request thread for as long as the dashboard is
+    # open, so cap them below gunicorn's `threads` to keep some for requests
+    'max_streams': int(os.environ.get('MEDIQUICK_SSE_STREAMS', 2)),
+    'busy_retry_ms': 30000,   # Over the cap, the browser is told to reconnect after this long...
+    'busy_poll_ms': 15000     # ...and to reload its list this often until then
+}
+
+# Open SSE streams in this worker process
+sse_stream_slots = threading.BoundedSemaphore(status_events_config['max_streams'])
+
+# Which Status_Event column each dashboard filters on
+STATUS_EVENT_ROLES = {'customer': 'cust_id', 'pharmacy': 'pharmacy_id', 'agent': 'agent_id'}
+
+STATUS_EVENT_COLUMNS = "event_id, order_id, sub_order_id, cust_id, pharmacy_id, agent_id, status, created_at"
+
+class StatusEventBus:
+    """
+    Tails Status_Event (written by the Sub_Order triggers) from one thread per
+    worker process and fans each new row out to the SSE streams open in that
+    process. Status changes made by any worker reach every worker this way.
+
+    AUTO_INCREMENT ids are handed out at insert time, not commit time, so a
+    row can become visible after rows with higher ids. Ids skipped over by
+    the tail are re-read on every poll until they show up or
+    gap_timeout_seconds passes (rolled-back inserts never show up).
+    """
+    def __init__(self):
+        self._subscribers = {}  # queue -> (column, value)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_id = None
+        self._gaps = {}  # skipped event_id -> monotonic time first noticed
+        self._last_prune = 0
+
+    def subscribe(self, column, value, notify=None):
+        """
+        Returns the queue this stream's events arrive on. `notify`, if given,
+        is called from the tail thread after events are queued (asgi.py uses
+        it to wake its event loop instead of holding a thread per stream).
+        """
+        events = queue.Queue(maxsize=status_events_config['max_queue'])
+        with self._lock:
+            self._subscribers[events] = (column, str(value), notify)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='status-events', daemon=True)
+                self._thread.start()
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.pop(events, None)
+
+    def _run(self):
+        while True:
+            time.sleep(status_events_config['poll_interval'])
+            with self._lock:
+                if not self._subscribers:
+                    continue
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Warning: Status event poll failed: {e}")
+
+    def _poll(self):
+        if self._last_id is None:
+            row, err = run_query("SELECT COALESCE(MAX(event_id), 0) AS last_id FROM Status_Event", fetch_one=True)
+            if err:
+                return
+            self._last_id = row['last_id']
+
+        query = f"SELECT {STATUS_EVENT_COLUMNS} FROM Status_Event WHERE event_id > %s"
+        params = [self._last_id]
+        if self._gaps:
+            query += f" OR event_id IN ({', '.join(['%s'] * len(self._gaps))})"
+            params += list(self._gaps)
+        events, err = run_query(query + " ORDER BY event_id LIMIT 1000", tuple(params))
+        if err:
+            return
+
+        now = time.monotonic()
+        max_gaps = status_events_config['max_gaps']
+        for event in events:
+            event_id = event['event_id']
+            if event_id <= self._last_id:
+                self._gaps.pop(event_id, None)  # A late commit below the tail
+                continue
+            for missing in range(max(self._last_id + 1, event_id - max_gaps), event_id):
+                self._gaps[missing] = now
+            self._last_id = event_id
+        self._gaps = {
+            event_id: noticed for event_id, noticed in self._gaps.items()
+            if now - noticed < status_events_config['gap_timeout_seconds']
+        }
+        if len(self._gaps) > max_gaps:
+            self._gaps = dict(sorted(self._gaps.items())[-max_gaps:])
+        if not events:
+            return
+
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        woken = set()
+        for event in events:
+            for events_queue, (column, value, notify) in subscribers:
+                if str(event[column]) != value:
+                    continue
+                try:
+                    events_queue.put_nowait(event)
+                except queue.Full:
+                    # Client is too far behind for deltas; make it reload its list
+                    with events_queue.mutex:
+                        events_queue.queue.clear()
+                    events_queue.put_nowait({"resync": True})
+                if notify is not None:
+                    woken.add(notify)
+        for notify in woken:
+            notify()
+
+        if time.monotonic() - self._last_prune > 3600:
+            self._last_prune = time.monotonic()
+            run_query(
+                "DELETE FROM Status_Event WHERE created_at < NOW() - INTERVAL %s HOUR",
+                (status_events_config['retention_hours'],)
+            )
+
+status_event_bus = StatusEventBus()
+
+def format_sse(event, with_id=True):
+    if event.get('resync'):
+        return "event: resync\ndata: {}\n\n"
+    event_id = f"id: {event['event_id']}\n" if with_id else ""
+    return f"{event_id}event: status\ndata: {json.dumps(event, default=json_serializer)}\n\n"
+
+STATUS_EVENT_REPLAY_LIMIT = 1000  # Missed events replayed on reconnect; further behind means a resync
+
+def parse_status_event_args(args, last_event_id=None):
+    """
+    Validates the /api/events arguments (shared with asgi.py). Returns
+    (column, value, last_event_id) and raises ValueError with the 400 message.
+    """
+    column = STATUS_EVENT_ROLES.get(args.get('role'))
+    value = args.get('id')
+    if not column or not value:
+        raise ValueError("role (customer, pharmacy or agent) and id are required")
+
+    last_event_id = last_event_id or args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise ValueError("Last-Event-ID must be an integer")
+    return column, value, last_event_id
+
+def build_missed_events_query(column, value, last_event_id):
+    return (
+        f"""SELECT {STATUS_EVENT_COLUMNS} FROM Status_Event
+            WHERE event_id > %s AND {column} = %s ORDER BY event_id LIMIT {STATUS_EVENT_REPLAY_LIMIT}""",
+        (last_event_id, value)
+    )
+
+class StatusEventStream:
+    """
+    SSE text for one dashboard's stream, shared by the Flask route and asgi.py.
+    Live events that were already replayed are skipped, and a late commit
+    below what was already sent goes out without an id, so the browser's
+    Last-Event-ID never moves backwards.
+    """
+    def __init__(self, last_event_id, missed):
+        if len(missed) >= STATUS_EVENT_REPLAY_LIMIT:
+            missed = [{"resync": True}]  # Too far behind; reload instead of replaying
+        self.missed = missed
+        self.replayed = {event['event_id'] for event in missed if not event.get('resync')}
+        self.highest_sent = last_event_id or 0
+
+    def opening(self):
+        """The reconnect delay, then the replayed events."""
+        chunks = ["retry: 3000\n\n"]
+        for event in self.missed:
+            if not event.get('resync'):
+                self.highest_sent = max(self.highest_sent, event['event_id'])
+            chunks.append(format_sse(event))
+        return ''.join(chunks)
+
+    def live(self, event):
+        """Text for an event from status_event_bus, or None if it was replayed."""
+        if event.get('resync'):
+            return format_sse(event)
+        if event['event_id'] in self.replayed:
+            return None
+        text = format_sse(event, with_id=event['event_id'] > self.highest_sent)
+        self.highest_sent = max(self.highest_sent, event['event_id'])
+        return text
+
+@app.route('/api/events', methods=['GET'])
+def stream_status_events():
+    """
+    Server-Sent Events stream of sub-order status changes for one dashboard:
+    ?role=customer|pharmacy|agent&id=<that role's id>. Each event is one
+    changed sub-order, so clients patch their lists instead of refetching.
+    Reconnecting browsers send Last-Event-ID and get what they missed.
+    Each stream holds a worker thread, so at most
+    status_events_config['max_streams'] are open per worker; over that, the
+    browser gets a `busy` event, polls its list and retries later. asgi.py serves this route on its event
+    loop instead, without a thread per stream.
+    """
+    try:
+        column, value, last_event_id = parse_status_event_args(request.args, request.headers.get('Last-Event-ID'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not sse_stream_slots.acquire(blocking=False):
+        # A named event, so the dashboard can fall back to polling rather than go quiet
+        busy = {"retry_ms": status_events_config['busy_retry_ms'], "poll_ms": status_events_config['busy_poll_ms']}
+        return Response(f"retry: {busy['retry_ms']}\nevent: busy\ndata: {json.dumps(busy)}\n\n",
+                        mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    # Subscribe before replaying so nothing falls in between; duplicates are skipped by id
+    events = status_event_bus.subscribe(column, value)
+    slot = {'held': True}
+
+    def close_stream():
+        # Runs via call_on_close, so also when the body was never iterated
+        status_event_bus.unsubscribe(events)
+        if slot.pop('held', False):
+            sse_stream_slots.release()
+
+    missed = []
+    if last_event_id is not None:
+        missed, err = run_query(*build_missed_events_query(column, value, last_event_id))
+        if err:
+            close_stream()
+            return jsonify({"error": str(err)}), 500
+    stream = StatusEventStream(last_event_id, missed)
+
+    def generate():
+        yield stream.opening()
+        while True:
+            try:
+                event = events.get(timeout=status_events_config['keepalive_seconds'])
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            text = stream.live(event)
+            if text:
+                yield text
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(close_stream)
+    return response
+
+# --- READ CACHE STATS ---
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Request, connection, query, fetch, JSON and stored-procedure timings for
+    this worker process. JSON by default; ?format=prometheus for scraping.
+    """
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify(metrics.snapshot())
+
+@app.route('/api/metrics', methods=['DELETE'])
+def reset_metrics():
+    """Clears this worker's metrics (e.g. between benchmark runs)."""
+    metrics.reset()
+    return jsonify({"message": "Metrics reset"})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss counters for the read cache (this worker process only)."""
+    return jsonify(read_cache.stats())
+
+# --- APP FACTORY ---
+def precompile_templates():
+    """Compiles every Jinja template up front so no page pays for it on first view."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def preload_reference_data():
+    """
+    Warms this process's connection pool and read cache with the catalogue
+    data almost every session starts with (the default medicine list and
+    the substitute graph).
+    """
+    query, params, _, _ = build_medicines_query({})
+    _, err = cached_query('medicines', query, params)
+    if err:
+        print(f"Warning: Could not preload reference data: {err}")
+    substitute_graph.load()
+
+def create_app(start_background_jobs=True):
+    """
+    Readies the app for serving in the current process: compiles templates,
+    opens the connection pool, preloads reference data and starts the
+    background jobs (dispatcher, sales rollup refresh). Call it once per
+    worker (wsgi.py does this). Routes are registered on the module-level
+    `app`, which is returned.
+    """
+    precompile_templates()
+    preload_reference_data()
+    if start_background_jobs:
+        if dispatcher_config['enabled']:
+            start_dispatcher()
+        start_rollup_refresher()
+    return app
+
 # --- MAIN RUN ---
 if __name__ == '__main__':
+    # Development server only; see wsgi.py for production.
+    # The debug reloader imports this file twice; only its child serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        create_app()
     app.run(debug=True, port=5000)
 
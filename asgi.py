@@ -0,0 +1,336 @@
+"""
+ASGI entry point for MediQuick.
+
+    pip install aiomysql asgiref uvicorn
+    uvicorn asgi:application --workers 4
+
+The read-heavy GET endpoints in ASYNC_ROUTES run on the event loop against an
+aiomysql pool, so one worker can keep many requests waiting on MySQL at once
+instead of one per thread. They build their SQL with the same helpers as the
+Flask routes, so both modes return the same JSON, and they record the same
+request and query histograms in `metrics`. Live status events (/api/events)
+are streamed from the event loop too, so open dashboards hold no threads.
+Every other route (and ?stream=1 order history) is the regular Flask app,
+run on a pool of MEDIQUICK_THREADS threads per worker as under gunicorn.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import aiomysql
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+
+import app as app_module
+from app import (
+    app, create_app, db_config, db_pool_config, read_cache_ttls, json_serializer,
+    metrics, elapsed_ms, log_slow_statement,
+    build_medicines_query, build_customer_orders_query, split_order_page,
+    build_pharmacy_orders_query, build_agent_deliveries_query, apply_delivery_route,
+    split_page, sub_order_sort_key,
+    status_event_bus, status_events_config, parse_status_event_args,
+    build_missed_events_query, StatusEventStream
+)
+
+async_db_pool_config = {
+    'minsize': 1,
+    'maxsize': 50  # Connections per worker; each in-flight async query holds one
+}
+
+# Threads per worker for the Flask routes; keep <= db_pool_config['pool_size']
+wsgi_threads = int(os.environ.get('MEDIQUICK_THREADS', 4))
+
+# "GET /path" of the async route being served; the label current_route() gives Flask routes
+request_route = contextvars.ContextVar('request_route', default='background')
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+async def get_async_pool():
+    """Creates this worker's aiomysql pool on first use."""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await aiomysql.create_pool(
+                host=db_config['host'],
+                user=db_config['user'],
+                password=db_config['password'],
+                db=db_config['database'],
+                minsize=async_db_pool_config['minsize'],
+                maxsize=async_db_pool_config['maxsize'],
+                pool_recycle=db_pool_config['recycle_seconds'],
+                autocommit=True
+            )
+    return _pool
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+async def run_query_async(query, params=None, cache_name=None):
+    """
+    Async counterpart of run_query (SELECT only). With cache_name it reads
+    through read_cache exactly like cached_query. Returns (rows, err).
+    """
+    # Looked up on the module each call, so a backend assigned to
+    # app.read_cache serves both entry points
+    read_cache = app_module.read_cache
+    if cache_name:
+        key = (cache_name, query, tuple(params or ()), False)
+        hit, rows = read_cache.get(key)
+        if hit:
+            return rows, None
+        generation = read_cache.generation(cache_name)
+
+    route = request_route.get()
+    try:
+        pool = await get_async_pool()
+        started = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), db_pool_config['checkout_timeout'])
+        finally:
+            metrics.observe('db_connect_ms', route, elapsed_ms(started))
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                started = time.perf_counter()
+                try:
+                    await cursor.execute(query, params or ())
+                finally:
+                    ms = elapsed_ms(started)
+                    metrics.observe('db_execute_ms', route, ms)
+                    log_slow_statement('query', query, params, ms, route=route)
+                started = time.perf_counter()
+                rows = await cursor.fetchall()
+                metrics.observe('db_fetch_ms', route, elapsed_ms(started))
+        finally:
+            pool.release(conn)
+    except asyncio.TimeoutError:
+        return None, "DB connection failed"
+    except (aiomysql.Error, OSError) as err:
+        return None, err
+
+    rows = list(rows)
+    if cache_name:
+        read_cache.set(key, rows, ttl=read_cache_ttls.get(cache_name), generation=generation)
+    return rows, None
+
+# --- ASYNC ROUTES ---
+# Each takes the query-string args and returns (status, payload, headers),
+# or None to hand the request to the Flask app instead.
+
+async def medicines(args):
+    query, params, limit, sort_key = build_medicines_query(args)
+    meds, err = await run_query_async(query, params, cache_name='medicines')
+    if err:
+        return 500, {"error": str(err)}, {}
+    meds, headers = split_page(meds, limit, sort_key)
+    return 200, meds, headers
+
+async def customer_orders(args):
+    cust_id = args.get('id')
+    if not cust_id:
+        return 400, {"error": "Customer ID is required"}, {}
+    if args.get('stream') == '1':
+        return None  # Streamed full history stays on the Flask route
+
+    query, params, limit = build_customer_orders_query(cust_id, args)
+    orders, err = await run_query_async(query, params)
+    if err:
+        return 500, {"error": str(err)}, {}
+    orders, headers = split_order_page(orders, limit)
+    return 200, orders, headers
+
+async def pharmacy_orders(args):
+    query, params, limit = build_pharmacy_orders_query(args.get('id'), args)
+    orders, err = await run_query_async(query, params)
+    if err:
+        return 500, {"error": str(err)}, {}
+    orders, headers = split_page(orders, limit, sub_order_sort_key)
+    return 200, orders, headers
+
+async def agent_deliveries(args):
+    query, params = build_agent_deliveries_query(args.get('id'))
+    deliveries, err = await run_query_async(query, params)
+    if err:
+        return 500, {"error": str(err)}, {}
+    deliveries, headers = apply_delivery_route(args.get('id'), deliveries)
+    return 200, deliveries, headers
+
+ASYNC_ROUTES = {
+    '/api/medicines': medicines,
+    '/api/customer/orders': customer_orders,
+    '/api/pharmacy/orders': pharmacy_orders,
+    '/api/agent/deliveries': agent_deliveries
+}
+
+# --- LIVE STATUS EVENTS ---
+# Same stream as the Flask route, but each open dashboard is a queue and a
+# waiting coroutine rather than a thread, so there is no per-worker cap.
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def send_text(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+def record_stream_response(started, status):
+    # Streams are timed to the first byte, like streamed Flask responses
+    route = request_route.get()
+    metrics.observe('request_ms', route, elapsed_ms(started))
+    metrics.count('responses', f"{route} {status}")
+
+async def status_events(scope, receive, send, args):
+    started = time.perf_counter()
+    headers = dict(scope.get('headers', []))
+    last_event_id = headers.get(b'last-event-id', b'').decode('latin-1')
+    try:
+        column, value, last_event_id = parse_status_event_args(args, last_event_id)
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)}, {})
+        return record_stream_response(started, 400)
+
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    # Subscribe before replaying so nothing falls in between; duplicates are skipped by id
+    events = status_event_bus.subscribe(column, value, notify=lambda: loop.call_soon_threadsafe(wakeup.set))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        missed = []
+        if last_event_id is not None:
+            missed, err = await run_query_async(*build_missed_events_query(column, value, last_event_id))
+            if err:
+                await send_json(send, 500, {"error": str(err)}, {})
+                return record_stream_response(started, 500)
+        stream = StatusEventStream(last_event_id, missed)
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]})
+        await send_text(send, stream.opening())
+        record_stream_response(started, 200)
+        while not disconnected.done():
+            wakeup.clear()
+            chunks = []
+            while True:
+                try:
+                    text = stream.live(events.get_nowait())
+                except queue.Empty:
+                    break
+                if text:
+                    chunks.append(text)
+            if chunks:
+                await send_text(send, ''.join(chunks))
+
+            woken = asyncio.ensure_future(wakeup.wait())
+            done, _ = await asyncio.wait({woken, disconnected}, timeout=status_events_config['keepalive_seconds'],
+                                         return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+            if not done:
+                await send_text(send, ": keepalive\n\n")
+    finally:
+        disconnected.cancel()
+        status_event_bus.unsubscribe(events)
+
+ASYNC_STREAMS = {
+    '/api/events': status_events
+}
+
+# --- FLASK APPLICATION ---
+wsgi_executor = ThreadPoolExecutor(max_workers=wsgi_threads, thread_name_prefix='wsgi')
+
+class ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    """
+    asgiref's WSGI bridge for one request, except the Flask app runs on
+    wsgi_executor. asgiref's own run_wsgi_app is thread-sensitive, which
+    would queue every sync route in the worker behind one shared thread.
+    The response iterable is closed afterwards, so Response.call_on_close
+    callbacks run (streamed queries hand their connection back that way).
+    """
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self.run_in_thread, thread_sensitive=False, executor=wsgi_executor)(body)
+
+    def run_in_thread(self, body):
+        environ = self.build_environ(self.scope, body)
+        iterable = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in iterable:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                if output:
+                    self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+async def flask_application(scope, receive, send):
+    await ThreadPoolWsgiInstance(app)(scope, receive, send)
+
+# --- ASGI APPLICATION ---
+async def send_json(send, status, payload, headers):
+    started = time.perf_counter()
+    body = json.dumps(payload, default=json_serializer).encode()
+    metrics.observe('json_ms', request_route.get(), elapsed_ms(started))
+    raw_headers = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(body)).encode())]
+    raw_headers += [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Same warm start as wsgi.py (blocking I/O, so off the event loop)
+            await asyncio.to_thread(create_app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_pool()
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    is_get = scope['type'] == 'http' and scope['method'] == 'GET'
+    handler = ASYNC_ROUTES.get(scope['path']) if is_get else None
+    stream = ASYNC_STREAMS.get(scope['path']) if is_get else None
+    if handler or stream:
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        args = {name: values[0] for name, values in parse_qs(query_string).items()}
+        route = f"GET {scope['path']}"
+        token = request_route.set(route)
+        started = time.perf_counter()
+        try:
+            if stream:
+                return await stream(scope, receive, send, args)
+            try:
+                result = await handler(args)
+            except ValueError as e:
+                result = (400, {"error": str(e)}, {})
+            if result is not None:
+                await send_json(send, *result)
+                metrics.observe('request_ms', route, elapsed_ms(started))
+                metrics.count('responses', f"{route} {result[0]}")
+                return
+        finally:
+            request_route.reset(token)
+
+    await flask_application(scope, receive, send)
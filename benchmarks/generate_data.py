@@ -0,0 +1,236 @@
+"""
+Synthetic data generator for the MediQuick benchmarks.
+
+Writes a SQL file that scales up 3_data_population.sql: N customers (each
+with a paid cart), pharmacies and delivery agents clustered around a few
+cities, a medicine catalogue, stock for every pharmacy, substitutes, and a
+history of past orders. Load it after scripts 1-6:
+
+    python benchmarks/generate_data.py --customers 10000 --orders 50000 > bench_data.sql
+    mysql -u root -p mediquick < bench_data.sql
+
+New ids start after the rows already in each table, so it can be loaded on
+top of the seed data. The same --seed always produces the same file. Only
+the tables of the original schema are written, so the file also loads into
+the schema of older commits; the rollup refresh at the end runs only where
+sp_refresh_sales_rollups exists.
+"""
+import argparse
+import random
+import sys
+
+# (city, state, latitude, longitude)
+CITIES = [
+    ('Mumbai', 'Maharashtra', 19.0760, 72.8777),
+    ('Bengaluru', 'Karnataka', 12.9716, 77.5946),
+    ('Kolkata', 'West Bengal', 22.5726, 88.3639),
+    ('Delhi', 'Delhi', 28.6139, 77.2090),
+    ('Chennai', 'Tamil Nadu', 13.0827, 80.2707),
+    ('Hyderabad', 'Telangana', 17.3850, 78.4867),
+    ('Pune', 'Maharashtra', 18.5204, 73.8567),
+    ('Ahmedabad', 'Gujarat', 23.0225, 72.5714),
+]
+CITY_SPREAD = 0.15  # Degrees of jitter around each city centre
+
+# Medicine names are PREFIX + SUFFIX + number, so search terms hit many rows
+NAME_PREFIXES = ['Para', 'Amoxi', 'Ceti', 'Ibu', 'Metfor', 'Azithro', 'Panto', 'Dolo', 'Vita', 'Calci']
+NAME_SUFFIXES = ['cetamol', 'cillin', 'rizine', 'profen', 'min', 'mycin', 'prazole', 'forte', 'plus', 'sol']
+MED_TYPES = [('Tablet', 'strip', '10 tablets'), ('Capsule', 'strip', '10 capsules'),
+             ('Syrup', 'bottle', '100ml'), ('Injection', 'vial', '10ml')]
+
+ROWS_PER_INSERT = 1000
+
+
+def sql_value(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def write_inserts(out, table, columns, rows, id_base=None):
+    """
+    Multi-row INSERTs, ROWS_PER_INSERT at a time. With id_base, the first
+    column holds 1-based offsets that are written as @id_base + offset.
+    """
+    for start in range(0, len(rows), ROWS_PER_INSERT):
+        chunk = rows[start:start + ROWS_PER_INSERT]
+        values = []
+        for row in chunk:
+            cells = [sql_value(v) for v in row]
+            if id_base:
+                cells[0] = f'@{id_base} + {row[0]}'
+            values.append('(' + ', '.join(cells) + ')')
+        out.write(f"INSERT INTO {table} ({', '.join(columns)}) VALUES\n")
+        out.write(',\n'.join(values) + ';\n')
+
+
+def near(rng, city):
+    return (round(city[2] + rng.uniform(-CITY_SPREAD, CITY_SPREAD), 6),
+            round(city[3] + rng.uniform(-CITY_SPREAD, CITY_SPREAD), 6))
+
+
+def generate(args, out):
+    rng = random.Random(args.seed)
+
+    out.write(f"-- Generated by benchmarks/generate_data.py {' '.join(sys.argv[1:])}\n")
+    out.write("SET FOREIGN_KEY_CHECKS = 1;\nSET autocommit = 0;\n")
+    for table, column, var in [('Customer', 'cust_id', 'cust0'), ('Cart', 'cart_id', 'cart0'),
+                               ('Pharmacy', 'pharmacy_id', 'pharm0'), ('Medicine', 'med_id', 'med0'),
+                               ('Delivery_Agent', 'agent_id', 'agent0'), ('Doctor', 'doc_id', 'doc0'),
+                               ('Orders', 'order_id', 'order0')]:
+        out.write(f"SET @{var} = (SELECT COALESCE(MAX({column}), 0) FROM {table});\n")
+
+    # Pharmacies and agents, spread over the cities
+    pharmacies = []  # (offset, city index)
+    rows = []
+    for i in range(1, args.pharmacies + 1):
+        city_idx = i % len(CITIES)
+        city = CITIES[city_idx]
+        lat, lng = near(rng, city)
+        pharmacies.append((i, city_idx))
+        rows.append((i, f'BENCH-{i:06d}', f'Bench Pharmacy {i}', f'9{rng.randrange(10**9):09d}',
+                     f'{i} Market Road', city[0], city[1], f'{rng.randrange(100000, 999999)}', lat, lng))
+    write_inserts(out, 'Pharmacy', ['pharmacy_id', 'license_no', 'pharm_name', 'contact_phone', 'address_street',
+                                    'address_city', 'address_state', 'address_pincode', 'latitude', 'longitude'],
+                  rows, id_base='pharm0')
+
+    rows = []
+    for i in range(1, args.agents + 1):
+        lat, lng = near(rng, CITIES[i % len(CITIES)])
+        rows.append((i, f'Bench Agent {i}', f'8{rng.randrange(10**9):09d}', lat, lng, 'Available'))
+    write_inserts(out, 'Delivery_Agent', ['agent_id', 'agent_name', 'phone', 'current_lat', 'current_lng', 'status'],
+                  rows, id_base='agent0')
+
+    rows = [(i, f'Dr. Bench {i}', f'7{rng.randrange(10**9):09d}') for i in range(1, args.doctors + 1)]
+    write_inserts(out, 'Doctor', ['doc_id', 'doc_name', 'contact_phone'], rows, id_base='doc0')
+
+    # Medicine catalogue; roughly one in five needs a prescription
+    medicines = []  # (offset, base price)
+    rows = []
+    for i in range(1, args.medicines + 1):
+        med_type, unit, unit_size = rng.choice(MED_TYPES)
+        name = f'{rng.choice(NAME_PREFIXES)}{rng.choice(NAME_SUFFIXES)} {i}'
+        medicines.append((i, round(rng.uniform(10, 500), 2)))
+        rows.append((i, name, med_type, f'Benchmark medicine {i}', unit, unit_size, rng.random() < 0.2))
+    write_inserts(out, 'Medicine', ['med_id', 'med_name', 'type', 'description', 'unit', 'unit_size',
+                                    'prescription_required'], rows, id_base='med0')
+
+    rows = []
+    for i in range(1, args.medicines + 1):
+        for substitute in rng.sample(range(1, args.medicines + 1), min(2, args.medicines)):
+            if substitute != i:
+                rows.append((i, substitute))
+    out.write("\n".join(
+        f"INSERT IGNORE INTO Medicine_Substitute (med_id, substitute_med_id) VALUES "
+        + ', '.join(f'(@med0 + {a}, @med0 + {b})' for a, b in rows[start:start + ROWS_PER_INSERT]) + ';'
+        for start in range(0, len(rows), ROWS_PER_INSERT)
+    ) + '\n')
+
+    # Stock: each pharmacy carries a random share of the catalogue
+    stocked = {}  # pharmacy offset -> [(med offset, price), ...]
+    lines = []
+    for pharm, _ in pharmacies:
+        carried = rng.sample(medicines, max(1, int(len(medicines) * args.stock_density)))
+        stocked[pharm] = [(med, round(price * rng.uniform(0.9, 1.1), 2)) for med, price in carried]
+        for med, price in stocked[pharm]:
+            lines.append(f'(@pharm0 + {pharm}, @med0 + {med}, {rng.randrange(500, 5000)}, {price})')
+    for start in range(0, len(lines), ROWS_PER_INSERT):
+        out.write("INSERT INTO Available_Stock (pharmacy_id, med_id, current_stock, price) VALUES\n")
+        out.write(',\n'.join(lines[start:start + ROWS_PER_INSERT]) + ';\n')
+    out.write("COMMIT;\n")
+
+    # Customers, each with an empty paid cart ready for checkout workloads
+    customers = []  # (offset, city index)
+    rows = []
+    for i in range(1, args.customers + 1):
+        city_idx = rng.randrange(len(CITIES))
+        city = CITIES[city_idx]
+        lat, lng = near(rng, city)
+        customers.append((i, city_idx))
+        rows.append((i, f'Bench{i}', 'Customer', f'bench.{i}@example.com', f'{i} Residency Road',
+                     city[0], city[1], f'{rng.randrange(100000, 999999)}', lat, lng))
+    write_inserts(out, 'Customer', ['cust_id', 'first_name', 'last_name', 'email', 'address_street', 'address_city',
+                                    'address_state', 'address_pincode', 'latitude', 'longitude'],
+                  rows, id_base='cust0')
+    out.write("INSERT INTO Cart (cart_id, cust_id, payment_status)\n"
+              "SELECT @cart0 + (cust_id - @cust0), cust_id, 'Paid' FROM Customer WHERE cust_id > @cust0;\n")
+    out.write("COMMIT;\n")
+
+    # Order history over the last 90 days. The newest --pending-orders are
+    # still waiting for an agent, so the dispatcher has work to do.
+    pharmacies_by_city = {}
+    for pharm, city_idx in pharmacies:
+        pharmacies_by_city.setdefault(city_idx, []).append(pharm)
+
+    order_rows, sub_order_rows, item_rows = [], [], []
+    for i in range(1, args.orders + 1):
+        cust, city_idx = rng.choice(customers)
+        age_seconds = rng.randrange(300, 90 * 24 * 3600)  # Relative to load time
+        pending = i > args.orders - args.pending_orders
+        nearby = pharmacies_by_city.get(city_idx) or [p for p, _ in pharmacies]
+        order_total = 0
+        for sub_order_id, pharm in enumerate(rng.sample(nearby, min(len(nearby), rng.choice([1, 1, 1, 2]))), 1):
+            sub_total = 0
+            for med, price in rng.sample(stocked[pharm], min(len(stocked[pharm]), rng.randint(1, 3))):
+                qty = rng.randint(1, 4)
+                sub_total += qty * price
+                item_rows.append(f'(@order0 + {i}, {sub_order_id}, @med0 + {med}, {qty}, {price})')
+            order_total += sub_total
+            status = 'Processing' if pending else rng.choice(['Delivered'] * 8 + ['Cancelled'])
+            sub_order_rows.append(f"(@order0 + {i}, {sub_order_id}, @pharm0 + {pharm}, {round(sub_total, 2)}, '{status}')")
+        final_status = 'Processing' if pending else 'Delivered'
+        order_rows.append(f"(@order0 + {i}, @cust0 + {cust}, NOW() - INTERVAL {age_seconds} SECOND, '{final_status}', "
+                          f"{round(order_total, 2)})")
+
+    for table, columns, lines in [
+        ('Orders', 'order_id, cust_id, order_date, final_status, total_amount', order_rows),
+        ('Sub_Order', 'order_id, sub_order_id, pharmacy_id, sub_total, status', sub_order_rows),
+        ('Order_Medicine', 'order_id, sub_order_id, med_id, quantity, price_at_order', item_rows),
+    ]:
+        for start in range(0, len(lines), ROWS_PER_INSERT):
+            out.write(f"INSERT INTO {table} ({columns}) VALUES\n")
+            out.write(',\n'.join(lines[start:start + ROWS_PER_INSERT]) + ';\n')
+        out.write("COMMIT;\n")
+
+    # Fold the history into the reporting rollups, where the schema has them
+    out.write(
+        "SET @refresh_rollups = IF(EXISTS(\n"
+        "    SELECT 1 FROM information_schema.ROUTINES\n"
+        "    WHERE ROUTINE_SCHEMA = DATABASE() AND ROUTINE_NAME = 'sp_refresh_sales_rollups'\n"
+        "), 'CALL sp_refresh_sales_rollups()', 'DO 0');\n"
+        "PREPARE refresh_rollups FROM @refresh_rollups;\n"
+        "EXECUTE refresh_rollups;\n"
+        "DEALLOCATE PREPARE refresh_rollups;\n"
+        "COMMIT;\nSET autocommit = 1;\n"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=10000)
+    parser.add_argument('--pharmacies', type=int, default=500)
+    parser.add_argument('--medicines', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--agents', type=int, default=300)
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--pending-orders', type=int, default=1000,
+                        help='Newest orders left waiting for an agent, for the dispatch workload (default 1000)')
+    parser.add_argument('--stock-density', type=float, default=0.2,
+                        help='Share of the catalogue each pharmacy stocks (default 0.2)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write here instead of stdout')
+    args = parser.parse_args()
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            generate(args, out)
+    else:
+        generate(args, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+Workload runner for the MediQuick benchmarks.
+
+Drives a running server (python app.py, gunicorn or uvicorn) with scripted
+workloads and writes throughput and latency percentiles to a JSON file:
+
+    python benchmarks/run_benchmark.py --duration 60 --concurrency 16 --output results/abc123.json
+    python benchmarks/run_benchmark.py --baseline results/abc123.json --output results/def456.json
+
+Workloads (pick with --workloads, default all):
+    search       GET  /api/medicines?q=<name prefix>
+    add_to_cart  POST /api/customer/cart?id=<customer>
+    checkout     add items, pay, then POST /api/cart/process?id=<customer>
+    dispatch     POST /api/admin/dispatch (one thread; see below)
+    reports      GET  /api/reports?name=<report>
+
+Customer and medicine ids are read from the database loaded with
+generate_data.py (connection settings from db_config in app.py). Each thread
+uses its own customers, so carts are never shared between threads.
+
+The dispatcher plans under a MySQL named lock, so concurrent dispatch calls
+would mostly time a no-op; that workload runs on one thread. Before each
+call it hands the sub-orders assigned to benchmark agents back to the queue
+(untimed), so every timed call has real work to plan.
+
+To benchmark an older commit, run this script from the current tree against
+a server started from the older one (see benchmarks/README.md), with
+--commit naming the server's commit.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib import error as urlerror
+from urllib import request as urlrequest
+from urllib.parse import urlencode
+
+import mysql.connector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import db_config  # noqa: E402
+
+from generate_data import NAME_PREFIXES  # noqa: E402
+
+REPORT_NAMES = ['aggregate_query', 'nested_query', 'medicine_sales']
+PERCENTILES = [50, 95, 99]
+REQUEST_TIMEOUT = 60  # Seconds before a single request counts as an error
+
+
+class Client:
+    """Minimal JSON-over-HTTP client (stdlib only, one per thread)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def call(self, method, path, params=None, body=None):
+        """Returns (status, payload). Network failures return status 0."""
+        url = self.base_url + path + ('?' + urlencode(params) if params else '')
+        data = json.dumps(body).encode() if body is not None else None
+        req = urlrequest.Request(url, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with urlrequest.urlopen(req, timeout=REQUEST_TIMEOUT) as resp:
+                return resp.status, resp.read()
+        except urlerror.HTTPError as e:
+            return e.code, e.read()
+        except (urlerror.URLError, OSError):
+            return 0, b''
+
+
+class Recorder:
+    """Latency samples and status codes per workload, shared by all threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # workload -> [ms, ...]
+        self.statuses = {}  # workload -> {status: count}
+        self.totals = {}  # workload -> {name: total}, e.g. sub-orders assigned by dispatch
+
+    def record(self, workload, ms, status):
+        with self._lock:
+            self.samples.setdefault(workload, []).append(ms)
+            counts = self.statuses.setdefault(workload, {})
+            counts[status] = counts.get(status, 0) + 1
+
+    def add(self, workload, name, amount):
+        with self._lock:
+            totals = self.totals.setdefault(workload, {})
+            totals[name] = totals.get(name, 0) + amount
+
+    def timed(self, workload, client, method, path, params=None, body=None):
+        started = time.perf_counter()
+        status, payload = client.call(method, path, params, body)
+        self.record(workload, (time.perf_counter() - started) * 1000, status)
+        return status, payload
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+def load_ids():
+    """Benchmark customers and over-the-counter medicines from generate_data.py."""
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT cust_id FROM Customer WHERE email LIKE 'bench.%' ORDER BY cust_id")
+        customers = [row[0] for row in cursor.fetchall()]
+        cursor.execute("""
+            SELECT med_id FROM Medicine
+            WHERE prescription_required = FALSE AND description LIKE 'Benchmark medicine%'
+            ORDER BY med_id
+        """)
+        medicines = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+    return customers, medicines
+
+
+# --- WORKLOADS ---
+# Each runs one iteration on behalf of a thread.
+
+def search(ctx):
+    ctx.recorder.timed('search', ctx.client, 'GET', '/api/medicines',
+                       {'q': ctx.rng.choice(NAME_PREFIXES)})
+
+def add_to_cart(ctx):
+    ctx.recorder.timed('add_to_cart', ctx.client, 'POST', '/api/customer/cart',
+                       {'id': ctx.next_customer()},
+                       {'med_id': ctx.rng.choice(ctx.medicines), 'qty': ctx.rng.randint(1, 3)})
+
+def checkout(ctx):
+    # Timed end to end: fill the cart, pay, then place the order
+    cust_id = ctx.next_customer()
+    started = time.perf_counter()
+    for med_id in ctx.rng.sample(ctx.medicines, min(len(ctx.medicines), ctx.rng.randint(1, 3))):
+        status, _ = ctx.client.call('POST', '/api/customer/cart', {'id': cust_id},
+                                    {'med_id': med_id, 'qty': ctx.rng.randint(1, 2)})
+        if status != 200:
+            break
+    else:
+        status, _ = ctx.client.call('POST', f'/api/cart/{cust_id}/pay_db_update')
+        if status == 200:
+            status, _ = ctx.client.call('POST', '/api/cart/process', {'id': cust_id})
+    ctx.recorder.record('checkout', (time.perf_counter() - started) * 1000, status)
+
+def requeue_dispatched(conn):
+    """Puts sub-orders assigned to benchmark agents back in the dispatch queue."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE Sub_Order so
+            JOIN Delivery_Agent da ON so.agent_id = da.agent_id
+            SET so.status = 'Processing', so.agent_id = NULL
+            WHERE so.status = 'Assigned' AND da.agent_name LIKE 'Bench Agent %'
+        """)
+        cursor.execute("""
+            UPDATE Delivery_Agent SET status = 'Available'
+            WHERE status = 'Busy' AND agent_name LIKE 'Bench Agent %'
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+def dispatch(ctx):
+    requeue_dispatched(ctx.db())
+    status, payload = ctx.recorder.timed('dispatch', ctx.client, 'POST', '/api/admin/dispatch')
+    if status == 200:
+        ctx.recorder.add('dispatch', 'assigned', len(json.loads(payload).get('assignments', [])))
+
+def reports(ctx):
+    ctx.recorder.timed('reports', ctx.client, 'GET', '/api/reports', {'name': ctx.rng.choice(REPORT_NAMES)})
+
+WORKLOADS = {
+    'search': search,
+    'add_to_cart': add_to_cart,
+    'checkout': checkout,
+    'dispatch': dispatch,
+    'reports': reports
+}
+SINGLE_THREADED = {'dispatch'}
+
+
+class WorkerContext:
+    def __init__(self, base_url, recorder, customers, medicines, seed):
+        self.client = Client(base_url)
+        self.recorder = recorder
+        self.customers = customers
+        self.medicines = medicines
+        self.rng = random.Random(seed)
+        self._next = 0
+        self._db = None
+
+    def db(self):
+        """This thread's own MySQL connection, for untimed setup steps."""
+        if self._db is None:
+            self._db = mysql.connector.connect(**db_config)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+    def next_customer(self):
+        cust_id = self.customers[self._next % len(self.customers)]
+        self._next += 1
+        return cust_id
+
+
+def run_workload(name, args, customers, medicines):
+    """Runs one workload with args.concurrency threads for args.duration seconds."""
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    step = WORKLOADS[name]
+    concurrency = 1 if name in SINGLE_THREADED else args.concurrency
+
+    def worker(index):
+        ctx = WorkerContext(args.base_url, recorder, customers[index::concurrency] or customers,
+                            medicines, args.seed + index)
+        try:
+            while time.monotonic() < deadline:
+                step(ctx)
+        finally:
+            ctx.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = sorted(recorder.samples.get(name, []))
+    statuses = recorder.statuses.get(name, {})
+    errors = sum(count for status, count in statuses.items() if not 200 <= status < 300)
+    result = {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'rps': round(len(samples) / elapsed, 2) if elapsed else 0
+    }
+    for pct in PERCENTILES:
+        value = percentile(samples, pct)
+        result[f'p{pct}_ms'] = round(value, 2) if value is not None else None
+    result['max_ms'] = round(samples[-1], 2) if samples else None
+    result.update(recorder.totals.get(name, {}))
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Prints each workload's change against a previous results file."""
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for name, current in results['workloads'].items():
+        previous = baseline.get('workloads', {}).get(name)
+        if not previous:
+            continue
+        changes = []
+        for key in ['rps'] + [f'p{pct}_ms' for pct in PERCENTILES]:
+            old, new = previous.get(key), current.get(key)
+            if old and new is not None:
+                changes.append(f"{key} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+        print(f"  {name:12} " + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help='Comma-separated workloads to run, in order (default: all)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per workload (default 30)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads (default 8)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--commit', help="Commit the server runs (default: this tree's HEAD)")
+    parser.add_argument('--output', help='Write the results JSON here (default: stdout)')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"Unknown workload(s): {', '.join(unknown)}")
+
+    customers, medicines = load_ids()
+    if not customers or not medicines:
+        sys.exit("No benchmark data found; load the output of generate_data.py first.")
+
+    # Start from empty server-side histograms so the snapshot matches this run
+    Client(args.base_url).call('DELETE', '/api/metrics')
+
+    results = {
+        'commit': args.commit or git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'base_url': args.base_url,
+        'duration_seconds': args.duration,
+        'concurrency': args.concurrency,
+        'workloads': {}
+    }
+    for name in names:
+        threads = 1 if name in SINGLE_THREADED else args.concurrency
+        print(f"Running {name} for {args.duration}s with {threads} thread(s)...", file=sys.stderr)
+        results['workloads'][name] = run_workload(name, args, customers, medicines)
+
+    status, payload = Client(args.base_url).call('GET', '/api/metrics')
+    results['server_metrics'] = json.loads(payload) if status == 200 else None
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
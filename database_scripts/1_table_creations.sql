@@ -87,6 +87,7 @@ CREATE TABLE Cart (
   cust_id INT NOT NULL,
   cart_created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   requires_prescription BOOLEAN DEFAULT FALSE,  -- auto-calculated from items  
+  prescription_item_count INT NOT NULL DEFAULT 0, -- items needing a prescription (kept by cart triggers)
   prescription_status ENUM('Not Uploaded','To Be Verified','Verified','Rejected') DEFAULT 'Not Uploaded',
   total_amount DECIMAL(12,2) NOT NULL DEFAULT 0.00,
   payment_status ENUM('Pending','Paid') DEFAULT 'Pending',
@@ -187,9 +188,12 @@ CREATE TABLE Prescription (
   uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   status ENUM('To Be Verified','Verified','Rejected') DEFAULT 'To Be Verified',
   verified_at TIMESTAMP NULL,
+  lease_doc_id INT NULL,           -- doctor currently holding it in their work queue
+  lease_expires_at DATETIME NULL,  -- back in the queue for everyone after this
   FOREIGN KEY (order_id) REFERENCES Orders(order_id) ON DELETE CASCADE ON UPDATE CASCADE,
   FOREIGN KEY (cust_id) REFERENCES Customer(cust_id) ON DELETE CASCADE ON UPDATE CASCADE,
-  FOREIGN KEY (assigned_doc_id) REFERENCES Doctor(doc_id) ON DELETE SET NULL ON UPDATE CASCADE
+  FOREIGN KEY (assigned_doc_id) REFERENCES Doctor(doc_id) ON DELETE SET NULL ON UPDATE CASCADE,
+  FOREIGN KEY (lease_doc_id) REFERENCES Doctor(doc_id) ON DELETE SET NULL ON UPDATE CASCADE
 );
 -- executed till here
 
@@ -224,9 +228,86 @@ CREATE TABLE SubOrder_Audit (
   FOREIGN KEY (order_id, sub_order_id) REFERENCES Sub_Order(order_id, sub_order_id) ON DELETE CASCADE ON UPDATE CASCADE
 );
 
-/* 18) Useful Indexes */
+/* 18) MEDICINE_STOCK_SUMMARY (per-medicine totals across all pharmacies, kept up to date by triggers on Available_Stock) */
+CREATE TABLE Medicine_Stock_Summary (
+  med_id INT PRIMARY KEY,
+  total_stock INT NOT NULL DEFAULT 0,
+  min_price DECIMAL(10,2) NOT NULL DEFAULT 0.00,
+  pharmacy_count INT NOT NULL DEFAULT 0,
+  FOREIGN KEY (med_id) REFERENCES Medicine(med_id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+/* 19) STATUS_EVENT (append-only feed of Sub_Order changes, written by triggers, read by /api/events) */
+CREATE TABLE Status_Event (
+  event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+  order_id INT NOT NULL,
+  sub_order_id INT NOT NULL,
+  cust_id INT NOT NULL,
+  pharmacy_id INT NOT NULL,
+  agent_id INT NULL,
+  status ENUM('Processing','Assigned','Shipped','Delivered','Cancelled') NOT NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+/* 20) DAILY_PHARMACY_SALES (reporting rollup: sub-orders and sales per pharmacy per day) */
+CREATE TABLE Daily_Pharmacy_Sales (
+  sales_date DATE NOT NULL,
+  pharmacy_id INT NOT NULL,
+  sub_order_count INT NOT NULL DEFAULT 0,
+  total_sales DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (sales_date, pharmacy_id),
+  FOREIGN KEY (pharmacy_id) REFERENCES Pharmacy(pharmacy_id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+/* 21) DAILY_MEDICINE_SALES (reporting rollup: units and revenue per medicine per day) */
+CREATE TABLE Daily_Medicine_Sales (
+  sales_date DATE NOT NULL,
+  med_id INT NOT NULL,
+  order_count INT NOT NULL DEFAULT 0,
+  quantity_sold INT NOT NULL DEFAULT 0,
+  revenue DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+  PRIMARY KEY (sales_date, med_id),
+  FOREIGN KEY (med_id) REFERENCES Medicine(med_id) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+/* 22) REPORT_WATERMARK (every order_id up to last_order_id is folded into the rollup) */
+CREATE TABLE Report_Watermark (
+  rollup_name VARCHAR(50) PRIMARY KEY,
+  last_order_id INT NOT NULL DEFAULT 0,
+  refreshed_at TIMESTAMP NULL
+);
+
+/* 23) REPORT_FOLDED_ORDER (orders above the watermark already folded; an order with a
+       lower id can still commit later, so these are tracked one by one until the
+       watermark passes them) */
+CREATE TABLE Report_Folded_Order (
+  rollup_name VARCHAR(50) NOT NULL,
+  order_id INT NOT NULL,
+  PRIMARY KEY (rollup_name, order_id)
+);
+
+/* 24) REPORT_JOB (report jobs shared by every app worker, so any worker can answer a poll) */
+CREATE TABLE Report_Job (
+  job_id CHAR(32) PRIMARY KEY,
+  status ENUM('running','done','failed') NOT NULL DEFAULT 'running',
+  result LONGTEXT NULL,        -- JSON rows once done
+  error VARCHAR(500) NULL,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  finished_at TIMESTAMP NULL,
+  INDEX idx_report_job_finished (finished_at)
+);
+
+/* 25) Useful Indexes */
 CREATE INDEX idx_available_stock_med ON Available_Stock(med_id);
-CREATE INDEX idx_orders_cust ON Orders(cust_id);
+CREATE INDEX idx_orders_cust ON Orders(cust_id, order_date); -- also serves the order-history keyset (order_date, order_id)
 CREATE INDEX idx_suborder_pharm ON Sub_Order(pharmacy_id);
+CREATE INDEX idx_suborder_status ON Sub_Order(status);
+CREATE INDEX idx_prescription_status_uploaded ON Prescription(status, uploaded_at); -- work queue, oldest first
+CREATE INDEX idx_prescription_lease ON Prescription(lease_doc_id, status); -- a doctor's leased batch
 CREATE INDEX idx_ordermedicine_med ON Order_Medicine(med_id);
+CREATE INDEX idx_pharmacy_location ON Pharmacy(latitude, longitude); -- bounded-radius pharmacy lookup
+CREATE FULLTEXT INDEX ft_medicine_name ON Medicine(med_name); -- catalogue search ranking
+CREATE FULLTEXT INDEX ft_medicine_search ON Medicine(med_name, description); -- catalogue search
+CREATE INDEX idx_status_event_created ON Status_Event(created_at); -- pruning old events
+CREATE INDEX idx_daily_medicine_sales_med ON Daily_Medicine_Sales(med_id, sales_date); -- "never ordered" report
 
@@ -20,6 +20,7 @@ GRANT SELECT ON mediquick.Sub_Order TO 'customer_role'@'localhost';
 GRANT SELECT ON mediquick.Order_Medicine TO 'customer_role'@'localhost';
 GRANT SELECT ON mediquick.Medicine TO 'customer_role'@'localhost';
 GRANT SELECT ON mediquick.Available_Stock TO 'customer_role'@'localhost';
+GRANT SELECT ON mediquick.Medicine_Stock_Summary TO 'customer_role'@'localhost';
 GRANT SELECT ON mediquick.Pharmacy TO 'customer_role'@'localhost';
 -- Customers can insert/update their own carts and orders
 GRANT INSERT, UPDATE ON mediquick.Cart TO 'customer_role'@'localhost';
@@ -42,6 +43,7 @@ GRANT INSERT(assigned_doc_id, verified_at) ON mediquick.Prescription TO 'doctor_
 CREATE ROLE IF NOT EXISTS 'pharmacy_role'@'localhost';
 -- Pharmacies can view stock, orders, and related data
 GRANT SELECT ON mediquick.Available_Stock TO 'pharmacy_role'@'localhost';
+GRANT SELECT ON mediquick.Medicine_Stock_Summary TO 'pharmacy_role'@'localhost';
 GRANT SELECT ON mediquick.Sub_Order TO 'pharmacy_role'@'localhost';
 GRANT SELECT ON mediquick.Orders TO 'pharmacy_role'@'localhost';
 GRANT SELECT ON mediquick.Order_Medicine TO 'pharmacy_role'@'localhost';
@@ -62,6 +62,25 @@ BEGIN
 END$$
 DELIMITER ;
 
+-- Cost of adding one pharmacy to an order: a fixed charge for the extra
+-- sub-order (one more pickup and agent trip) plus its distance from the
+-- customer. fn_simple_distance is in degrees; one degree is roughly 111 km.
+-- Compared against item prices by sp_allocate_cart.
+DELIMITER $$
+CREATE FUNCTION fn_pharmacy_stop_cost(
+    cust_lat DECIMAL(10,6),
+    cust_lng DECIMAL(10,6),
+    pharm_lat DECIMAL(10,6),
+    pharm_lng DECIMAL(10,6)
+) RETURNS DECIMAL(12,2) DETERMINISTIC
+BEGIN
+    DECLARE v_per_stop DECIMAL(12,2) DEFAULT 30.00;  -- per extra sub-order
+    DECLARE v_per_km DECIMAL(12,2) DEFAULT 5.00;     -- per km from the customer
+
+    RETURN v_per_stop + v_per_km * 111 * COALESCE(fn_simple_distance(cust_lat, cust_lng, pharm_lat, pharm_lng), 0);
+END$$
+DELIMITER ;
+
 
 DELIMITER $$
 CREATE FUNCTION fn_check_payment_status(p_cart_id INT) RETURNS ENUM('Pending','Paid') DETERMINISTIC
@@ -131,10 +150,18 @@ BEGIN
     JOIN Available_Stock av ON av.med_id = ci.med_id AND av.pharmacy_id = ci.assigned_pharmacy_id
     WHERE ci.cart_id = p_cart_id;
 
+    -- Conditional decrement: the rows are locked by sp_reserve_cart_stock, so a
+    -- short row here means stock was never reserved; fail instead of overselling
     UPDATE Available_Stock av
     JOIN Cart_Item ci ON av.med_id = ci.med_id AND av.pharmacy_id = ci.assigned_pharmacy_id
     SET av.current_stock = av.current_stock - ci.quantity
-    WHERE ci.cart_id = p_cart_id;
+    WHERE ci.cart_id = p_cart_id
+      AND av.current_stock >= ci.quantity;
+
+    IF ROW_COUNT() < (SELECT COUNT(*) FROM Cart_Item WHERE cart_id = p_cart_id) THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'Insufficient stock to complete this order.';
+    END IF;
 
     UPDATE Sub_Order so
     JOIN (
@@ -155,7 +182,7 @@ CREATE FUNCTION fn_clear_cart(p_cart_id INT) RETURNS BOOLEAN DETERMINISTIC
 BEGIN
     DELETE FROM Cart_Item WHERE cart_id = p_cart_id;
     UPDATE Cart
-    SET total_amount = 0, requires_prescription = FALSE
+    SET total_amount = 0, requires_prescription = FALSE, prescription_item_count = 0
     WHERE cart_id = p_cart_id;
 
     RETURN TRUE;
@@ -184,3 +211,35 @@ BEGIN
     RETURN v_requires_prescription;
 END$$
 DELIMITER ;
+
+-- ==============================
+-- Per-row helpers for the incremental cart triggers (T3-T5).
+-- Each is a single primary-key lookup, so a Cart_Item change costs O(1)
+-- instead of re-scanning the whole cart.
+-- ==============================
+DELIMITER $$
+CREATE FUNCTION fn_cart_item_amount(p_med_id INT, p_pharmacy_id INT, p_quantity INT)
+RETURNS DECIMAL(12,2)
+DETERMINISTIC
+BEGIN
+    -- Unassigned items (no pharmacy yet) don't count, same as fn_get_cart_total
+    RETURN COALESCE((
+        SELECT p_quantity * price
+        FROM Available_Stock
+        WHERE pharmacy_id = p_pharmacy_id AND med_id = p_med_id
+    ), 0);
+END$$
+DELIMITER ;
+
+DELIMITER $$
+CREATE FUNCTION fn_is_prescription_medicine(p_med_id INT)
+RETURNS INT
+DETERMINISTIC
+BEGIN
+    RETURN COALESCE((
+        SELECT IF(prescription_required, 1, 0)
+        FROM Medicine
+        WHERE med_id = p_med_id
+    ), 0);
+END$$
+DELIMITER ;
@@ -31,6 +31,9 @@ END$$
 DELIMITER ;
 
 /* T3) cart_item_after_insert: Automatically update Cart totals and prescription flag when Cart_Item table changes.
+       Applies only this row's delta (quantity x price at the assigned pharmacy), so bulk
+       changes such as fn_clear_cart or sp_validate_cart_stock stay linear in cart size.
+       Single-table UPDATE assigns left to right, so requires_prescription sees the new count.
 ==========================================================*/
 DELIMITER $$
 CREATE TRIGGER trg_cart_item_after_insert
@@ -39,13 +42,17 @@ FOR EACH ROW
 BEGIN
     UPDATE Cart
     SET
-        total_amount = fn_get_cart_total(NEW.cart_id),
-        requires_prescription = fn_is_prescription_required(NEW.cart_id)
+        total_amount = total_amount
+            + fn_cart_item_amount(NEW.med_id, NEW.assigned_pharmacy_id, NEW.quantity),
+        prescription_item_count = prescription_item_count + fn_is_prescription_medicine(NEW.med_id),
+        requires_prescription = (prescription_item_count > 0)
     WHERE cart_id = NEW.cart_id;
 END$$
 DELIMITER ;
 
 /* T4) cart_item_after_update 
+       The deltas use current prices and prescription flags; T6-T8 and T11 re-total the
+       carts holding a medicine whenever those change, so OLD's amount is what T3 added.
 =============================*/
 DELIMITER $$
 CREATE TRIGGER trg_cart_item_after_update
@@ -54,8 +61,13 @@ FOR EACH ROW
 BEGIN
     UPDATE Cart
     SET
-        total_amount = fn_get_cart_total(NEW.cart_id),
-        requires_prescription = fn_is_prescription_required(NEW.cart_id)
+        total_amount = total_amount
+            - fn_cart_item_amount(OLD.med_id, OLD.assigned_pharmacy_id, OLD.quantity)
+            + fn_cart_item_amount(NEW.med_id, NEW.assigned_pharmacy_id, NEW.quantity),
+        prescription_item_count = prescription_item_count
+            - fn_is_prescription_medicine(OLD.med_id)
+            + fn_is_prescription_medicine(NEW.med_id),
+        requires_prescription = (prescription_item_count > 0)
     WHERE cart_id = NEW.cart_id;
 END$$
 DELIMITER ;
@@ -69,20 +81,184 @@ FOR EACH ROW
 BEGIN
     UPDATE Cart
     SET
-        total_amount = fn_get_cart_total(OLD.cart_id),
-        requires_prescription = fn_is_prescription_required(OLD.cart_id)
+        total_amount = total_amount
+            - fn_cart_item_amount(OLD.med_id, OLD.assigned_pharmacy_id, OLD.quantity),
+        prescription_item_count = prescription_item_count - fn_is_prescription_medicine(OLD.med_id),
+        requires_prescription = (prescription_item_count > 0)
     WHERE cart_id = OLD.cart_id;
 END$$
 DELIMITER ;
 
+/* T6) available_stock_after_insert: Keep Medicine_Stock_Summary in step with Available_Stock.
+       Covers new stock rows from the pharmacy dashboard and new medicine creation.
+       Cart items already assigned to this pharmacy start counting (fn_get_cart_total
+       skips items without a stock row), so their carts are re-totalled.
+==========================================================*/
+DELIMITER $$
+CREATE TRIGGER trg_available_stock_after_insert
+AFTER INSERT ON Available_Stock
+FOR EACH ROW
+BEGIN
+    INSERT INTO Medicine_Stock_Summary (med_id, total_stock, min_price, pharmacy_count)
+    VALUES (NEW.med_id, NEW.current_stock, NEW.price, 1)
+    ON DUPLICATE KEY UPDATE
+        total_stock = total_stock + NEW.current_stock,
+        min_price = IF(pharmacy_count = 0, NEW.price, LEAST(min_price, NEW.price)),
+        pharmacy_count = pharmacy_count + 1;
 
+    UPDATE Cart
+    SET total_amount = fn_get_cart_total(cart_id)
+    WHERE cart_id IN (
+        SELECT cart_id FROM Cart_Item
+        WHERE med_id = NEW.med_id AND assigned_pharmacy_id = NEW.pharmacy_id
+    );
+END$$
+DELIMITER ;
 
+/* T7) available_stock_after_update: apply the stock delta; only re-scan this medicine's
+       prices when the cheapest row got more expensive. Covers stock edits and the
+       checkout decrement in fn_insert_order_medicines.
+       A price change also re-totals the carts holding this medicine at this pharmacy,
+       so T4/T5 later subtract the same amount they see in the total.
+==========================================================*/
+DELIMITER $$
+CREATE TRIGGER trg_available_stock_after_update
+AFTER UPDATE ON Available_Stock
+FOR EACH ROW
+BEGIN
+    IF NEW.current_stock != OLD.current_stock OR NEW.price != OLD.price THEN
+        UPDATE Medicine_Stock_Summary
+        SET
+            total_stock = total_stock + (NEW.current_stock - OLD.current_stock),
+            min_price = CASE
+                WHEN NEW.price <= min_price THEN NEW.price
+                WHEN OLD.price = min_price AND NEW.price > OLD.price THEN
+                    (SELECT MIN(price) FROM Available_Stock WHERE med_id = NEW.med_id)
+                ELSE min_price
+            END
+        WHERE med_id = NEW.med_id;
+    END IF;
 
+    IF NEW.price != OLD.price THEN
+        UPDATE Cart
+        SET total_amount = fn_get_cart_total(cart_id)
+        WHERE cart_id IN (
+            SELECT cart_id FROM Cart_Item
+            WHERE med_id = NEW.med_id AND assigned_pharmacy_id = NEW.pharmacy_id
+        );
+    END IF;
+END$$
+DELIMITER ;
 
+/* T8) available_stock_after_delete
+       Cart items assigned here stop counting towards their cart's total (as in T6).
+=============================*/
+DELIMITER $$
+CREATE TRIGGER trg_available_stock_after_delete
+AFTER DELETE ON Available_Stock
+FOR EACH ROW
+BEGIN
+    UPDATE Medicine_Stock_Summary
+    SET
+        total_stock = total_stock - OLD.current_stock,
+        min_price = IF(OLD.price = min_price,
+                       COALESCE((SELECT MIN(price) FROM Available_Stock WHERE med_id = OLD.med_id), 0),
+                       min_price),
+        pharmacy_count = pharmacy_count - 1
+    WHERE med_id = OLD.med_id;
 
+    UPDATE Cart
+    SET total_amount = fn_get_cart_total(cart_id)
+    WHERE cart_id IN (
+        SELECT cart_id FROM Cart_Item
+        WHERE med_id = OLD.med_id AND assigned_pharmacy_id = OLD.pharmacy_id
+    );
+END$$
+DELIMITER ;
 
+/* T9) sub_order_after_insert: Publish new sub-orders to Status_Event so the pharmacy
+       and customer dashboards hear about them without polling.
+==========================================================*/
+DELIMITER $$
+CREATE TRIGGER trg_sub_order_after_insert
+AFTER INSERT ON Sub_Order
+FOR EACH ROW
+BEGIN
+    INSERT INTO Status_Event (order_id, sub_order_id, cust_id, pharmacy_id, agent_id, status)
+    SELECT NEW.order_id, NEW.sub_order_id, o.cust_id, NEW.pharmacy_id, NEW.agent_id, NEW.status
+    FROM Orders o
+    WHERE o.order_id = NEW.order_id;
+END$$
+DELIMITER ;
 
+/* T10) sub_order_after_update: Publish status and agent changes, whichever code path made
+        them (agent and pharmacy dashboards, admin assign, the dispatcher, procedures).
+==========================================================*/
+DELIMITER $$
+CREATE TRIGGER trg_sub_order_after_update
+AFTER UPDATE ON Sub_Order
+FOR EACH ROW
+BEGIN
+    IF NEW.status != OLD.status OR NOT (NEW.agent_id <=> OLD.agent_id) THEN
+        INSERT INTO Status_Event (order_id, sub_order_id, cust_id, pharmacy_id, agent_id, status)
+        SELECT NEW.order_id, NEW.sub_order_id, o.cust_id, NEW.pharmacy_id, NEW.agent_id, NEW.status
+        FROM Orders o
+        WHERE o.order_id = NEW.order_id;
+    END IF;
+END$$
+DELIMITER ;
 
+/* T11) medicine_after_update: Re-count prescription items in the carts holding a
+        medicine whose prescription flag changed (e.g. PUT /api/medicines/<id>), so
+        requires_prescription stays right and T4/T5 subtract what T3 added.
+==========================================================*/
+DELIMITER $$
+CREATE TRIGGER trg_medicine_after_update
+AFTER UPDATE ON Medicine
+FOR EACH ROW
+BEGIN
+    IF NEW.prescription_required != OLD.prescription_required THEN
+        UPDATE Cart c
+        SET
+            prescription_item_count = (
+                SELECT COUNT(*)
+                FROM Cart_Item ci
+                JOIN Medicine m ON ci.med_id = m.med_id
+                WHERE ci.cart_id = c.cart_id
+                  AND m.prescription_required = TRUE
+            ),
+            requires_prescription = (prescription_item_count > 0)
+        WHERE c.cart_id IN (SELECT cart_id FROM Cart_Item WHERE med_id = NEW.med_id);
+    END IF;
+END$$
+DELIMITER ;
 
+/* Backfill Medicine_Stock_Summary for rows inserted before the triggers existed
+   (3_data_population.sql). Re-run this block to repair the summary if stock was
+   changed with triggers disabled, e.g. by a cascading Pharmacy delete.
+==========================================================*/
+SET SQL_SAFE_UPDATES = 0;
+DELETE FROM Medicine_Stock_Summary;
+INSERT INTO Medicine_Stock_Summary (med_id, total_stock, min_price, pharmacy_count)
+SELECT med_id, SUM(current_stock), MIN(price), COUNT(*)
+FROM Available_Stock
+GROUP BY med_id;
+SET SQL_SAFE_UPDATES = 1;
 
-
+/* Backfill the cart totals the same way (logic of sp_recompute_cart_totals): the seed
+   Cart_Item rows predate the cart triggers, so without this carts 1 and 3 would start
+   with prescription_item_count = 0 and lose requires_prescription on the next OTC add.
+==========================================================*/
+SET SQL_SAFE_UPDATES = 0;
+UPDATE Cart c
+SET
+    total_amount = fn_get_cart_total(c.cart_id),
+    prescription_item_count = (
+        SELECT COUNT(*)
+        FROM Cart_Item ci
+        JOIN Medicine m ON ci.med_id = m.med_id
+        WHERE ci.cart_id = c.cart_id
+          AND m.prescription_required = TRUE
+    ),
+    requires_prescription = (prescription_item_count > 0);
+SET SQL_SAFE_UPDATES = 1;
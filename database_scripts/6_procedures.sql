@@ -1,5 +1,62 @@
 -- Procedures 
 
+-- ========================
+--   P0) Finds the closest pharmacy that can supply p_qty of a medicine.
+--       Searches a growing box around the customer so that only nearby
+--       pharmacies are read (uses idx_pharmacy_location), and only falls
+--       back to a full scan when nothing is stocked within range.
+-- ========================
+DELIMITER $$
+CREATE PROCEDURE sp_find_nearest_pharmacy(
+    IN p_med_id INT,
+    IN p_qty INT,
+    IN p_lat DECIMAL(10,6),
+    IN p_lng DECIMAL(10,6),
+    IN p_exclude_pharmacy_id INT,   -- NULL = no exclusion
+    OUT p_pharmacy_id INT
+)
+BEGIN
+    DECLARE v_radius DECIMAL(10,6) DEFAULT 0.1;
+
+    SET p_pharmacy_id = NULL;
+
+    -- Radius grows 0.1 -> 0.4 -> 1.6 -> 6.4 degrees.
+    -- A pharmacy within distance r always lies inside the +/- r box,
+    -- so the first hit with dist <= r is the true closest one.
+    WHILE p_pharmacy_id IS NULL AND v_radius <= 6.4
+          AND p_lat IS NOT NULL AND p_lng IS NOT NULL DO
+        SET p_pharmacy_id = (
+            SELECT p.pharmacy_id
+            FROM Pharmacy p
+            STRAIGHT_JOIN Available_Stock a
+                ON a.pharmacy_id = p.pharmacy_id AND a.med_id = p_med_id
+            WHERE p.latitude BETWEEN p_lat - v_radius AND p_lat + v_radius
+              AND p.longitude BETWEEN p_lng - v_radius AND p_lng + v_radius
+              AND fn_simple_distance(p_lat, p_lng, p.latitude, p.longitude) <= v_radius
+              AND a.current_stock >= p_qty
+              AND (p_exclude_pharmacy_id IS NULL OR p.pharmacy_id != p_exclude_pharmacy_id)
+            ORDER BY fn_simple_distance(p_lat, p_lng, p.latitude, p.longitude) ASC
+            LIMIT 1
+        );
+        SET v_radius = v_radius * 4;
+    END WHILE;
+
+    -- Nothing nearby (or no coordinates): rank every pharmacy, as before
+    IF p_pharmacy_id IS NULL THEN
+        SET p_pharmacy_id = (
+            SELECT a.pharmacy_id
+            FROM Available_Stock a
+            JOIN Pharmacy p ON p.pharmacy_id = a.pharmacy_id
+            WHERE a.med_id = p_med_id
+              AND a.current_stock >= p_qty
+              AND (p_exclude_pharmacy_id IS NULL OR a.pharmacy_id != p_exclude_pharmacy_id)
+            ORDER BY fn_simple_distance(p_lat, p_lng, p.latitude, p.longitude) ASC
+            LIMIT 1
+        );
+    END IF;
+END$$
+DELIMITER ;
+
 -- ========================
 --   P1)Finds and assigns the best pharmacy for one item.
 -- ==============================
@@ -10,6 +67,7 @@ BEGIN
     DECLARE v_cust_lat DECIMAL(10,6);
     DECLARE v_cust_lng DECIMAL(10,6);
     DECLARE v_quantity INT;
+    DECLARE v_pharmacy_id INT;
     
     SELECT c.latitude, c.longitude, ci.quantity
     INTO v_cust_lat, v_cust_lng, v_quantity
@@ -19,24 +77,183 @@ BEGIN
     WHERE ca.cart_id = p_cart_id AND ci.med_id = p_med_id
     LIMIT 1;
 
+    -- Find the single best pharmacy (bounded-radius search)
+    CALL sp_find_nearest_pharmacy(p_med_id, v_quantity, v_cust_lat, v_cust_lng, NULL, v_pharmacy_id);
+
     -- Update the Cart_Item row with the best pharmacy
+    IF v_pharmacy_id IS NOT NULL THEN
+        UPDATE Cart_Item
+        SET assigned_pharmacy_id = v_pharmacy_id
+        WHERE cart_id = p_cart_id AND med_id = p_med_id;
+    END IF;
+
+    -- This procedure does NOT call sp_validate_cart_stock
+END$$
+DELIMITER ;
+
+-- ========================
+--   P1b) Cart-level pharmacy allocation.
+--        Picks pharmacies for the whole cart at once, minimising
+--        item prices + fn_pharmacy_stop_cost for every pharmacy used, so a
+--        cart is not split across several pharmacies (several sub-orders,
+--        pickups and agent trips) just to be a little closer per item.
+--        Starts from the current assignment (items without a valid one get
+--        their cheapest nearby pharmacy), then repeatedly applies the best
+--        "consolidate into pharmacy Q" move: items Q sells for less move to
+--        Q, and so does every item of a pharmacy Q can fully replace when
+--        dropping that pharmacy pays off. Stops when no move lowers the cost.
+--        Only pharmacies with enough stock for the item are considered.
+-- ========================
+DELIMITER $$
+CREATE PROCEDURE sp_allocate_cart(IN p_cart_id INT)
+BEGIN
+    DECLARE v_cust_lat DECIMAL(10,6);
+    DECLARE v_cust_lng DECIMAL(10,6);
+    DECLARE v_radius DECIMAL(10,6) DEFAULT 1.6;
+    DECLARE v_max_rounds INT DEFAULT 20;
+    DECLARE v_round INT DEFAULT 0;
+    DECLARE v_pharmacy_id INT;
+    DECLARE v_delta DECIMAL(14,2);
+
+    SELECT c.latitude, c.longitude
+    INTO v_cust_lat, v_cust_lng
+    FROM Cart ca
+    JOIN Customer c ON ca.cust_id = c.cust_id
+    WHERE ca.cart_id = p_cart_id;
+
+    -- Step 1: Candidate (item, pharmacy) pairs: nearby pharmacies with enough
+    --         stock, plus the item's current pharmacy wherever it is
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_candidate;
+    CREATE TEMPORARY TABLE tmp_cart_candidate (
+        pharmacy_id INT NOT NULL,
+        med_id INT NOT NULL,
+        item_cost DECIMAL(14,2) NOT NULL,
+        stop_cost DECIMAL(14,2) NOT NULL,
+        PRIMARY KEY (pharmacy_id, med_id)
+    );
+
+    INSERT INTO tmp_cart_candidate (pharmacy_id, med_id, item_cost, stop_cost)
+    SELECT a.pharmacy_id, ci.med_id, ci.quantity * a.price,
+           fn_pharmacy_stop_cost(v_cust_lat, v_cust_lng, p.latitude, p.longitude)
+    FROM Cart_Item ci
+    JOIN Available_Stock a ON a.med_id = ci.med_id AND a.current_stock >= ci.quantity
+    JOIN Pharmacy p ON p.pharmacy_id = a.pharmacy_id
+    WHERE ci.cart_id = p_cart_id
+      AND (a.pharmacy_id = ci.assigned_pharmacy_id
+           OR (p.latitude BETWEEN v_cust_lat - v_radius AND v_cust_lat + v_radius
+               AND p.longitude BETWEEN v_cust_lng - v_radius AND v_cust_lng + v_radius));
+
+    -- Step 2: Items whose pharmacy can't supply them start at their cheapest candidate
     UPDATE Cart_Item ci
     JOIN (
-        -- This subquery finds the single best pharmacy
-        SELECT 
-            a.pharmacy_id,
-            fn_simple_distance(v_cust_lat, v_cust_lng, p.latitude, p.longitude) AS dist
-        FROM Available_Stock a
-        JOIN Pharmacy p ON p.pharmacy_id = a.pharmacy_id
-        WHERE a.med_id = p_med_id
-          AND a.current_stock >= v_quantity
-        ORDER BY dist ASC -- Order by distance
-        LIMIT 1 -- Pick the closest one
-    ) best_ph
-    SET ci.assigned_pharmacy_id = best_ph.pharmacy_id
-    WHERE ci.cart_id = p_cart_id AND ci.med_id = p_med_id;
+        SELECT med_id, pharmacy_id,
+               ROW_NUMBER() OVER (PARTITION BY med_id ORDER BY item_cost + stop_cost, pharmacy_id) AS rnk
+        FROM tmp_cart_candidate
+    ) best ON best.med_id = ci.med_id AND best.rnk = 1
+    LEFT JOIN Available_Stock a ON a.med_id = ci.med_id AND a.pharmacy_id = ci.assigned_pharmacy_id
+    SET ci.assigned_pharmacy_id = best.pharmacy_id
+    WHERE ci.cart_id = p_cart_id
+      AND (a.pharmacy_id IS NULL OR a.current_stock < ci.quantity);
+
+    -- Step 3: Improve with consolidation moves until none helps
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_move;
+    CREATE TEMPORARY TABLE tmp_cart_move (
+        q_id INT NOT NULL,        -- pharmacy the item could move to
+        p_id INT NOT NULL,        -- pharmacy it is at now
+        med_id INT NOT NULL,
+        diff DECIMAL(14,2) NOT NULL,  -- price change for the item
+        PRIMARY KEY (q_id, med_id)
+    );
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_stop;
+    CREATE TEMPORARY TABLE tmp_cart_stop (
+        pharmacy_id INT PRIMARY KEY,
+        items INT NOT NULL,
+        stop_cost DECIMAL(14,2) NOT NULL
+    );
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_close;
+    CREATE TEMPORARY TABLE tmp_cart_close (pharmacy_id INT PRIMARY KEY);
+
+    allocation: WHILE v_round < v_max_rounds DO
+        SET v_round = v_round + 1;
+
+        DELETE FROM tmp_cart_move;
+        INSERT INTO tmp_cart_move (q_id, p_id, med_id, diff)
+        SELECT q.pharmacy_id, ci.assigned_pharmacy_id, ci.med_id, q.item_cost - ci.quantity * a.price
+        FROM tmp_cart_candidate q
+        JOIN Cart_Item ci
+            ON ci.cart_id = p_cart_id AND ci.med_id = q.med_id AND ci.assigned_pharmacy_id != q.pharmacy_id
+        JOIN Available_Stock a
+            ON a.med_id = ci.med_id AND a.pharmacy_id = ci.assigned_pharmacy_id AND a.current_stock >= ci.quantity;
+
+        IF NOT EXISTS (SELECT 1 FROM tmp_cart_move) THEN
+            LEAVE allocation;
+        END IF;
+
+        DELETE FROM tmp_cart_stop;
+        INSERT INTO tmp_cart_stop (pharmacy_id, items, stop_cost)
+        SELECT ci.assigned_pharmacy_id, COUNT(*),
+               fn_pharmacy_stop_cost(v_cust_lat, v_cust_lng, p.latitude, p.longitude)
+        FROM Cart_Item ci
+        JOIN Pharmacy p ON p.pharmacy_id = ci.assigned_pharmacy_id
+        WHERE ci.cart_id = p_cart_id
+        GROUP BY ci.assigned_pharmacy_id, p.latitude, p.longitude;
+
+        -- Cost change of each move: per current pharmacy, either drop it
+        -- (all its items move; saves its stop cost) or move only the items
+        -- that get cheaper; plus Q's stop cost if Q isn't used yet.
+        SELECT pp.q_id,
+               SUM(CASE WHEN pp.moved = cur.items AND pp.close_diff - cur.stop_cost < pp.cherry_diff
+                        THEN pp.close_diff - cur.stop_cost
+                        ELSE pp.cherry_diff END)
+               + IF(q_open.items IS NULL, q_cost.stop_cost, 0) AS delta
+        INTO v_pharmacy_id, v_delta
+        FROM (
+            SELECT q_id, p_id, COUNT(*) AS moved, SUM(diff) AS close_diff, SUM(LEAST(diff, 0)) AS cherry_diff
+            FROM tmp_cart_move
+            GROUP BY q_id, p_id
+        ) pp
+        JOIN tmp_cart_stop cur ON cur.pharmacy_id = pp.p_id
+        JOIN (
+            SELECT pharmacy_id, MAX(stop_cost) AS stop_cost
+            FROM tmp_cart_candidate
+            GROUP BY pharmacy_id
+        ) q_cost ON q_cost.pharmacy_id = pp.q_id
+        LEFT JOIN (
+            SELECT assigned_pharmacy_id, COUNT(*) AS items
+            FROM Cart_Item
+            WHERE cart_id = p_cart_id
+            GROUP BY assigned_pharmacy_id
+        ) q_open ON q_open.assigned_pharmacy_id = pp.q_id
+        GROUP BY pp.q_id, q_open.items, q_cost.stop_cost
+        ORDER BY delta, pp.q_id
+        LIMIT 1;
+
+        IF v_delta >= 0 THEN
+            LEAVE allocation;
+        END IF;
+
+        -- Apply the move: pharmacies being dropped lose all their items to Q
+        DELETE FROM tmp_cart_close;
+        INSERT INTO tmp_cart_close (pharmacy_id)
+        SELECT m.p_id
+        FROM tmp_cart_move m
+        JOIN tmp_cart_stop cur ON cur.pharmacy_id = m.p_id
+        WHERE m.q_id = v_pharmacy_id
+        GROUP BY m.p_id, cur.items, cur.stop_cost
+        HAVING COUNT(*) = cur.items AND SUM(m.diff) - cur.stop_cost < SUM(LEAST(m.diff, 0));
+
+        UPDATE Cart_Item ci
+        JOIN tmp_cart_move m ON m.med_id = ci.med_id AND m.q_id = v_pharmacy_id
+        LEFT JOIN tmp_cart_close c ON c.pharmacy_id = m.p_id
+        SET ci.assigned_pharmacy_id = v_pharmacy_id
+        WHERE ci.cart_id = p_cart_id
+          AND (m.diff < 0 OR c.pharmacy_id IS NOT NULL);
+    END WHILE;
 
-    -- This procedure does NOT call sp_validate_cart_stock
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_candidate;
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_move;
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_stop;
+    DROP TEMPORARY TABLE IF EXISTS tmp_cart_close;
 END$$
 DELIMITER ;
 
@@ -53,12 +270,183 @@ BEGIN
     
     -- Step 2: Assign the best pharmacy for this item
     CALL sp_assign_single_cart_item(p_cart_id, p_med_id);
+
+    -- Step 3: Re-balance the whole cart (may move other items too)
+    CALL sp_allocate_cart(p_cart_id);
     
     -- This procedure does NOT call sp_validate_cart_stock
     -- The trigger will fire and update the total, that's all.
 END$$
 DELIMITER ;
 
+-- ========================
+-- P2b) Add many items to a cart in one call (no total update, triggers handle it)
+--      p_items is a JSON array: [{"med_id": 1, "qty": 2}, ...]
+--      Pharmacies for all listed items are assigned in one set-based UPDATE.
+-- ========================
+DELIMITER $$
+CREATE PROCEDURE sp_add_cart_items(IN p_cart_id INT, IN p_items JSON)
+BEGIN
+    DECLARE v_cust_lat DECIMAL(10,6);
+    DECLARE v_cust_lng DECIMAL(10,6);
+    DECLARE v_radius DECIMAL(10,6) DEFAULT 1.6;
+    DECLARE v_med_id INT;
+
+    -- Step 1: Add or update all item quantities (repeated med_ids are summed)
+    INSERT INTO Cart_Item (cart_id, med_id, quantity)
+    SELECT p_cart_id, items.med_id, items.qty
+    FROM (
+        SELECT jt.med_id, SUM(jt.qty) AS qty
+        FROM JSON_TABLE(p_items, '$[*]' COLUMNS (
+            med_id INT PATH '$.med_id',
+            qty INT PATH '$.qty'
+        )) jt
+        GROUP BY jt.med_id
+    ) items
+    ON DUPLICATE KEY UPDATE quantity = Cart_Item.quantity + items.qty;
+
+    SELECT c.latitude, c.longitude
+    INTO v_cust_lat, v_cust_lng
+    FROM Cart ca
+    JOIN Customer c ON ca.cust_id = c.cust_id
+    WHERE ca.cart_id = p_cart_id;
+
+    -- Step 2: Assign the closest pharmacy to every listed item at once,
+    --         ranking only pharmacies near the customer (idx_pharmacy_location)
+    UPDATE Cart_Item ci
+    JOIN (
+        SELECT
+            listed_ci.med_id,
+            a.pharmacy_id,
+            ROW_NUMBER() OVER (
+                PARTITION BY listed_ci.med_id
+                ORDER BY fn_simple_distance(v_cust_lat, v_cust_lng, p.latitude, p.longitude) ASC
+            ) AS rnk
+        FROM (
+            SELECT DISTINCT jt.med_id
+            FROM JSON_TABLE(p_items, '$[*]' COLUMNS (med_id INT PATH '$.med_id')) jt
+        ) listed
+        JOIN Cart_Item listed_ci ON listed_ci.cart_id = p_cart_id AND listed_ci.med_id = listed.med_id
+        JOIN Available_Stock a ON a.med_id = listed_ci.med_id AND a.current_stock >= listed_ci.quantity
+        JOIN Pharmacy p ON p.pharmacy_id = a.pharmacy_id
+        WHERE p.latitude BETWEEN v_cust_lat - v_radius AND v_cust_lat + v_radius
+          AND p.longitude BETWEEN v_cust_lng - v_radius AND v_cust_lng + v_radius
+          AND fn_simple_distance(v_cust_lat, v_cust_lng, p.latitude, p.longitude) <= v_radius
+    ) best ON ci.med_id = best.med_id AND ci.cart_id = p_cart_id
+    SET ci.assigned_pharmacy_id = best.pharmacy_id
+    WHERE best.rnk = 1;
+
+    -- Step 3: Items with nothing suitable nearby fall back to the single-item
+    --         search (wider radius, then every pharmacy). Usually none.
+    SET v_med_id = (
+        SELECT MIN(ci.med_id)
+        FROM Cart_Item ci
+        JOIN JSON_TABLE(p_items, '$[*]' COLUMNS (med_id INT PATH '$.med_id')) jt ON jt.med_id = ci.med_id
+        LEFT JOIN Available_Stock a ON a.med_id = ci.med_id AND a.pharmacy_id = ci.assigned_pharmacy_id
+        LEFT JOIN Pharmacy p ON p.pharmacy_id = ci.assigned_pharmacy_id
+        WHERE ci.cart_id = p_cart_id
+          AND (a.pharmacy_id IS NULL
+               OR a.current_stock < ci.quantity
+               OR NOT COALESCE(fn_simple_distance(v_cust_lat, v_cust_lng, p.latitude, p.longitude) <= v_radius, FALSE))
+    );
+
+    WHILE v_med_id IS NOT NULL DO
+        CALL sp_assign_single_cart_item(p_cart_id, v_med_id);
+
+        SET v_med_id = (
+            SELECT MIN(ci.med_id)
+            FROM Cart_Item ci
+            JOIN JSON_TABLE(p_items, '$[*]' COLUMNS (med_id INT PATH '$.med_id')) jt ON jt.med_id = ci.med_id
+            LEFT JOIN Available_Stock a ON a.med_id = ci.med_id AND a.pharmacy_id = ci.assigned_pharmacy_id
+            LEFT JOIN Pharmacy p ON p.pharmacy_id = ci.assigned_pharmacy_id
+            WHERE ci.cart_id = p_cart_id
+              AND ci.med_id > v_med_id
+              AND (a.pharmacy_id IS NULL
+                   OR a.current_stock < ci.quantity
+                   OR NOT COALESCE(fn_simple_distance(v_cust_lat, v_cust_lng, p.latitude, p.longitude) <= v_radius, FALSE))
+        );
+    END WHILE;
+
+    -- Step 4: Re-balance the whole cart so it uses as few pharmacies as pays off
+    CALL sp_allocate_cart(p_cart_id);
+END$$
+DELIMITER ;
+
+-- ========================
+-- P2c) Reorder: copy a past order's medicines back into the customer's cart.
+--      Pharmacies are re-resolved against current stock by sp_add_cart_items.
+-- ========================
+DELIMITER $$
+CREATE PROCEDURE sp_reorder(IN p_cust_id INT, IN p_order_id INT)
+BEGIN
+    DECLARE v_cart_id INT;
+    DECLARE v_items JSON;
+
+    SET v_cart_id = (SELECT cart_id FROM Cart WHERE cust_id = p_cust_id LIMIT 1);
+    IF v_cart_id IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Could not find cart for customer.';
+    END IF;
+
+    -- One entry per medicine (an order can hold the same med in several sub-orders)
+    SELECT JSON_ARRAYAGG(JSON_OBJECT('med_id', t.med_id, 'qty', t.qty))
+    INTO v_items
+    FROM (
+        SELECT om.med_id, SUM(om.quantity) AS qty
+        FROM Orders o
+        JOIN Order_Medicine om ON om.order_id = o.order_id
+        WHERE o.order_id = p_order_id AND o.cust_id = p_cust_id
+        GROUP BY om.med_id
+    ) t;
+
+    IF v_items IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'Order not found for this customer.';
+    END IF;
+
+    CALL sp_add_cart_items(v_cart_id, v_items);
+
+    -- Summary, including items no pharmacy can currently supply
+    SELECT
+        JSON_LENGTH(v_items) AS items_added,
+        (
+            SELECT COUNT(*)
+            FROM Cart_Item ci
+            JOIN JSON_TABLE(v_items, '$[*]' COLUMNS (med_id INT PATH '$.med_id')) jt ON jt.med_id = ci.med_id
+            LEFT JOIN Available_Stock a ON a.med_id = ci.med_id AND a.pharmacy_id = ci.assigned_pharmacy_id
+            WHERE ci.cart_id = v_cart_id
+              AND (a.pharmacy_id IS NULL OR a.current_stock < ci.quantity)
+        ) AS unavailable_items,
+        CONCAT('Order #', p_order_id, ' added to your cart') AS message;
+END$$
+DELIMITER ;
+
+-- ========================
+-- P2d) Swap a cart item for a substitute medicine (same quantity).
+--      The app checks the pair against Medicine_Substitute (and asks the
+--      customer first for prescription medicines) before calling this.
+-- ========================
+DELIMITER $$
+CREATE PROCEDURE sp_substitute_cart_item(IN p_cart_id INT, IN p_med_id INT, IN p_substitute_med_id INT)
+BEGIN
+    DECLARE v_qty INT DEFAULT NULL;
+
+    SET v_qty = (
+        SELECT quantity FROM Cart_Item
+        WHERE cart_id = p_cart_id AND med_id = p_med_id
+        FOR UPDATE
+    );
+
+    IF v_qty IS NULL THEN
+        SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'That medicine is no longer in your cart.';
+    END IF;
+
+    DELETE FROM Cart_Item WHERE cart_id = p_cart_id AND med_id = p_med_id;
+
+    -- Adds to the substitute's quantity if it is already in the cart,
+    -- then picks pharmacies for the cart again
+    CALL sp_add_cart_item(p_cart_id, p_substitute_med_id, v_qty);
+END$$
+DELIMITER ;
+
 -- ========================
 --   P3) Checks if all items in the cart are still in stock at their assigned pharmacies before finalizing the order.
 -- ========================
@@ -74,53 +462,61 @@ BEGIN
     DECLARE v_rows_updated INT DEFAULT 0;
     DECLARE v_failed_med_name VARCHAR(150) DEFAULT NULL;
     DECLARE v_error_message VARCHAR(512); 
+    DECLARE v_med_id INT;
+    DECLARE v_quantity INT;
+    DECLARE v_old_pharmacy_id INT;
+    DECLARE v_new_pharmacy_id INT;
 
     -- == 2. ATTEMPT TO FIX THE CART ==
-    WITH
-    BadItems AS (
-        SELECT 
-            ci.med_id, 
-            ci.quantity, 
-            ci.assigned_pharmacy_id
+    -- Re-run the cart-level allocation against current stock and prices.
+    CALL sp_allocate_cart(p_cart_id);
+
+    -- Items still without a pharmacy that has enough stock (nothing nearby)
+    -- move one by one, in med_id order, to the closest pharmacy that does.
+    SET v_med_id = (
+        SELECT MIN(ci.med_id)
         FROM Cart_Item ci
         JOIN Available_Stock av 
             ON ci.med_id = av.med_id 
             AND ci.assigned_pharmacy_id = av.pharmacy_id
-        -- (FIX) We no longer JOIN Cart or Customer here
         WHERE ci.cart_id = p_cart_id
           AND ci.quantity > av.current_stock
-    ),
-    RankedNewPharmacies AS (
-        SELECT
-            bi.med_id,
-            a.pharmacy_id AS new_pharmacy_id,
-            -- (FIX) Use the new parameters
-            ROW_NUMBER() OVER(
-                PARTITION BY bi.med_id 
-                ORDER BY fn_simple_distance(p_cust_lat, p_cust_lng, p.latitude, p.longitude) ASC
-            ) as rnk
-        FROM BadItems bi
-        JOIN Available_Stock a ON bi.med_id = a.med_id
-        JOIN Pharmacy p ON a.pharmacy_id = p.pharmacy_id
-        WHERE 
-            a.current_stock >= bi.quantity
-            AND a.pharmacy_id != bi.assigned_pharmacy_id
-    )
-    
-    UPDATE Cart_Item ci
-    JOIN RankedNewPharmacies rnp 
-        ON ci.med_id = rnp.med_id AND ci.cart_id = p_cart_id
-    SET 
-        ci.assigned_pharmacy_id = rnp.new_pharmacy_id
-    WHERE 
-        rnp.rnk = 1;
+    );
+
+    WHILE v_med_id IS NOT NULL DO
+        SELECT quantity, assigned_pharmacy_id
+        INTO v_quantity, v_old_pharmacy_id
+        FROM Cart_Item
+        WHERE cart_id = p_cart_id AND med_id = v_med_id;
+
+        -- (FIX) Use the new parameters
+        CALL sp_find_nearest_pharmacy(v_med_id, v_quantity, p_cust_lat, p_cust_lng,
+                                      v_old_pharmacy_id, v_new_pharmacy_id);
+
+        IF v_new_pharmacy_id IS NOT NULL THEN
+            UPDATE Cart_Item
+            SET assigned_pharmacy_id = v_new_pharmacy_id
+            WHERE cart_id = p_cart_id AND med_id = v_med_id;
+
+            SET v_rows_updated = v_rows_updated + 1;
+        END IF;
+
+        SET v_med_id = (
+            SELECT MIN(ci.med_id)
+            FROM Cart_Item ci
+            JOIN Available_Stock av 
+                ON ci.med_id = av.med_id 
+                AND ci.assigned_pharmacy_id = av.pharmacy_id
+            WHERE ci.cart_id = p_cart_id
+              AND ci.quantity > av.current_stock
+              AND ci.med_id > v_med_id
+        );
+    END WHILE;
 
     -- This UPDATE on Cart_Item fires the trigger.
     -- The trigger updates Cart.
     -- This is now SAFE because *this* procedure did NOT read from Cart.
 
-    SET v_rows_updated = ROW_COUNT();
-
     -- == 3. CHECK FOR *UNFIXABLE* ITEMS ==
     SELECT 
         m.med_name
@@ -149,6 +545,96 @@ END$$
 
 DELIMITER ;
 
+-- ========================
+--   P3b) Full recompute of a cart's total and prescription flag.
+--        The cart triggers maintain these incrementally; this settles them
+--        once per checkout (and can repair a cart after manual edits).
+-- ========================
+DELIMITER $$
+CREATE PROCEDURE sp_recompute_cart_totals(IN p_cart_id INT)
+BEGIN
+    UPDATE Cart
+    SET
+        total_amount = fn_get_cart_total(p_cart_id),
+        prescription_item_count = (
+            SELECT COUNT(*)
+            FROM Cart_Item ci
+            JOIN Medicine m ON ci.med_id = m.med_id
+            WHERE ci.cart_id = p_cart_id
+              AND m.prescription_required = TRUE
+        ),
+        requires_prescription = (prescription_item_count > 0)
+    WHERE cart_id = p_cart_id;
+END$$
+DELIMITER ;
+
+-- ========================
+--   P3c) Reserve a cart's stock for checkout.
+--        Locks the Available_Stock rows the cart draws from, pharmacy by
+--        pharmacy in primary-key order, then the matching
+--        Medicine_Stock_Summary rows in med_id order. Every checkout takes
+--        its locks in the same order, so concurrent checkouts for a hot
+--        medicine queue up instead of deadlocking. Quantities are re-checked
+--        under the lock; the locks are held until the caller's COMMIT.
+-- ========================
+DELIMITER $$
+CREATE PROCEDURE sp_reserve_cart_stock(IN p_cart_id INT)
+BEGIN
+    DECLARE v_pharmacy_id INT;
+    DECLARE v_locked INT;
+    DECLARE v_failed_med_name VARCHAR(150) DEFAULT NULL;
+
+    SET v_pharmacy_id = (
+        SELECT MIN(assigned_pharmacy_id)
+        FROM Cart_Item
+        WHERE cart_id = p_cart_id
+    );
+
+    WHILE v_pharmacy_id IS NOT NULL DO
+        SELECT COUNT(*) INTO v_locked
+        FROM Available_Stock
+        WHERE pharmacy_id = v_pharmacy_id
+          AND med_id IN (
+              SELECT med_id
+              FROM Cart_Item
+              WHERE cart_id = p_cart_id AND assigned_pharmacy_id = v_pharmacy_id
+          )
+        FOR UPDATE;
+
+        SET v_pharmacy_id = (
+            SELECT MIN(assigned_pharmacy_id)
+            FROM Cart_Item
+            WHERE cart_id = p_cart_id AND assigned_pharmacy_id > v_pharmacy_id
+        );
+    END WHILE;
+
+    -- The stock triggers (T6-T8) update these when stock is decremented
+    SELECT COUNT(*) INTO v_locked
+    FROM Medicine_Stock_Summary
+    WHERE med_id IN (SELECT med_id FROM Cart_Item WHERE cart_id = p_cart_id)
+    FOR UPDATE;
+
+    -- Another checkout may have taken the stock after sp_validate_cart_stock ran
+    SET v_failed_med_name = (
+        SELECT m.med_name
+        FROM Cart_Item ci
+        LEFT JOIN Available_Stock av
+            ON ci.med_id = av.med_id
+            AND ci.assigned_pharmacy_id = av.pharmacy_id
+        JOIN Medicine m ON ci.med_id = m.med_id
+        WHERE ci.cart_id = p_cart_id
+          AND (av.current_stock IS NULL OR ci.quantity > av.current_stock)
+        ORDER BY ci.med_id
+        LIMIT 1
+    );
+
+    IF v_failed_med_name IS NOT NULL THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'Some items just sold out at their pharmacy. Please review your cart and try again.';
+    END IF;
+END$$
+DELIMITER ;
+
 -- ========================
 --   Procedure 4
 -- ========================
@@ -185,13 +671,26 @@ BEGIN
         v_cust_lng
     FROM Cart ca
     JOIN Customer c ON ca.cust_id = c.cust_id
-    WHERE ca.cart_id = p_cart_id;
+    WHERE ca.cart_id = p_cart_id
+    FOR UPDATE OF ca; -- A double-submitted checkout waits here for the first one
+
+    IF NOT EXISTS (SELECT 1 FROM Cart_Item WHERE cart_id = p_cart_id) THEN
+        SIGNAL SQLSTATE '45000'
+        SET MESSAGE_TEXT = 'Your cart is empty.';
+    END IF;
     
     -- Step 3: VALIDATE STOCK
     -- (FIX) Pass the location data in as parameters
     CALL sp_validate_cart_stock(p_cart_id, v_cust_lat, v_cust_lng);
 
-    -- Step 4: Re-fetch the total, in case validation changed it.
+    -- Step 3b: RESERVE STOCK (row locks held until COMMIT, so the
+    --          decrement in Step 7 cannot oversell)
+    CALL sp_reserve_cart_stock(p_cart_id);
+
+    -- Step 4: Settle the total once against current prices (the triggers only
+    --         apply deltas), then re-fetch it, in case validation changed it.
+    CALL sp_recompute_cart_totals(p_cart_id);
+
     SELECT total_amount INTO v_final_total
     FROM Cart
     WHERE cart_id = p_cart_id;
@@ -256,6 +755,8 @@ DELIMITER ;
 
 -- ========================
 --   P6) Doctor verifies prescription 
+--       Only the doctor holding the lease may verify it (or anyone, once
+--       the lease has expired). rows_updated = 0 means it was not theirs.
 -- ========================
 DELIMITER $$
 CREATE PROCEDURE sp_verify_prescription(
@@ -268,10 +769,13 @@ BEGIN
     SET
         status = p_new_status,
         assigned_doc_id = p_doc_id, -- Assign the doctor who verified it [cite: 34]
-        verified_at = CURRENT_TIMESTAMP
+        verified_at = CURRENT_TIMESTAMP,
+        lease_doc_id = NULL,
+        lease_expires_at = NULL
     WHERE
         presc_id = p_presc_id
-        AND status = 'To Be Verified'; -- Only update unverified ones [cite: 37]
+        AND status = 'To Be Verified' -- Only update unverified ones [cite: 37]
+        AND (lease_doc_id IS NULL OR lease_doc_id = p_doc_id OR lease_expires_at <= NOW());
     
     SELECT ROW_COUNT() AS rows_updated;
 END$$
@@ -400,4 +904,105 @@ DELIMITER ;
     
 --     -- (A trigger would typically update the parent Orders table status here)
 -- END$$
--- DELIMITER ;
\ No newline at end of file
+-- DELIMITER ;
+
+-- =========================
+-- P9) Incremental refresh of the reporting rollups
+--     Folds every committed order not yet counted into Daily_Pharmacy_Sales
+--     and Daily_Medicine_Sales, all in one transaction. Order ids are handed
+--     out before the checkout commits, so an order can appear after orders
+--     with higher ids: above the watermark, folded orders are remembered one
+--     by one (Report_Folded_Order), and the watermark only moves past orders
+--     placed over an hour ago, which no open checkout can still be behind.
+--     Safe to call concurrently: the watermark row lock serializes refreshes.
+-- =========================
+DELIMITER $$
+CREATE PROCEDURE sp_refresh_sales_rollups()
+BEGIN
+    DECLARE v_from_order_id INT;
+    DECLARE v_to_order_id INT;
+    DECLARE v_folded INT DEFAULT 0;
+
+    INSERT IGNORE INTO Report_Watermark (rollup_name, last_order_id) VALUES ('daily_sales', 0);
+
+    START TRANSACTION;
+
+    SET v_from_order_id = (
+        SELECT last_order_id FROM Report_Watermark WHERE rollup_name = 'daily_sales' FOR UPDATE
+    );
+
+    DROP TEMPORARY TABLE IF EXISTS tmp_rollup_order;
+    CREATE TEMPORARY TABLE tmp_rollup_order (order_id INT PRIMARY KEY);
+    INSERT INTO tmp_rollup_order (order_id)
+    SELECT o.order_id
+    FROM Orders o
+    WHERE o.order_id > v_from_order_id
+      AND NOT EXISTS (
+          SELECT 1 FROM Report_Folded_Order f
+          WHERE f.rollup_name = 'daily_sales' AND f.order_id = o.order_id
+      );
+    SET v_folded = ROW_COUNT();
+
+    IF v_folded > 0 THEN
+        INSERT INTO Daily_Pharmacy_Sales (sales_date, pharmacy_id, sub_order_count, total_sales)
+        SELECT * FROM (
+            SELECT DATE(o.order_date) AS sales_date, so.pharmacy_id,
+                   COUNT(*) AS sub_order_count, SUM(so.sub_total) AS total_sales
+            FROM tmp_rollup_order t
+            JOIN Orders o ON o.order_id = t.order_id
+            JOIN Sub_Order so ON so.order_id = o.order_id
+            GROUP BY DATE(o.order_date), so.pharmacy_id
+        ) batch
+        ON DUPLICATE KEY UPDATE
+            sub_order_count = Daily_Pharmacy_Sales.sub_order_count + batch.sub_order_count,
+            total_sales = Daily_Pharmacy_Sales.total_sales + batch.total_sales;
+
+        INSERT INTO Daily_Medicine_Sales (sales_date, med_id, order_count, quantity_sold, revenue)
+        SELECT * FROM (
+            SELECT DATE(o.order_date) AS sales_date, om.med_id,
+                   COUNT(DISTINCT om.order_id) AS order_count,
+                   SUM(om.quantity) AS quantity_sold,
+                   SUM(om.quantity * om.price_at_order) AS revenue
+            FROM tmp_rollup_order t
+            JOIN Orders o ON o.order_id = t.order_id
+            JOIN Order_Medicine om ON om.order_id = o.order_id
+            GROUP BY DATE(o.order_date), om.med_id
+        ) batch
+        ON DUPLICATE KEY UPDATE
+            order_count = Daily_Medicine_Sales.order_count + batch.order_count,
+            quantity_sold = Daily_Medicine_Sales.quantity_sold + batch.quantity_sold,
+            revenue = Daily_Medicine_Sales.revenue + batch.revenue;
+
+        INSERT INTO Report_Folded_Order (rollup_name, order_id)
+        SELECT 'daily_sales', order_id FROM tmp_rollup_order;
+    END IF;
+
+    -- Everything visible above the old watermark is folded now; move it over
+    -- the orders that are old enough to have no uncommitted order below them
+    SET v_to_order_id = (
+        SELECT MAX(order_id)
+        FROM Orders
+        WHERE order_id > v_from_order_id
+          AND order_date < NOW() - INTERVAL 1 HOUR
+    );
+    IF v_to_order_id IS NOT NULL THEN
+        UPDATE Report_Watermark
+        SET last_order_id = v_to_order_id
+        WHERE rollup_name = 'daily_sales';
+
+        DELETE FROM Report_Folded_Order
+        WHERE rollup_name = 'daily_sales' AND order_id <= v_to_order_id;
+    END IF;
+
+    UPDATE Report_Watermark
+    SET refreshed_at = CURRENT_TIMESTAMP
+    WHERE rollup_name = 'daily_sales';
+
+    COMMIT;
+    DROP TEMPORARY TABLE IF EXISTS tmp_rollup_order;
+
+    SELECT
+        COALESCE(v_to_order_id, v_from_order_id) AS last_order_id,
+        (v_folded > 0) AS advanced;
+END$$
+DELIMITER ;
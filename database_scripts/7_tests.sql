@@ -13,7 +13,7 @@ DELETE FROM Low_Stock_Alert;
 DELETE FROM Medicine_Substitute;
 
 -- 2. Reset cart totals (since items are deleted, triggers won't fire)
-UPDATE Cart SET total_amount = 0.00, requires_prescription = 0;
+UPDATE Cart SET total_amount = 0.00, requires_prescription = 0, prescription_item_count = 0;
 
 -- 3. Reset stock to original values from '2 populating-block1.sql'
 --    This is the corrected block:
@@ -301,3 +301,282 @@ SELECT * FROM Prescription WHERE presc_id = @test_presc_id_2;
 -- EXPECTED: status = 'Rejected', assigned_doc_id = 2, verified_at is NOT NULL
 
 -- =====================================================================
+
+
+-- =====================================================================
+-- Test 10: sp_find_nearest_pharmacy (Bounded-radius pharmacy lookup)
+-- =====================================================================
+-- Customer 2 (Priya) is in Bengaluru (12.9716, 77.5946).
+-- P2 (HealthPlus Bengaluru, 12.9352, 77.6245) stocks Med 1 and is inside the first radius.
+CALL sp_find_nearest_pharmacy(1, 1, 12.9716, 77.5946, NULL, @nearest_pharmacy);
+SELECT @nearest_pharmacy; -- EXPECTED: 2
+
+-- Excluding P2 forces the search outwards to the next closest pharmacy with Med 1.
+CALL sp_find_nearest_pharmacy(1, 1, 12.9716, 77.5946, 2, @nearest_pharmacy);
+SELECT @nearest_pharmacy; -- EXPECTED: 1 (MedLife Mumbai)
+
+-- No pharmacy can supply 1000 units: nothing is found.
+CALL sp_find_nearest_pharmacy(1, 1000, 12.9716, 77.5946, NULL, @nearest_pharmacy);
+SELECT @nearest_pharmacy; -- EXPECTED: NULL
+
+
+-- =====================================================================
+-- Test 11: Medicine_Stock_Summary triggers (T6-T8)
+-- =====================================================================
+-- The summary must always match a fresh SUM/MIN over Available_Stock.
+-- Step 1: Raise the price of the cheapest Med 5 row (P3, 45.00 -> 60.00).
+-- min_price must move to the next cheapest row (P2, 50.00).
+UPDATE Available_Stock SET price = 60.00 WHERE pharmacy_id = 3 AND med_id = 5;
+SELECT * FROM Medicine_Stock_Summary WHERE med_id = 5; -- EXPECTED: min_price = 50.00
+
+-- Step 2: Add Med 5 stock at P1 with a new lowest price.
+INSERT INTO Available_Stock (pharmacy_id, med_id, current_stock, price) VALUES (1, 5, 7, 40.00);
+SELECT * FROM Medicine_Stock_Summary WHERE med_id = 5; -- EXPECTED: min_price = 40.00, pharmacy_count = 3
+
+-- Step 3: Remove it again and restore the original price.
+DELETE FROM Available_Stock WHERE pharmacy_id = 1 AND med_id = 5;
+UPDATE Available_Stock SET price = 45.00 WHERE pharmacy_id = 3 AND med_id = 5;
+
+-- Step 4: Compare against the live aggregate (EXPECTED: 0 rows).
+SELECT mss.med_id
+FROM Medicine_Stock_Summary mss
+JOIN (
+    SELECT med_id, SUM(current_stock) AS total_stock, MIN(price) AS min_price, COUNT(*) AS pharmacy_count
+    FROM Available_Stock
+    GROUP BY med_id
+) live ON live.med_id = mss.med_id
+WHERE live.total_stock != mss.total_stock
+   OR live.min_price != mss.min_price
+   OR live.pharmacy_count != mss.pharmacy_count;
+
+
+-- =====================================================================
+-- Test 12: Incremental cart triggers (T3-T5, T7, T11) vs full recompute
+-- =====================================================================
+-- Step 0: Seed carts were backfilled when the triggers were created.
+-- EXPECTED: 0 (no cart's maintained prescription count differs from its items)
+SELECT COUNT(*) AS mismatched_carts
+FROM Cart c
+WHERE c.prescription_item_count != (
+    SELECT COUNT(*) FROM Cart_Item ci JOIN Medicine m ON ci.med_id = m.med_id
+    WHERE ci.cart_id = c.cart_id AND m.prescription_required = TRUE
+);
+
+-- Step 1: Build a cart with several items, change one, remove one.
+CALL sp_add_cart_item(2, 1, 2); -- Paracetamol (OTC)
+CALL sp_add_cart_item(2, 4, 1); -- Insulin (needs prescription)
+CALL sp_add_cart_item(2, 1, 3); -- Paracetamol again: quantity 2 -> 5
+DELETE FROM Cart_Item WHERE cart_id = 2 AND med_id = 4;
+
+-- Step 2: The maintained values must equal a from-scratch calculation.
+-- EXPECTED: total_amount = fn_get_cart_total(2), requires_prescription = 0, prescription_item_count = 0
+SELECT total_amount, fn_get_cart_total(2) AS recomputed_total,
+       requires_prescription, prescription_item_count
+FROM Cart WHERE cart_id = 2;
+
+-- Step 3: Reprice Paracetamol at its pharmacy and make it prescription-only while it sits in the cart.
+SET @pharmacy = (SELECT assigned_pharmacy_id FROM Cart_Item WHERE cart_id = 2 AND med_id = 1);
+SET @old_price = (SELECT price FROM Available_Stock WHERE pharmacy_id = @pharmacy AND med_id = 1);
+UPDATE Available_Stock SET price = price + 5.00 WHERE pharmacy_id = @pharmacy AND med_id = 1;
+UPDATE Medicine SET prescription_required = TRUE WHERE med_id = 1;
+-- EXPECTED: total_amount = recomputed_total, requires_prescription = 1, prescription_item_count = 1
+SELECT total_amount, fn_get_cart_total(2) AS recomputed_total,
+       requires_prescription, prescription_item_count
+FROM Cart WHERE cart_id = 2;
+
+-- Step 4: Clean up before restoring the price and flag, so removal uses the changed values.
+DELETE FROM Cart_Item WHERE cart_id = 2;
+-- EXPECTED: 0.00, 0, 0
+SELECT total_amount, requires_prescription, prescription_item_count FROM Cart WHERE cart_id = 2;
+UPDATE Medicine SET prescription_required = FALSE WHERE med_id = 1;
+UPDATE Available_Stock SET price = @old_price WHERE pharmacy_id = @pharmacy AND med_id = 1;
+
+
+-- =====================================================================
+-- Test 13: sp_add_cart_items (Batch add-to-cart)
+-- =====================================================================
+-- Customer 2 (Priya, Bengaluru). P2 (Bengaluru) stocks Med 1, 4 and 5.
+-- Med 1 is listed twice, so its quantities are summed (1 + 2 = 3).
+CALL sp_add_cart_items(2, '[{"med_id": 1, "qty": 1}, {"med_id": 5, "qty": 2}, {"med_id": 1, "qty": 2}]');
+
+-- EXPECTED: Med 1 qty 3 and Med 5 qty 2, both assigned to P2
+SELECT * FROM Cart_Item WHERE cart_id = 2;
+-- EXPECTED: 3 * 22.00 + 2 * 50.00 = 166.00
+SELECT total_amount, fn_get_cart_total(2) AS recomputed_total FROM Cart WHERE cart_id = 2;
+
+-- Clean up
+DELETE FROM Cart_Item WHERE cart_id = 2;
+
+
+-- =====================================================================
+-- Test 14: sp_reorder (One-click reorder)
+-- =====================================================================
+-- Relies on Test 6 having created an order for Customer 3 (5 x Med 1).
+SET @reorder_id = (SELECT MAX(order_id) FROM Orders WHERE cust_id = 3);
+CALL sp_reorder(3, @reorder_id);
+-- EXPECTED: items_added = 1, message 'Order #... added to your cart'
+
+SELECT * FROM Cart_Item WHERE cart_id = 3; -- EXPECTED: Med 1, qty 5, assigned to a pharmacy with stock
+
+-- Another customer's order cannot be reordered.
+-- EXPECTED: Error "Order not found for this customer."
+CALL sp_reorder(2, @reorder_id);
+
+-- Clean up
+DELETE FROM Cart_Item WHERE cart_id = 3;
+
+
+-- =====================================================================
+-- Test 15: sp_reserve_cart_stock (Row-locked stock reservation)
+-- =====================================================================
+-- Step 1: A cart whose stock is all there reserves cleanly.
+START TRANSACTION;
+CALL sp_add_cart_item(2, 1, 2); -- Paracetamol, assigned to P2
+CALL sp_reserve_cart_stock(2);  -- EXPECTED: no error
+-- From a second session, this now blocks until the ROLLBACK below:
+--   UPDATE Available_Stock SET current_stock = current_stock - 1
+--   WHERE pharmacy_id = (SELECT assigned_pharmacy_id FROM Cart_Item WHERE cart_id = 2 AND med_id = 1) AND med_id = 1;
+ROLLBACK;
+
+-- Step 2: Stock taken after validation is caught under the lock.
+START TRANSACTION;
+CALL sp_add_cart_item(2, 1, 2);
+UPDATE Available_Stock SET current_stock = 1
+WHERE med_id = 1 AND pharmacy_id = (SELECT assigned_pharmacy_id FROM Cart_Item WHERE cart_id = 2 AND med_id = 1);
+-- EXPECTED: Error "Some items just sold out at their pharmacy. ..."
+CALL sp_reserve_cart_stock(2);
+ROLLBACK;
+
+
+-- =====================================================================
+-- Test 16: Status_Event triggers (T9, T10)
+-- =====================================================================
+-- Relies on Test 6 having created an order for Customer 3.
+SET @event_order = (SELECT MAX(order_id) FROM Orders WHERE cust_id = 3);
+SET @last_event = (SELECT COALESCE(MAX(event_id), 0) FROM Status_Event);
+
+UPDATE Sub_Order SET status = 'Shipped' WHERE order_id = @event_order AND sub_order_id = 1;
+UPDATE Sub_Order SET status = 'Shipped' WHERE order_id = @event_order AND sub_order_id = 1; -- no change, no event
+
+-- EXPECTED: exactly one new row: status 'Shipped', cust_id 3, the sub-order's pharmacy_id
+SELECT * FROM Status_Event WHERE event_id > @last_event;
+
+
+-- =====================================================================
+-- Test 17: sp_refresh_sales_rollups (Incremental reporting rollups)
+-- =====================================================================
+-- Step 1: Rebuild from scratch so the rollups can be compared with the raw tables.
+SET SQL_SAFE_UPDATES = 0;
+DELETE FROM Daily_Pharmacy_Sales;
+DELETE FROM Daily_Medicine_Sales;
+DELETE FROM Report_Watermark;
+DELETE FROM Report_Folded_Order;
+SET SQL_SAFE_UPDATES = 1;
+CALL sp_refresh_sales_rollups(); -- EXPECTED: advanced = 1
+
+-- EXPECTED: identical totals per pharmacy
+SELECT p.pharm_name, SUM(d.sub_order_count) AS rollup_orders, SUM(d.total_sales) AS rollup_sales
+FROM Daily_Pharmacy_Sales d JOIN Pharmacy p ON d.pharmacy_id = p.pharmacy_id
+GROUP BY p.pharm_name;
+SELECT p.pharm_name, COUNT(so.sub_order_id) AS raw_orders, SUM(so.sub_total) AS raw_sales
+FROM Sub_Order so JOIN Orders o ON so.order_id = o.order_id JOIN Pharmacy p ON so.pharmacy_id = p.pharmacy_id
+GROUP BY p.pharm_name;
+
+-- Step 2: A second run with no new orders changes nothing.
+CALL sp_refresh_sales_rollups(); -- EXPECTED: advanced = 0, same last_order_id
+
+-- Step 3: An order whose checkout commits after one with a higher id is still
+-- counted, exactly once. Recent orders stay tracked in Report_Folded_Order.
+SET @late_order_id = (SELECT MAX(order_id) FROM Orders) + 1;
+INSERT INTO Orders (order_id, cust_id, total_amount) VALUES (@late_order_id + 1, 1, 10.00);
+INSERT INTO Sub_Order (order_id, sub_order_id, pharmacy_id, sub_total, status)
+VALUES (@late_order_id + 1, 1, 1, 10.00, 'Processing');
+CALL sp_refresh_sales_rollups(); -- EXPECTED: advanced = 1 (the higher id first)
+INSERT INTO Orders (order_id, cust_id, total_amount) VALUES (@late_order_id, 1, 20.00);
+INSERT INTO Sub_Order (order_id, sub_order_id, pharmacy_id, sub_total, status)
+VALUES (@late_order_id, 1, 1, 20.00, 'Processing');
+CALL sp_refresh_sales_rollups(); -- EXPECTED: advanced = 1 (the late one)
+CALL sp_refresh_sales_rollups(); -- EXPECTED: advanced = 0
+SELECT COUNT(*) AS tracked FROM Report_Folded_Order
+WHERE order_id IN (@late_order_id, @late_order_id + 1); -- EXPECTED: 2
+-- EXPECTED: rollup and raw totals still identical (repeat the Step 1 queries)
+SELECT SUM(sub_order_count) AS rollup_orders, SUM(total_sales) AS rollup_sales FROM Daily_Pharmacy_Sales;
+SELECT COUNT(*) AS raw_orders, SUM(sub_total) AS raw_sales FROM Sub_Order;
+
+-- Step 4: Clean up and rebuild.
+DELETE FROM Orders WHERE order_id IN (@late_order_id, @late_order_id + 1);
+SET SQL_SAFE_UPDATES = 0;
+DELETE FROM Daily_Pharmacy_Sales;
+DELETE FROM Daily_Medicine_Sales;
+DELETE FROM Report_Watermark;
+DELETE FROM Report_Folded_Order;
+SET SQL_SAFE_UPDATES = 1;
+CALL sp_refresh_sales_rollups();
+
+
+-- =====================================================================
+-- Test 18: sp_allocate_cart (Cart-level pharmacy allocation)
+-- =====================================================================
+-- Customer 1 (Aarav, Mumbai). P1 (Colaba, ~20 km away) stocks Med 1 and 3.
+-- A new pharmacy next door stocks only Med 1, at P1's price.
+START TRANSACTION;
+INSERT INTO Pharmacy (license_no, pharm_name, address_city, address_state, latitude, longitude)
+VALUES ('LIC-T18', 'Corner Chemist Mumbai', 'Mumbai', 'Maharashtra', 19.0760, 72.8777);
+SET @corner = LAST_INSERT_ID();
+INSERT INTO Available_Stock (pharmacy_id, med_id, current_stock, price) VALUES (@corner, 1, 10, 20.00);
+
+-- Step 1: Alone, Paracetamol goes to the pharmacy next door.
+CALL sp_add_cart_item(1, 1, 2);
+SELECT med_id, assigned_pharmacy_id FROM Cart_Item WHERE cart_id = 1; -- EXPECTED: Med 1 -> @corner
+
+-- Step 2: Cetirizine is only at P1. Nearest-per-item would split the cart
+-- over two pharmacies; one stop at P1 is cheaper overall.
+CALL sp_add_cart_item(1, 3, 1);
+-- EXPECTED: Med 1 and Med 3 both assigned to pharmacy 1
+SELECT med_id, assigned_pharmacy_id FROM Cart_Item WHERE cart_id = 1;
+-- EXPECTED: total still matches a full recompute (2 * 20.00 + 18.00 = 58.00)
+SELECT total_amount, fn_get_cart_total(1) AS recomputed_total FROM Cart WHERE cart_id = 1;
+ROLLBACK;
+
+
+-- =====================================================================
+-- Test 19: sp_substitute_cart_item (Substitute-aware fulfilment)
+-- =====================================================================
+-- Customer 2 (Bengaluru). Cetirizine (Med 3) substitutes Paracetamol (Med 1).
+START TRANSACTION;
+CALL sp_add_cart_item(2, 3, 1);
+CALL sp_add_cart_item(2, 1, 2);
+
+-- Step 1: Swapping moves the quantity onto the substitute already in the cart.
+CALL sp_substitute_cart_item(2, 1, 3);
+SELECT med_id, quantity, assigned_pharmacy_id FROM Cart_Item WHERE cart_id = 2; -- EXPECTED: only Med 3, qty 3
+SELECT total_amount, fn_get_cart_total(2) AS recomputed_total FROM Cart WHERE cart_id = 2; -- EXPECTED: equal
+
+-- Step 2: An item that is not in the cart cannot be swapped.
+-- EXPECTED: Error "That medicine is no longer in your cart."
+CALL sp_substitute_cart_item(2, 1, 3);
+ROLLBACK;
+
+
+-- =====================================================================
+-- Test 20: Prescription leases (sp_verify_prescription work queue)
+-- =====================================================================
+-- Relies on Test 9's order for cust_id = 1. Doctor 1 holds a lease.
+START TRANSACTION;
+INSERT INTO Prescription (order_id, cust_id, file_path, status, lease_doc_id, lease_expires_at)
+VALUES (@order_id_for_presc, 1, '/uploads/presc_lease.pdf', 'To Be Verified', 1, NOW() + INTERVAL 10 MINUTE);
+SET @leased_presc_id = LAST_INSERT_ID();
+
+-- Step 1: Another doctor cannot verify it while the lease is live.
+CALL sp_verify_prescription(@leased_presc_id, 2, 'Verified'); -- EXPECTED: rows_updated = 0
+
+-- Step 2: The lease holder can, and the lease is cleared.
+CALL sp_verify_prescription(@leased_presc_id, 1, 'Verified'); -- EXPECTED: rows_updated = 1
+SELECT status, assigned_doc_id, lease_doc_id FROM Prescription WHERE presc_id = @leased_presc_id;
+-- EXPECTED: 'Verified', 1, NULL
+
+-- Step 3: An expired lease is open to everyone.
+INSERT INTO Prescription (order_id, cust_id, file_path, status, lease_doc_id, lease_expires_at)
+VALUES (@order_id_for_presc, 1, '/uploads/presc_expired.pdf', 'To Be Verified', 1, NOW() - INTERVAL 1 MINUTE);
+CALL sp_verify_prescription(LAST_INSERT_ID(), 2, 'Rejected'); -- EXPECTED: rows_updated = 1
+ROLLBACK;
@@ -0,0 +1,28 @@
+# Gunicorn settings for `gunicorn wsgi:application`.
+# Any value can be overridden on the command line, e.g. `--workers 4`.
+import multiprocessing
+import os
+
+bind = os.environ.get('MEDIQUICK_BIND', '0.0.0.0:5000')
+
+# One process per core (plus one) for CPU work, a few threads each for
+# requests waiting on MySQL. Keep threads <= db_pool_config['pool_size'].
+workers = int(os.environ.get('MEDIQUICK_WORKERS', multiprocessing.cpu_count() + 1))
+worker_class = 'gthread'
+# Live-update streams (/api/events) hold a thread each; the app caps them at
+# MEDIQUICK_SSE_STREAMS (default 2) per worker, so keep threads above that.
+# Dashboards beyond workers x streams poll instead (see README).
+threads = int(os.environ.get('MEDIQUICK_THREADS', 4))
+
+# Workers import the app themselves, so pools and background threads are
+# created after the fork rather than shared with the master.
+preload_app = False
+
+timeout = 60            # Streamed reports can take a while
+graceful_timeout = 30
+keepalive = 5
+max_requests = 5000     # Recycle workers periodically
+max_requests_jitter = 500
+
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,12 @@
+"""
+Production WSGI entry point for MediQuick.
+
+    pip install gunicorn
+    gunicorn wsgi:application          # settings come from gunicorn.conf.py
+
+Each worker process imports this module on its own (preload_app is off), so
+each gets its own connection pool, compiled templates and warm read cache.
+"""
+from app import create_app
+
+application = create_app()